@@ -0,0 +1,5 @@
+"""
+order_engine.py の計測用（合成データ生成 + ベンチマーク実行）
+
+    python -m benchmarks.run --sizes 1k 10k 100k
+"""
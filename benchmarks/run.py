@@ -0,0 +1,118 @@
+"""
+order_engine.py のベンチマーク
+
+ステージごとの実行時間（wall）とピークメモリ（tracemalloc）を表示する。
+tracemalloc は計測対象を遅くするので、時間計測とメモリ計測は別々に1回ずつ回す。
+
+    python -m benchmarks.run                      # 1k / 10k / 100k
+    python -m benchmarks.run --sizes 1m --modes order_ai
+"""
+
+import argparse
+import time
+import tracemalloc
+from datetime import date
+
+from benchmarks.synthetic import generate_tables, parse_size
+from order_engine import (
+    PurchaseIndex,
+    build_price_improve_list,
+    compute_order_results,
+    current_purchase_prices,
+    finalize_order_results,
+    prepare_order_inputs,
+    prepare_price_improve_inputs,
+)
+
+MODES = ("order_ai", "price_improve")
+
+
+class StageTimer:
+    """ステージごとに wall time（trace_memory=False）または peak memory（True）を記録する"""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.rows = []
+
+    def run(self, label, func, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            peak = 0
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            self.rows.append((label, elapsed, peak))
+
+
+def bench_order_ai(timer: StageTimer, tables: dict, today: date):
+    df_sales, df_master, df_warehouse, df_purchase, recent_jans = timer.run(
+        "prepare", prepare_order_inputs,
+        tables["sales"], tables["purchase_data"], tables["item_master"],
+        tables["warehouse_stock"], tables["purchase_history"], today=today,
+    )
+    index = timer.run("purchase_index", PurchaseIndex, df_purchase)
+    results = timer.run(
+        "compute", compute_order_results,
+        df_sales, df_master, df_warehouse, index, recent_jans,
+    )
+    out = timer.run("finalize", finalize_order_results, results, df_master, tables["benten_stock"])
+    return len(out)
+
+
+def bench_price_improve(timer: StageTimer, tables: dict, today: date):
+    df_sales, df_purchase, df_item = timer.run(
+        "prepare", prepare_price_improve_inputs,
+        tables["sales"], tables["purchase_data"], tables["item_master"],
+    )
+    index = timer.run("purchase_index", PurchaseIndex, df_purchase)
+    current = timer.run("current_price", current_purchase_prices, df_sales, index)
+    out = timer.run("build_list", build_price_improve_list, current, df_purchase, df_item)
+    return len(out)
+
+
+BENCHES = {
+    "order_ai": bench_order_ai,
+    "price_improve": bench_price_improve,
+}
+
+
+def print_report(size_label, mode, timing: StageTimer, memory: StageTimer, n_out):
+    print(f"\n== {mode} / {size_label} SKUs ({n_out:,} rows out) ==")
+    print(f"{'stage':<16}{'wall [s]':>12}{'peak [MiB]':>14}")
+    for (label, elapsed, _), (_, _, peak) in zip(timing.rows, memory.rows):
+        print(f"{label:<16}{elapsed:>12.3f}{peak / 2**20:>14.1f}")
+    total = sum(r[1] for r in timing.rows)
+    print(f"{'total':<16}{total:>12.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="order_engine benchmark (synthetic data)")
+    parser.add_argument("--sizes", nargs="+", default=["1k", "10k", "100k"], help="1k / 10k / 100k / 1m / 件数")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    today = date.today()
+    for size in args.sizes:
+        n_skus = parse_size(size)
+
+        timing, memory = StageTimer(), StageTimer(trace_memory=True)
+        tables = timing.run("generate", generate_tables, n_skus, seed=args.seed, today=today)
+        memory.run("generate", generate_tables, n_skus, seed=args.seed, today=today)
+
+        for mode in args.modes:
+            mode_timing, mode_memory = StageTimer(), StageTimer(trace_memory=True)
+            mode_timing.rows.append(timing.rows[0])
+            mode_memory.rows.append(memory.rows[0])
+            n_out = BENCHES[mode](mode_timing, tables, today)
+            BENCHES[mode](mode_memory, tables, today)
+            print_report(size, mode, mode_timing, mode_memory, n_out)
+
+
+if __name__ == "__main__":
+    main()
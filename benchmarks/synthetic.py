@@ -0,0 +1,128 @@
+"""
+合成データ生成
+
+Supabase の sales / purchase_data / item_master / warehouse_stock /
+purchase_history / benten_stock と同じ列構成の DataFrame を SKU 数指定で作る。
+値の分布はざっくり本番に寄せている（ランク比率、ロット候補、上海メモ、直近発注など）。
+"""
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+SIZES = {
+    "1k": 1_000,
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+}
+
+RANKS = np.array(["Aランク", "Aランク★", "Bランク", "Bランク★", "Cランク", "TEST", "NEW", None], dtype=object)
+RANK_WEIGHTS = [0.08, 0.02, 0.15, 0.05, 0.45, 0.1, 0.05, 0.1]
+HANDLING = np.array(["取扱中", "取扱中", "取扱中", "取扱中止", "新規"], dtype=object)
+SUPPLIERS = np.array([f"{i:04d} 仕入先{i}" for i in range(1, 41)], dtype=object)
+LOTS = np.array([1, 2, 3, 6, 10, 12, 24, 36, 48, 72, 144])
+
+
+def parse_size(size) -> int:
+    """ "10k" / "1m" / "5000" → SKU数 """
+    s = str(size).strip().lower()
+    if s in SIZES:
+        return SIZES[s]
+    return int(s.replace("_", ""))
+
+
+def generate_tables(n_skus: int, seed: int = 0, today: date = None) -> dict:
+    """
+    n_skus 件の SKU を持つテーブル一式を返す。
+    return: {"sales", "purchase_data", "item_master", "warehouse_stock", "purchase_history", "benten_stock"}
+    """
+    rng = np.random.default_rng(seed)
+    today = today or date.today()
+
+    # 本番同様、商品コードは sales.jan / warehouse_stock.product_code と同じ値
+    jans = (4900000000000 + np.arange(n_skus)).astype(str).astype(object)
+    codes = jans
+
+    # item_master（全SKU）
+    item_master = pd.DataFrame({
+        "id": np.arange(1, n_skus + 1),
+        "jan": jans,
+        "商品コード": codes,
+        "商品名": "商品" + pd.Series(np.arange(n_skus)).astype(str),
+        "メーカー名": "メーカー" + pd.Series(rng.integers(0, max(n_skus // 50, 1), n_skus)).astype(str),
+        "ランク": rng.choice(RANKS, n_skus, p=RANK_WEIGHTS),
+        "取扱区分": rng.choice(HANDLING, n_skus),
+        "ケース入数": rng.choice([6, 12, 24, 48], n_skus),
+        "発注ロット": rng.choice(LOTS, n_skus),
+        "発注済": rng.integers(0, 20, n_skus) * (rng.random(n_skus) < 0.3),
+        "purchase_cost": rng.integers(50, 3000, n_skus),
+        "average_cost": rng.integers(50, 3000, n_skus),
+    })
+
+    # sales（販売実績のあるSKU = 約8割）
+    sold_mask = rng.random(n_skus) < 0.8
+    n_sales = int(sold_mask.sum())
+    quantity_sold = rng.negative_binomial(2, 0.1, n_sales)
+    sales = pd.DataFrame({
+        "id": np.arange(1, n_sales + 1),
+        "jan": jans[sold_mask],
+        "handling_type": rng.choice(HANDLING, n_sales),
+        "quantity_sold": quantity_sold,
+        "stock_total": rng.integers(0, 60, n_sales),
+        "stock_available": rng.integers(0, 50, n_sales),
+        "stock_ordered": rng.integers(0, 20, n_sales) * (rng.random(n_sales) < 0.3),
+    })
+
+    # purchase_data（SKUあたり 0〜4 件の仕入候補）
+    n_options = rng.integers(0, 5, n_skus)
+    opt_idx = np.repeat(np.arange(n_skus), n_options)
+    n_purchase = len(opt_idx)
+    base_price = rng.integers(50, 3000, n_skus)[opt_idx]
+    price = (base_price * rng.uniform(0.85, 1.15, n_purchase)).round(1)
+    price[rng.random(n_purchase) < 0.03] = np.nan
+    purchase_data = pd.DataFrame({
+        "id": np.arange(1, n_purchase + 1),
+        "jan": jans[opt_idx],
+        "supplier": rng.choice(SUPPLIERS, n_purchase),
+        "order_lot": rng.choice(np.append(LOTS, 0), n_purchase),
+        "price": price,
+    })
+
+    # warehouse_stock（JD在庫：約9割のSKU）
+    wh_mask = rng.random(n_skus) < 0.9
+    n_wh = int(wh_mask.sum())
+    warehouse_stock = pd.DataFrame({
+        "product_code": jans[wh_mask],
+        "jan": jans[wh_mask],
+        "stock_available": rng.integers(0, 80, n_wh),
+    })
+
+    # benten_stock（弁天在庫：約3割のSKU）
+    bt_mask = rng.random(n_skus) < 0.3
+    benten_stock = pd.DataFrame({
+        "jan": jans[bt_mask],
+        "stock": rng.integers(0, 40, int(bt_mask.sum())),
+    })
+
+    # purchase_history（SKU数の半分程度。上海メモ・本日/昨日の発注を含む）
+    n_hist = max(n_skus // 2, 1)
+    days_ago = rng.integers(0, 60, n_hist)
+    purchase_history = pd.DataFrame({
+        "id": np.arange(1, n_hist + 1),
+        "jan": rng.choice(jans, n_hist),
+        "quantity": rng.integers(1, 100, n_hist),
+        "memo": rng.choice(np.array(["", "上海", "定番補充", None], dtype=object), n_hist, p=[0.6, 0.1, 0.25, 0.05]),
+        "order_date": (pd.Timestamp(today) - pd.to_timedelta(days_ago, unit="D")).strftime("%Y-%m-%d"),
+        "order_id": "PO" + pd.Series(np.arange(n_hist)).astype(str),
+    })
+
+    return {
+        "sales": sales,
+        "purchase_data": purchase_data,
+        "item_master": item_master,
+        "warehouse_stock": warehouse_stock,
+        "purchase_history": purchase_history,
+        "benten_stock": benten_stock,
+    }
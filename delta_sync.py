@@ -0,0 +1,81 @@
+"""
+差分アップロード（全削除 → 全件再投入の代わりに、変わった行だけを書き込む）
+
+新しいデータと現在のサーバ側の内容を、キー列ごとの行ハッシュで比較し、
+追加・更新は upsert（on_conflict=キー列）、消えたキーは DELETE で送る。
+現在の内容はサーバから取得するか、手元のスナップショットを渡す。
+main.py の csv_upload モードから呼ぶ。
+"""
+
+import pandas as pd
+
+from supabase_client import SupabaseError, in_filter
+
+DELETE_CHUNK = 200
+
+
+def _normalized(df: pd.DataFrame, cols, numeric_cols) -> pd.DataFrame:
+    """ハッシュ用に列を揃える（数値は数値として、それ以外は前後空白を除いた文字列、欠損は ""）"""
+    out = pd.DataFrame(index=df.index)
+    for c in cols:
+        s = df[c] if c in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if c in numeric_cols:
+            s = pd.to_numeric(s, errors="coerce").astype("float64")
+            out[c] = s.map(repr).where(s.notna(), "")
+        else:
+            out[c] = s.astype(object).where(s.notna(), "").astype(str).str.strip()
+    return out
+
+
+def row_hashes(df: pd.DataFrame, key_col: str, value_cols, numeric_cols=()) -> pd.Series:
+    """キー → 行ハッシュ（uint64）。キーが重複している場合は後の行"""
+    norm = _normalized(df, value_cols, set(numeric_cols))
+    hashes = pd.util.hash_pandas_object(norm, index=False)
+    keys = df[key_col].astype(str).str.strip()
+    return pd.Series(hashes.to_numpy(), index=keys.to_numpy())[lambda s: ~s.index.duplicated(keep="last")]
+
+
+def diff_rows(new: pd.DataFrame, current: pd.DataFrame, key_col: str, value_cols, numeric_cols=()):
+    """
+    new と current を比較して (追加行, 更新行, 削除キーのリスト) を返す。
+    value_cols: 比較する列（updated_at のように毎回変わる列は含めない）
+    """
+    new = new.drop_duplicates(subset=[key_col], keep="last")
+    new_hash = row_hashes(new, key_col, value_cols, numeric_cols)
+    if current is None or current.empty:
+        return new, new.iloc[0:0], []
+    cur_hash = row_hashes(current, key_col, value_cols, numeric_cols)
+
+    keys = new[key_col].astype(str).str.strip().to_numpy()
+    old = cur_hash.reindex(keys)
+    is_insert = old.isna().to_numpy()
+    is_update = ~is_insert & (old.to_numpy() != new_hash.reindex(keys).to_numpy())
+
+    deleted = cur_hash.index.difference(pd.Index(keys)).tolist()
+    return new[is_insert], new[is_update], deleted
+
+
+def apply_delta(client, table: str, new: pd.DataFrame, key_col: str, value_cols, numeric_cols=(), current=None, progress=None) -> dict:
+    """
+    差分だけを書き込む。current を省略するとサーバから key_col + value_cols を取得して比較する。
+    progress: bulk_insert にそのまま渡す進捗コールバック
+    失敗時は SupabaseError（途中までの書き込みは残る）。戻り値: 件数の dict
+    """
+    if current is None:
+        current = client.fetch_table(table, columns=[key_col] + list(value_cols))
+
+    inserts, updates, deleted = diff_rows(new, current, key_col, value_cols, numeric_cols)
+    changed = pd.concat([inserts, updates], ignore_index=True)
+    if not changed.empty:
+        client.bulk_insert(table, changed, prefer="resolution=merge-duplicates", on_conflict=key_col, progress=progress)
+    for i in range(0, len(deleted), DELETE_CHUNK):
+        res = client.delete(table, [(key_col, in_filter(deleted[i:i + DELETE_CHUNK]))])
+        if res.status_code >= 300:
+            raise SupabaseError(table, res.status_code, res.text)
+
+    return {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deleted),
+        "unchanged": len(new.drop_duplicates(subset=[key_col])) - len(inserts) - len(updates),
+    }
@@ -0,0 +1,193 @@
+"""
+DuckDB による集計（結合・絞り込み・集約を SQL でまとめて実行し、表示する最終結果だけを返す）
+
+monthly_sales / rank_check / store_profit / daily_sales で、pandas の処理の代わりに選べる（モードごとに切り替え）。
+スナップショット（snapshot_store の Parquet）があるテーブルはファイルを直接読み（必要な列だけ）、
+それ以外のテーブルは TableCache から、item 360 や期間で絞った明細などは渡された DataFrame をそのまま参照する。
+DuckDB は内部でマルチスレッドで実行する（threads で上限を指定。未指定は CPU 数）。
+
+main.py では st.cache_resource で1つだけ作る。duckdb が無い環境では使わない（AVAILABLE=False）。
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+try:
+    import pyarrow  # noqa: F401（結果を Arrow 経由で DataFrame にする）
+    ARROW = True
+except ImportError:
+    ARROW = False
+
+# jan_codes.normalize_jan（既定の引数）と同じ規則の SQL マクロ
+#   欠損 → ""、全角数字・全角ピリオド → 半角、空白を除去、"….0" の ".0" を除去
+# 正規表現は重いので、各クエリではユニークな値（または元の値ごとの集計結果）にだけ適用する
+JAN_MACRO = r"""
+create or replace macro jan_code(x) as
+  regexp_replace(
+    regexp_replace(translate(coalesce(cast(x as varchar), ''), '０１２３４５６７８９．', '0123456789.'), '[\s\p{Z}]+', '', 'g'),
+    '^(\d+)\.0+$', '\1'
+  )
+"""
+
+def _int(col):
+    """数値列を整数へ（文字列・欠損は 0。pandas の to_numeric(...).fillna(0).astype(int) と同じ）"""
+    return f"cast(trunc(coalesce(try_cast({col} as double), 0)) as bigint)"
+
+
+class QueryError(Exception):
+    """DuckDB での実行に失敗（呼び出し側は pandas の処理に切り替える）"""
+
+
+class QueryEngine:
+    def __init__(self, table_cache, store=None, threads: int = None):
+        """
+        table_cache: スナップショットが無いテーブルの取得に使う（TableCache）
+        store: SnapshotStore（None ならすべて TableCache から）
+        """
+        self.table_cache = table_cache
+        self.store = store
+        config = {"threads": int(threads)} if threads else {}
+        self._db = duckdb.connect(":memory:", config=config)
+        self._db.execute(JAN_MACRO)
+        self._lock = threading.Lock()
+
+    # ---------- 公開 ----------
+    def query(self, sql: str, params=None, tables=None, frames=None) -> pd.DataFrame:
+        """
+        tables: SQL 中の名前 → (テーブル名, 使う列)。スナップショットがあれば Parquet、無ければ TableCache から
+        frames: SQL 中の名前 → DataFrame（コピーせずに参照する）
+        """
+        with self._lock:
+            # 接続はスレッドセーフではないので、実行ごとに同じ DB へのカーソル（別接続）を作る
+            cur = self._db.cursor()
+        try:
+            for name, (table, columns) in (tables or {}).items():
+                path = self._parquet(cur, table, columns)
+                if path is not None:
+                    cur.execute(f"create or replace temp view {name} as select * from read_parquet('{path}')")
+                else:
+                    cur.register(name, self.table_cache.get(table, columns))
+            for name, df in (frames or {}).items():
+                cur.register(name, df)
+            result = cur.execute(sql, params or {})
+            if not ARROW:
+                return result.df()
+            # Arrow 経由の方が文字列列の変換が速い（duckdb 1.5 から to_arrow_table）
+            to_arrow = getattr(result, "to_arrow_table", None) or result.fetch_arrow_table
+            return to_arrow().to_pandas()
+        except duckdb.Error as e:
+            raise QueryError(str(e)) from e
+        finally:
+            cur.close()
+
+    # ---------- 内部 ----------
+    def _parquet(self, cur, table, columns):
+        """スナップショットの Parquet のパス（対象外・列が足りないときは None）"""
+        if self.store is None or table not in self.store:
+            return None
+        path = self.store.parquet_path(table, columns)
+        names = {row[0] for row in cur.execute("select name from parquet_schema(?)", [path]).fetchall()}
+        return path if all(c in names for c in columns or []) else None
+
+
+# ==========================================================
+# モードごとの集計
+# ==========================================================
+def monthly_sales(engine: QueryEngine, df_master: pd.DataFrame) -> pd.DataFrame:
+    """
+    sales（商品コードで正規化）と商品マスタ（商品コードで一意に済み。jan→JAN、利用可能在庫 列あり）を結合し、
+    販売数 > 0 の行だけを返す
+    """
+    sql = f"""
+        with s as (
+          select cast(jan as varchar) as raw,
+                 {_int("quantity_sold")} as 販売数,
+                 {_int("stock_ordered")} as 発注済
+          from sales
+          where {_int("quantity_sold")} > 0
+        ),
+        k as (
+          select raw, jan_code(raw) as 商品コード from (select distinct raw from s)
+        )
+        select
+          k.商品コード, m.JAN as jan, m.ランク, m.メーカー名, m.商品名, m.取扱区分,
+          s.販売数, cast(coalesce(m.利用可能在庫, 0) as bigint) as 利用可能, s.発注済
+        from s
+        join k on k.raw is not distinct from s.raw
+        left join master m on m.商品コード = k.商品コード
+    """
+    return engine.query(
+        sql,
+        tables={"sales": ("sales", ["jan", "quantity_sold", "stock_ordered"])},
+        frames={"master": df_master},
+    )
+
+
+def rank_check(engine: QueryEngine, df_items: pd.DataFrame, ranks, name="", maker=None,
+               alert_1_0=False, alert_1_2=False) -> pd.DataFrame:
+    """
+    sales を JAN ごとに集計（実績30日）して商品（JAN で一意に済み。rank_check の base_cols）に結合し、
+    発注アラートを付けて条件で絞り込む。行は df_items の順（pandas の left merge と同じ）。
+    name は大文字小文字を区別しない部分一致（正規表現としては扱わない）
+    """
+    where = ["list_contains($ranks, cast(ランク as varchar))"]
+    params = {"ranks": list(ranks)}
+    if name:
+        where.append("contains(lower(商品名), lower($name))")
+        params["name"] = name
+    if maker is not None:
+        where.append("cast(メーカー名 as varchar) = $maker")
+        params["maker"] = maker
+    if alert_1_0:
+        where.append("\"発注アラート1.0\"")
+    if alert_1_2:
+        where.append("\"発注アラート1.2\"")
+
+    sql = f"""
+        with s as (
+          select jan_code(raw) as JAN, sum(実績) as 実績
+          from (
+            select cast(jan as varchar) as raw, sum(try_cast(quantity_sold as double)) as 実績
+            from sales group by 1
+          )
+          group by 1
+        )
+        select * exclude (_row) from (
+          select
+            i._row, i.JAN, i.商品名, i.メーカー名, i.ランク, i.ケース入数, i.発注ロット,
+            coalesce(s.実績, 0) as "実績（30日）",
+            i.JD在庫, i.弁天在庫, i.発注済, i.最安原価,
+            coalesce(s.実績, 0) > (i.JD在庫 + i.弁天在庫 + i.発注済) as "発注アラート1.0",
+            coalesce(s.実績, 0) * 1.2 > (i.JD在庫 + i.弁天在庫 + i.発注済) as "発注アラート1.2"
+          from items i
+          left join s on s.JAN = i.JAN
+        )
+        where {" and ".join(where)}
+        order by _row
+    """
+    return engine.query(
+        sql, params,
+        tables={"sales": ("sales", ["jan", "quantity_sold"])},
+        frames={"items": df_items.assign(_row=np.arange(len(df_items)))},
+    )
+
+
+def store_summary(engine: QueryEngine, df_lines: pd.DataFrame) -> pd.DataFrame:
+    """明細行を店舗ごとに合計（qty / revenue / defined_cost / gross_profit。店舗順）"""
+    sql = f"""
+        select store,
+               cast(sum({_int("qty")}) as bigint) as qty,
+               cast(sum({_int("revenue")}) as bigint) as revenue,
+               cast(sum({_int("defined_cost")}) as bigint) as defined_cost,
+               cast(sum({_int("gross_profit")}) as bigint) as gross_profit
+        from lines where store is not null group by store order by store
+    """
+    return engine.query(sql, frames={"lines": df_lines})
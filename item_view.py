@@ -0,0 +1,132 @@
+"""
+item 360（商品マスタ + JD在庫 + 弁天在庫 + 上海控除後の発注済）の結合済みビュー
+
+search_item / monthly_sales / rank_check / order_ai が共通で使う。
+元の4テーブルは TableCache から取り、どれかのスナップショットが入れ替わったとき
+（書き込みによる破棄・TTL 後の再取得）だけ作り直す。モードを切り替えても再取得・再結合しない。
+
+main.py では st.cache_resource で1つだけ作る。返す DataFrame は全セッションで共有しているので、
+呼び出し側で変更しないこと（列を選んでから、またはコピーしてから加工する）。
+"""
+
+import threading
+
+import pandas as pd
+
+from jan_codes import normalize_jan
+
+# 元テーブルと使う列（TableCache のキーになるので、各モードの射影とは別に固定）
+SOURCES = {
+    "item_master": [
+        "jan", "商品コード", "商品名", "メーカー名", "ランク", "取扱区分",
+        "ケース入数", "発注ロット", "重量", "発注済", "average_cost", "purchase_cost",
+    ],
+    "warehouse_stock": ["product_code", "jan", "stock_available"],
+    "benten_stock": ["jan", "stock"],
+    "purchase_history": ["jan", "quantity", "memo"],
+}
+
+# 値の種類が少ない文字列列 → category
+CATEGORY_COLUMNS = ["メーカー名", "ランク", "取扱区分"]
+# 空欄を残す整数列 → Int32
+NULLABLE_INT_COLUMNS = ["ケース入数", "発注ロット", "重量"]
+
+
+def _first_values(df: pd.DataFrame, key: str, value: str) -> pd.Series:
+    """key ごとに先頭行の value（index=正規化済みの key）"""
+    if df is None or df.empty or key not in df.columns or value not in df.columns:
+        return pd.Series(dtype="float64")
+    out = pd.DataFrame({key: normalize_jan(df[key]), value: pd.to_numeric(df[value], errors="coerce")})
+    out = out[out[key] != ""]
+    return out.drop_duplicates(subset=[key], keep="first").set_index(key)[value]
+
+
+def build_item_360(df_master, df_warehouse, df_benten, df_history) -> pd.DataFrame:
+    """
+    item_master の1行 = 1行。追加する列:
+      JD在庫          : warehouse_stock.stock_available（product_code を 商品コード で照合。monthly_sales）
+      JD在庫_JAN      : 同上（product_code を JAN で照合。search_item）
+      JD在庫_倉庫JAN  : 同上（warehouse_stock.jan を JAN で照合。rank_check）
+      弁天在庫        : benten_stock.stock（JAN で照合）
+      上海数量        : purchase_history のうち memo に「上海」を含む数量の合計（JAN ごと）
+      発注済_修正後   : 発注済 − 上海数量（0 未満は 0）
+    JD在庫 の照合キーはモードごとに従来のまま（照合できない商品は 0）。
+    商品名・ランクは元の値のまま（欠損は欠損のまま。ランクの空白除去などはモード側で行う）。
+    """
+    df = df_master.copy() if df_master is not None else pd.DataFrame()
+    for c in SOURCES["item_master"]:
+        if c not in df.columns:
+            df[c] = pd.NA
+
+    df["jan"] = normalize_jan(df["jan"])
+    df["商品コード"] = normalize_jan(df["商品コード"])
+
+    # JD在庫
+    stock = _first_values(df_warehouse, "product_code", "stock_available")
+    stock_by_jan = _first_values(df_warehouse, "jan", "stock_available")
+    df["JD在庫"] = df["商品コード"].map(stock).fillna(0).round().astype("int32")
+    df["JD在庫_JAN"] = df["jan"].map(stock).fillna(0).round().astype("int32")
+    df["JD在庫_倉庫JAN"] = df["jan"].map(stock_by_jan).fillna(0).round().astype("int32")
+
+    # 弁天在庫
+    benten = _first_values(df_benten, "jan", "stock")
+    df["弁天在庫"] = df["jan"].map(benten).fillna(0).round().astype("int32")
+
+    # 発注済（上海分を控除）
+    shanghai = pd.Series(dtype="float64")
+    if df_history is not None and not df_history.empty:
+        memo = df_history["memo"].astype(str)
+        hist = df_history[memo.str.contains("上海", na=False)]
+        shanghai = (
+            pd.to_numeric(hist["quantity"], errors="coerce").fillna(0)
+            .groupby(normalize_jan(hist["jan"])).sum()
+        )
+    df["発注済"] = pd.to_numeric(df["発注済"], errors="coerce").fillna(0).round().astype("int32")
+    df["上海数量"] = df["jan"].map(shanghai).fillna(0).round().astype("int32")
+    df["発注済_修正後"] = (df["発注済"] - df["上海数量"]).clip(lower=0).astype("int32")
+
+    # 省メモリの型
+    for c in NULLABLE_INT_COLUMNS:
+        df[c] = pd.to_numeric(df[c], errors="coerce").round().astype("Int32")
+    for c in ["average_cost", "purchase_cost"]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    for c in CATEGORY_COLUMNS:
+        df[c] = df[c].astype("category")
+
+    return df.reset_index(drop=True)
+
+
+class ItemView:
+    def __init__(self, table_cache):
+        self.table_cache = table_cache
+        self._sources = None
+        self._frame = None
+        self._lock = threading.Lock()
+        # 作り直しは同時に1回だけ
+        self._build_lock = threading.Lock()
+
+    def peek(self):
+        """作成済みで、元のスナップショットが変わっていなければそれを返す。無ければ None（取得・作成はしない）"""
+        with self._lock:
+            sources, frame = self._sources, self._frame
+        if sources is None:
+            return None
+        for table, columns in SOURCES.items():
+            if self.table_cache.peek(table, columns) is not sources[table]:
+                return None
+        return frame
+
+    def get(self) -> pd.DataFrame:
+        """item 360 を返す（元テーブルの取得に失敗したら例外）"""
+        with self._build_lock:
+            sources = {table: self.table_cache.get(table, columns) for table, columns in SOURCES.items()}
+            with self._lock:
+                if self._sources is not None and all(sources[t] is self._sources[t] for t in SOURCES):
+                    return self._frame
+            frame = build_item_360(
+                sources["item_master"], sources["warehouse_stock"],
+                sources["benten_stock"], sources["purchase_history"],
+            )
+            with self._lock:
+                self._sources, self._frame = sources, frame
+            return frame
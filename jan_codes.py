@@ -0,0 +1,81 @@
+"""
+JAN コードの正規化（列ごとにまとめて処理するベクトル版）
+
+アップロード（csv_upload）・各モードの取得後・発注AI / 仕入価格改善の計算で
+JAN を突き合わせる前に、同じ規則で揃えるために使う。
+
+  - 欠損（None / NaN）は na_value（既定 ""）
+  - 全角数字・全角ピリオドは半角に
+  - 空白（前後・途中・全角スペース）は除去
+  - 数値として読まれた "4901234567890.0" の ".0" を除去（float 列もそのまま渡してよい）
+  - leading_zeros=n のとき、数字だけの値の先頭に n 個以上続く 0 を除去（発注AIは 5、仕入価格改善は 1）。
+    数字以外を含む値はそのまま、0 だけの値は "0" にする
+  - digits_only=True のとき、数字以外の文字を除去（Lark シートの JAN セルなど）
+
+同じ JAN が何行も並ぶ列が多いので、ユニークな値だけを正規化して元の並びに戻す。
+"""
+
+import numpy as np
+import pandas as pd
+
+_FULLWIDTH = str.maketrans("０１２３４５６７８９．", "0123456789.")
+# 半角数字だけかを判定するときの1回あたりの件数（文字コードの配列が 件数 × 最大文字数 × 4 バイトになるため）
+_CHECK_BLOCK = 20_000
+
+
+def _plain_digits(values: pd.Series, leading_zeros: int) -> np.ndarray:
+    """
+    すでに正規化済みの値（半角数字だけ。leading_zeros 指定時は先頭が 0 でない）かどうか。
+    文字列を UCS-4 の配列として見て、文字コードの範囲を NumPy でまとめて判定する。
+    """
+    plain = np.zeros(len(values), dtype=bool)
+    for start in range(0, len(values), _CHECK_BLOCK):
+        arr = np.asarray(values.iloc[start:start + _CHECK_BLOCK], dtype=str)
+        chars = arr.view(np.uint32).reshape(len(arr), -1)
+        ok = (((chars >= 48) & (chars <= 57)) | (chars == 0)).all(axis=1)
+        if leading_zeros:
+            ok &= chars[:, 0] != 48
+        plain[start:start + len(arr)] = ok
+    return plain
+
+
+def _normalize_strings(u: pd.Series, leading_zeros: int, digits_only: bool) -> pd.Series:
+    u = (
+        u.str.translate(_FULLWIDTH)
+         .str.replace(r"\s+", "", regex=True)
+         .str.replace(r"^(\d+)\.0+$", r"\1", regex=True)
+    )
+    if digits_only:
+        u = u.str.replace(r"\D", "", regex=True)
+    if leading_zeros:
+        digits = u.str.fullmatch(r"\d+").fillna(False).astype(bool)
+        stripped = u[digits].str.replace(rf"^0{{{int(leading_zeros)},}}", "", regex=True)
+        u[digits] = stripped.where(stripped != "", "0")
+    return u
+
+
+def normalize_jan(values, leading_zeros: int = 0, digits_only: bool = False, na_value="") -> pd.Series:
+    """
+    values: Series / リスト / 配列。戻り値は object 型の Series（Series を渡した場合は index を保つ）
+    """
+    s = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    if len(uniques) == 0:
+        return pd.Series(np.full(len(s), na_value, dtype=object), index=s.index)
+
+    if pd.api.types.is_float_dtype(uniques):
+        # 整数値の float は "….0" を付けずに文字列へ
+        f = np.asarray(uniques, dtype="float64")
+        whole = np.isfinite(f) & (f == np.floor(f))
+        u = pd.Series(np.where(whole, np.where(whole, f, 0).astype("int64").astype(str), f.astype(str)), dtype=object)
+    else:
+        u = pd.Series(uniques).astype(str).astype(object)
+
+    # ほとんどの値は半角数字だけなので、それ以外の値だけを文字列処理する
+    dirty = ~_plain_digits(u, leading_zeros)
+    if dirty.any():
+        u[dirty] = _normalize_strings(u[dirty], leading_zeros, digits_only)
+
+    out = np.append(u.to_numpy(dtype=object), na_value)
+    # 欠損（code -1）は末尾の na_value を指す
+    return pd.Series(out[codes], index=s.index, dtype=object)
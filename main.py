@@ -44,9 +44,25 @@ import os
 import math
 import re
 import hashlib
+import io
+import threading
 import time
 from zoneinfo import ZoneInfo
+from openpyxl import load_workbook
 from streamlit_javascript import st_javascript
+from supabase_client import SupabaseClient, SupabaseError, in_filter, is_missing_function, pg_quote
+from table_cache import TableCache
+from delta_sync import apply_delta
+from jan_codes import normalize_jan
+from item_view import ItemView
+from snapshot_store import AVAILABLE as SNAPSHOT_AVAILABLE, DEFAULT_SNAPSHOT_DIR, SnapshotStore
+import duckdb_engine
+from duckdb_engine import AVAILABLE as DUCKDB_AVAILABLE, QueryEngine, QueryError
+from upload_jobs import DEFAULT_CHECKPOINT_DIR, JobManager, job_id_for, key_filters, stream_chunks
+from order_engine import (
+    compute_order_results, compute_price_improve, finalize_order_results,
+    prepare_order_inputs, PurchaseIndex,
+)
 
 # ここに parse_items_fixed を追加
 def parse_items_fixed(text):
@@ -185,19 +201,93 @@ COLUMN_NAMES = {
     }
 }
 
-# 🔐 Supabase接続設定
-SUPABASE_URL_PRE = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY_PRE = st.secrets["SUPABASE_KEY"]
-HEADERS_PRE = {
-    "apikey": SUPABASE_KEY_PRE,
-    "Authorization": f"Bearer {SUPABASE_KEY_PRE}",
-    "Content-Type": "application/json"
-}
+# 🔐 Supabase接続設定（プロセスで1つのクライアントを全モード・全セッションで共有）
+@st.cache_resource
+def get_supabase_client():
+    return SupabaseClient(
+        st.secrets["SUPABASE_URL"],
+        st.secrets["SUPABASE_KEY"],
+        page_size=int(st.secrets.get("FETCH_PAGE_SIZE", 1000)),
+        max_workers=int(st.secrets.get("FETCH_MAX_WORKERS", 8)),
+        write_workers=int(st.secrets.get("UPLOAD_MAX_WORKERS", 4)),
+    )
 
-def apply_common_search_ui(df, language: str):
+supabase = get_supabase_client()
+
+# 💾 ローカルスナップショット（Parquet、updated_at による差分同期。SNAPSHOT_STORE=True のときだけ。
+#    サーバ側のトリガーが必要なので既定では使わない。準備は snapshot_store.py の先頭を参照）
+@st.cache_resource
+def get_snapshot_store():
+    if not SNAPSHOT_AVAILABLE or not st.secrets.get("SNAPSHOT_STORE", False):
+        return None
+    client = get_supabase_client()
+    store = SnapshotStore(client, st.secrets.get("SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR))
+    # 書き込んだテーブルは次の読み込みで必ず同期する（TableCache の破棄より先に登録）
+    client.add_write_listener(store.invalidate)
+    # 起動時に全テーブルを差分同期しておく（最初のモード表示を待たせない）
+    threading.Thread(target=store.sync_all, daemon=True).start()
+    return store
+
+# 🗂️ テーブルキャッシュ（全セッション共有。同時の同じ取得は1回にまとめる。TTL 経過後はバックグラウンド更新、書き込みで即破棄）
+@st.cache_resource
+def get_table_cache():
+    client = get_supabase_client()
+    store = get_snapshot_store()
+
+    def load(table, columns, filters):
+        # スナップショット対象のテーブル全体はローカルから（同期は変更分だけ）。期間などで絞る読み込みはサーバから
+        if store is not None and table in store and not filters:
+            return store.read(table, columns)
+        return client.fetch_table(table, columns=columns, filters=filters)
+
+    cache = TableCache(load, ttl=int(st.secrets.get("TABLE_CACHE_TTL", 300)))
+    client.add_write_listener(cache.invalidate)
+    return cache
+
+table_cache = get_table_cache()
+
+# 🔍 検索条件をサーバ側（PostgREST）で絞り込むか（False なら従来どおり全件取得して pandas で絞り込み）
+SEARCH_SERVER_FILTER = bool(st.secrets.get("SEARCH_SERVER_FILTER", True))
+# サーバ側絞り込みで取得する最大件数
+SEARCH_LIMIT = int(st.secrets.get("SEARCH_LIMIT", 5000))
+
+
+def clean_rank_options(values):
+    """ランク候補（空・nan は除外してソート）"""
+    return sorted(
+        pd.Series(values, dtype=object)
+          .astype(str).str.strip()
+          .replace(["", "nan", "None", "NULL"], pd.NA)
+          .dropna()
+          .unique()
+          .tolist()
+    )
+
+
+def search_options_from_frame(df):
+    """検索UIの候補（メーカー名 / ランク / 取扱区分）を DataFrame から作る"""
+    return {
+        "makers": sorted(df.get("メーカー名", pd.Series(dtype=str)).dropna().unique().tolist()),
+        "ranks": clean_rank_options(df.get("ランク", pd.Series(dtype=str))),
+        "types": sorted(df.get("取扱区分", pd.Series(dtype=str)).dropna().unique().tolist()),
+    }
+
+
+def fetch_search_options():
     """
-    商品情報検索 / 販売実績（直近1ヶ月）で共通で使う検索UI＋フィルタ。
-    df を絞り込んだ結果を返す。
+    item_master の DISTINCT 候補。PostgREST に DISTINCT が無いので1列だけ射影して取得し、
+    テーブルキャッシュ（全セッション共有・書き込みで破棄）に乗せて使い回す。
+    """
+    values = {}
+    for col in ["メーカー名", "ランク", "取扱区分"]:
+        df = fetch_table("item_master", [col])
+        values[col] = df[col] if col in df.columns else pd.Series(dtype=str)
+    return search_options_from_frame(pd.DataFrame(values))
+
+
+def common_search_ui(options, language: str):
+    """
+    商品情報検索 / 販売実績（直近1ヶ月）で共通の検索UI。選択された条件を dict で返す。
     """
 
     # ---------- 🔍 検索UI ----------
@@ -224,69 +314,139 @@ def apply_common_search_ui(df, language: str):
 
     maker_filter = st.selectbox(
         TEXT[language]["search_brand"],
-        [TEXT[language]["all"]] +
-        sorted(df.get("メーカー名", pd.Series(dtype=str)).dropna().unique().tolist())
-    )
-    # ランク候補（空は除外）
-    rank_options = (
-        df.get("ランク", pd.Series(dtype=str))
-          .astype(str).str.strip()
-          .replace(["", "nan", "None", "NULL"], pd.NA)
-          .dropna()
-          .unique()
-          .tolist()
+        [TEXT[language]["all"]] + options["makers"]
     )
-    rank_options = sorted(rank_options)
-    
     # 複数選択（デフォルトは全選択＝絞り込み無しと同じ）
     rank_filter = st.multiselect(
         TEXT[language]["search_rank"],
-        options=rank_options,
-        default=rank_options
+        options=options["ranks"],
+        default=options["ranks"]
     )
     type_filter = st.selectbox(
         TEXT[language]["search_type"],
-        [TEXT[language]["all"]] +
-        sorted(df.get("取扱区分", pd.Series(dtype=str)).dropna().unique().tolist())
+        [TEXT[language]["all"]] + options["types"]
     )
 
-    # ---------- 絞り込み ----------
-    jan_list = [j.strip() for j in re.split(r"[,\n\r]+", jan_filter_multi) if j.strip()]
+    return {
+        "jan_list": [j for j in normalize_jan(re.split(r"[,\n\r]+", jan_filter_multi)) if j],
+        "code": keyword_code,
+        "name": keyword_name,
+        "maker": None if maker_filter == TEXT[language]["all"] else maker_filter,
+        "ranks": rank_filter,
+        "all_ranks": len(rank_filter) == len(options["ranks"]),
+        "type": None if type_filter == TEXT[language]["all"] else type_filter,
+    }
+
+
+def is_narrowing_search(cond) -> bool:
+    """ランク全選択以外に、行を絞り込む条件が入っているか"""
+    return bool(
+        cond["jan_list"] or cond["code"] or cond["name"] or cond["maker"] or cond["type"]
+        or not cond["all_ranks"]
+    )
+
+
+def filter_search_frame(df, cond):
+    """検索条件で DataFrame を絞り込む（pandas 版）"""
     df_view = df.copy()
 
     # 優先度: 複数JAN > コード/JAN欄 > 商品名欄
-    if jan_list:
+    if cond["jan_list"]:
         if "jan" in df_view.columns:
-            df_view = df_view[df_view["jan"].isin(jan_list)]
-    elif keyword_code:
+            df_view = df_view[df_view["jan"].isin(cond["jan_list"])]
+    elif cond["code"]:
         if "商品コード" in df_view.columns and "jan" in df_view.columns:
             df_view = df_view[
-                df_view["商品コード"].str.contains(keyword_code, case=False, na=False) |
-                df_view["jan"].str.contains(keyword_code, case=False, na=False)
+                df_view["商品コード"].str.contains(cond["code"], case=False, na=False, regex=False) |
+                df_view["jan"].str.contains(cond["code"], case=False, na=False, regex=False)
             ]
         elif "jan" in df_view.columns:
-            df_view = df_view[df_view["jan"].str.contains(keyword_code, case=False, na=False)]
+            df_view = df_view[df_view["jan"].str.contains(cond["code"], case=False, na=False, regex=False)]
 
-    if keyword_name and "商品名" in df_view.columns:
-        df_view = df_view[df_view["商品名"].str.contains(keyword_name, case=False, na=False)]
+    if cond["name"] and "商品名" in df_view.columns:
+        df_view = df_view[df_view["商品名"].str.contains(cond["name"], case=False, na=False, regex=False)]
 
-    if maker_filter != TEXT[language]["all"] and "メーカー名" in df_view.columns:
-        df_view = df_view[df_view["メーカー名"] == maker_filter]
+    if cond["maker"] and "メーカー名" in df_view.columns:
+        df_view = df_view[df_view["メーカー名"] == cond["maker"]]
 
-    if "ランク" in df_view.columns and rank_filter:
+    if "ランク" in df_view.columns and cond["ranks"]:
         # デフォルトが全選択なので、全選択のままなら実質変化なし
-        df_view = df_view[df_view["ランク"].isin(rank_filter)]
+        df_view = df_view[df_view["ランク"].isin(cond["ranks"])]
 
-    if type_filter != TEXT[language]["all"] and "取扱区分" in df_view.columns:
-        df_view = df_view[df_view["取扱区分"] == type_filter]
+    if cond["type"] and "取扱区分" in df_view.columns:
+        df_view = df_view[df_view["取扱区分"] == cond["type"]]
 
     return df_view
 
 
+LIKE_ESCAPES = str.maketrans({"\\": "\\\\", "%": "\\%", "_": "\\_", "*": "_"})
+
+
+def search_filters(cond):
+    """
+    検索条件 → item_master に対する PostgREST フィルタ（ilike / in.() / eq）。
+    部分一致は str.contains(case=False, regex=False) 相当の ilike（正規表現ではなく文字列として一致）。
+    """
+    def like(text):
+        # LIKE の特殊文字（\ % _）はエスケープする。PostgREST は * を必ず % に置き換えるので、
+        # 文字としての * は1文字の _ で近似し、取得後に pandas 版で絞り直す
+        return pg_quote("*" + text.translate(LIKE_ESCAPES) + "*")
+
+    filters = []
+    if cond["jan_list"]:
+        filters.append(("jan", in_filter(cond["jan_list"])))
+    elif cond["code"]:
+        filters.append(("or", f"(商品コード.ilike.{like(cond['code'])},jan.ilike.{like(cond['code'])})"))
+    if cond["name"]:
+        filters.append(("商品名", f"ilike.{like(cond['name'])}"))
+    if cond["maker"]:
+        filters.append(("メーカー名", f"eq.{pg_quote(cond['maker'])}"))
+    if cond["ranks"]:
+        filters.append(("ランク", in_filter(cond["ranks"])))
+    if cond["type"]:
+        filters.append(("取扱区分", f"eq.{pg_quote(cond['type'])}"))
+    return filters
+
+
+def fetch_item_master_filtered(cond, columns, order=None):
+    """
+    検索条件に一致する item_master の行だけをサーバ側で絞り込んで取得（最大 SEARCH_LIMIT 件）。
+    上限で切れた場合は警告を出す。失敗時はエラー表示して空の DataFrame
+    """
+    try:
+        df, total = supabase.select_frame("item_master", columns, search_filters(cond), order=order, limit=SEARCH_LIMIT)
+    except SupabaseError as e:
+        st.error(f"item_master の取得に失敗: {e.status_code} / {e.text}")
+        return pd.DataFrame(columns=columns)
+    truncated = total > len(df)
+    if "*" in (cond["code"] or "") + (cond["name"] or ""):
+        df = filter_search_frame(df, cond)
+    if truncated:
+        st.warning(f"⚠️ 該当 {total:,} 件のうち先頭 {len(df):,} 件のみ表示しています。条件を絞り込んでください。")
+    return df if not df.empty else pd.DataFrame(columns=columns)
+
+
+def fetch_rows_in(table_name, column, values, columns=None):
+    """column が values に一致する行だけを取得。失敗時はエラー表示して空の DataFrame"""
+    try:
+        return supabase.select_in(table_name, column, values, columns)
+    except SupabaseError as e:
+        st.error(f"{table_name} の取得に失敗: {e.status_code} / {e.text}")
+        return pd.DataFrame(columns=columns or [])
+
+
+def apply_common_search_ui(df, language: str):
+    """
+    商品情報検索 / 販売実績（直近1ヶ月）で共通で使う検索UI＋フィルタ（pandas 版）。
+    df を絞り込んだ結果を返す。
+    """
+    cond = common_search_ui(search_options_from_frame(df), language)
+    return filter_search_frame(df, cond)
+
+
 # 📅 item_master の最新更新日時を JST 表示で取得
 def fetch_latest_item_update():
-    url = f"{SUPABASE_URL_PRE}/rest/v1/item_master?select=updated_at&order=updated_at.desc&limit=1"
-    res = requests.get(url, headers=HEADERS_PRE)
+    res = supabase.select("item_master", "select=updated_at&order=updated_at.desc&limit=1")
     if res.status_code == 200 and res.json():
         dt = pd.to_datetime(res.json()[0]["updated_at"], errors="coerce", utc=True)
         if pd.notnull(dt):
@@ -294,22 +454,73 @@ def fetch_latest_item_update():
             return f"（{dt_jst.strftime('%-m.%d update')}）"
     return ""
 
-def fetch_table(table_name):
-    headers = {**HEADERS_PRE, "Prefer": "count=exact"}
-    dfs = []
-    offset = 0
-    limit = 1000
-    while True:
-        url = f"{SUPABASE_URL_PRE}/rest/v1/{table_name}?select=*&offset={offset}&limit={limit}"
-        res = requests.get(url, headers=headers)
-        if res.status_code == 416 or not res.json():
-            break
-        if res.status_code not in [200, 206]:
-            st.error(f"{table_name} の取得に失敗: {res.status_code} / {res.text}")
-            return pd.DataFrame()
-        dfs.append(pd.DataFrame(res.json()))
-        offset += limit
-    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+# 発注AI / 仕入価格改善で共通の purchase_data の列（supplier は無ければ「不明」扱い）
+PURCHASE_COLUMNS = ["jan", "order_lot", "price", "supplier"]
+
+def fetch_table(table_name, columns=None, filters=None):
+    """
+    テーブル全件取得（テーブルキャッシュ経由）。失敗時はエラー表示して空の DataFrame
+    columns: 使う列だけを指定する（ペイロード・デコード時間・メモリを削減）。None は全列
+    filters: [(列, "eq.xxx"), ...]。期間などで絞った行だけを取得する
+    キャッシュは全セッション共有なので、各モードで自由に加工できるようコピーを返す。
+    """
+    try:
+        return table_cache.get(table_name, columns, filters).copy()
+    except SupabaseError as e:
+        st.error(f"{table_name} の取得に失敗: {e.status_code} / {e.text}")
+        return pd.DataFrame()
+
+# 🧩 item 360（商品マスタ + JD在庫 + 弁天在庫 + 上海控除後の発注済。全セッション共有、元データが変わったときだけ作り直す）
+@st.cache_resource
+def get_item_view():
+    return ItemView(get_table_cache())
+
+item_view = get_item_view()
+
+def fetch_item_360():
+    """
+    item 360 の取得。失敗時はエラー表示して空の DataFrame。
+    全セッション共有の DataFrame をそのまま返すので、列を選んでから（またはコピーしてから）加工すること。
+    """
+    try:
+        return item_view.get()
+    except SupabaseError as e:
+        st.error(f"{e.table} の取得に失敗: {e.status_code} / {e.text}")
+        return pd.DataFrame()
+
+# 🦆 集計エンジン（DuckDB。duckdb が無い・QUERY_ENGINE=False なら pandas のみ）
+@st.cache_resource
+def get_query_engine():
+    if not DUCKDB_AVAILABLE or not st.secrets.get("QUERY_ENGINE", True):
+        return None
+    threads = st.secrets.get("DUCKDB_THREADS")
+    return QueryEngine(get_table_cache(), get_snapshot_store(), threads=int(threads) if threads else None)
+
+query_engine = get_query_engine()
+
+ENGINE_PANDAS = "pandas"
+ENGINE_DUCKDB = "DuckDB"
+
+def select_engine(mode_key):
+    """モードごとの集計エンジン選択（DuckDB が使えるときだけ表示）"""
+    if query_engine is None:
+        return ENGINE_PANDAS
+    return st.radio("⚙️ 集計エンジン", [ENGINE_PANDAS, ENGINE_DUCKDB], horizontal=True, key=f"engine_{mode_key}")
+
+def show_engine_timing(mode_key, engine, seconds):
+    """直近の集計時間をエンジンごとに並べて表示（セッション内で比較できるように残す）"""
+    timings = st.session_state.setdefault("engine_timings", {}).setdefault(mode_key, {})
+    timings[engine] = seconds
+    if query_engine is not None:
+        st.caption("⏱️ 集計時間: " + " / ".join(f"{name} {sec:.3f}秒" for name, sec in timings.items()))
+
+def run_duckdb(fn, *args, **kwargs):
+    """DuckDB で集計。失敗したら警告を出して None（呼び出し側は pandas で集計する）"""
+    try:
+        return fn(query_engine, *args, **kwargs)
+    except (QueryError, SupabaseError) as e:
+        st.warning(f"DuckDB での集計に失敗したため pandas で集計します: {e}")
+        return None
 
 item_master_update_text = fetch_latest_item_update()
 
@@ -514,45 +725,18 @@ elif mode == "order_ai":
 
 
     if st.button("🤖 計算を開始する"):
-        SUPABASE_URL = st.secrets["SUPABASE_URL"]
-        SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-        HEADERS = {
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        import math
-        from datetime import date, timedelta
-
-        def fetch_table(table_name):
-            headers = {**HEADERS, "Prefer": "count=exact"}
-            dfs = []
-            offset = 0
-            limit = 1000
-            while True:
-                url = f"{SUPABASE_URL}/rest/v1/{table_name}?select=*&offset={offset}&limit={limit}"
-                res = requests.get(url, headers=headers)
-                if res.status_code == 416 or not res.json():
-                    break
-                if res.status_code not in [200, 206]:
-                    st.error(f"{table_name} の取得に失敗: {res.status_code} / {res.text}")
-                    return pd.DataFrame()
-                dfs.append(pd.DataFrame(res.json()))
-                offset += limit
-            return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
-        def normalize_jan(x):
-            try:
-                return str(x).strip()
-            except:
-                return ""
-
         with st.spinner("📦 データを読み込み中..."):
-            df_sales = fetch_table("sales")
-            df_purchase = fetch_table("purchase_data")
-            df_master = fetch_table("item_master")
-            df_warehouse = fetch_table("warehouse_stock")  # JD固定なので常に取得
+            df_sales = fetch_table("sales", ["jan", "quantity_sold", "stock_available"])
+            df_purchase = fetch_table("purchase_data", PURCHASE_COLUMNS)
+            # 商品マスタ・上海控除後の発注済は item 360 から（作成済みなら再取得・再結合なし）
+            df_360 = fetch_item_360()
+            df_master = (
+                df_360[["jan", "ランク", "発注済", "発注済_修正後", "商品コード", "商品名", "取扱区分"]]
+                if not df_360.empty else pd.DataFrame()
+            )
+            df_warehouse = fetch_table("warehouse_stock", ["product_code", "stock_available"])  # JD固定なので常に取得
+            # 弁天在庫は benten_stock から直接（item 360 は商品マスタに無い JAN を持たない）
+            df_benten = fetch_table("benten_stock", ["jan", "stock"])
 
 
         if df_sales.empty or df_purchase.empty or df_master.empty:
@@ -562,236 +746,35 @@ elif mode == "order_ai":
             st.warning("JDモード用の warehouse_stock データが不足しています。")
             st.stop()
 
-        # 正規化・型揃え
-        df_sales["jan"] = df_sales["jan"].apply(normalize_jan)
-        df_purchase["jan"] = df_purchase["jan"].apply(normalize_jan)
-        df_master["jan"] = df_master["jan"].apply(normalize_jan)
-        df_sales["quantity_sold"] = pd.to_numeric(df_sales["quantity_sold"], errors="coerce").fillna(0).astype(int)
-        df_sales["stock_available"] = pd.to_numeric(df_sales["stock_available"], errors="coerce").fillna(0).astype(int)
-
-        if ai_mode == "JDモード":
-            df_warehouse["product_code"] = df_warehouse["product_code"].apply(normalize_jan)
-            df_warehouse["stock_available"] = pd.to_numeric(df_warehouse["stock_available"], errors="coerce").fillna(0).astype(int)
-
         # 発注履歴（上海除外/直近判定に使用）
-        df_history = fetch_table("purchase_history")
-        if df_history.empty:
-            df_history = pd.DataFrame(columns=["jan", "quantity", "memo", "order_date"])
-        df_history["quantity"] = pd.to_numeric(df_history["quantity"], errors="coerce").fillna(0).astype(int)
-        df_history["memo"] = df_history["memo"].astype(str).fillna("")
-        df_history["jan"] = df_history["jan"].apply(normalize_jan)
-
-        # 「上海」分を item_master 発注済から控除
-        df_shanghai = df_history[df_history["memo"].str.contains("上海", na=False)]
-        df_shanghai_grouped = df_shanghai.groupby("jan")["quantity"].sum().reset_index(name="shanghai_quantity")
-        if "発注済" not in df_master.columns:
-            df_master["発注済"] = 0
-        df_master = df_master.merge(df_shanghai_grouped, on="jan", how="left")
-        df_master["shanghai_quantity"] = df_master["shanghai_quantity"].fillna(0).astype(int)
-        df_master["発注済_修正後"] = (pd.to_numeric(df_master["発注済"], errors="coerce").fillna(0) - df_master["shanghai_quantity"]).clip(lower=0)
-
-        # sales に反映
-        df_sales.drop(columns=["発注済"], errors="ignore", inplace=True)
-        df_sales = df_sales.merge(df_master[["jan", "発注済_修正後"]], on="jan", how="left")
-        df_sales["発注済"] = df_sales["発注済_修正後"].fillna(0).astype(int)
-
-        # purchase_data 型揃え
-        df_purchase["order_lot"] = pd.to_numeric(df_purchase["order_lot"], errors="coerce").fillna(0).astype(int)
-        df_purchase["price"] = pd.to_numeric(df_purchase["price"], errors="coerce")
-
-        # ランク倍率（C/TESTで使用。A/Bは新仕様により未使用）
-        rank_multiplier = {
-            "Aランク": 1.0,  # 未使用
-            "Bランク": 1.2,  # 未使用（発注数は1.7S、発注点1.2Sに変更）
-            "Cランク": 1.0,
-            "TEST": 1.5,
-            "NEW": 1.5
-        }
+        df_history = fetch_table("purchase_history", ["jan", "quantity", "memo", "order_date"])
 
-        with st.spinner("🤖 発注AIが計算をしています..."):
-            # 直近（本日/昨日）発注の除外
-            df_history_recent = df_history.copy()
-            df_history_recent["order_date"] = pd.to_datetime(df_history_recent["order_date"], errors="coerce").dt.date
-            today = date.today()
-            yesterday = today - timedelta(days=1)
-            recent_jans = df_history_recent[df_history_recent["order_date"].isin([today, yesterday])]["jan"].dropna().astype(str).apply(normalize_jan).unique().tolist()
-
-            results = []
-
-            for _, row in df_sales.iterrows():
-                jan = row["jan"]
-                sold = row["quantity_sold"]
-                ordered = row["発注済"]
-
-                # 在庫取得
-                if ai_mode == "JDモード":
-                    stock_row = df_warehouse[df_warehouse["product_code"] == jan]
-                    stock = stock_row["stock_available"].values[0] if not stock_row.empty else 0
-                else:
-                    stock = row.get("stock_available", 0)
-
-                # ランク取得
-                rank_row = df_master[df_master["jan"] == jan]
-                if not rank_row.empty and ("ランク" in df_master.columns):
-                    rank = str(rank_row.iloc[0]["ランク"]) if pd.notna(rank_row.iloc[0]["ランク"]) else ""
-                else:
-                    rank = ""
-
-                # ★対応：基底ランク（A/B/C or ""）
-                base_rank = normalize_rank_base(rank)
-
-                # 直近発注スキップ
-                if jan in recent_jans:
-                    continue
-
-                current_total = stock + ordered
-
-                # ===== 発注点判定 =====
-                if base_rank in ["A", "B"]:
-                    # 新仕様：在庫+発注済 が ceil(実績×1.2) を「下回ったら」発注
-                    reorder_point = max(math.ceil(sold * 1.2), 1)
-                    if current_total >= reorder_point:
-                        continue  # 下回っていない（=発注しない）
-                else:
-                    # 既存仕様（C/TEST）
-                    if rank == "Cランク":
-                        reorder_point = max(math.floor(sold * 0.7), 1)
-                    else:  # TEST or その他
-                        reorder_point = max(math.floor(sold * 0.7), 1)
-                    if current_total > reorder_point:
-                        continue
-
-                # ===== 発注数の基準 =====
-                if base_rank in ["A", "B"]:
-                    # 新仕様：発注数 = ceil(実績×1.7)
-                    base_needed = max(math.ceil(sold * 1.7), 0)
-                    # 「最低1個」特例は A/B でも有効にしておく（在庫ほぼゼロで実績ありの安全策）
-                    if stock <= 1 and sold >= 1 and base_needed <= 0:
-                        base_needed = 1
-                else:
-                    # C/TEST：不足分 = ceil(実績×倍率) - 在庫 - 発注済
-                    m = rank_multiplier.get(rank, 1.0)
-                    need_raw = math.ceil(sold * m) - stock - ordered
-                    base_needed = 1 if (stock <= 1 and sold >= 1 and need_raw <= 0) else max(need_raw, 0)
-                    if base_needed <= 0:
-                        continue  # 不足なし
-
-                # ここで base_needed > 0 なら発注必要
-
-                # 仕入候補抽出
-                options_all = df_purchase[df_purchase["jan"] == jan].copy()
-                valid_options = pd.DataFrame()
-                if not options_all.empty:
-                    options_all["order_lot"] = pd.to_numeric(options_all["order_lot"], errors="coerce").fillna(0).astype(int)
-                    options_all["price"] = pd.to_numeric(options_all["price"], errors="coerce")
-                    options_lotpos = options_all[options_all["order_lot"] > 0].copy()
-                    valid_options = options_lotpos[options_lotpos["price"].notna() & (options_lotpos["price"] > 0)].copy()
-
-                # 価格が無い/ロット無効 → 空欄で出力
-                if valid_options.empty:
-                    results.append({
-                        "jan": jan,
-                        "販売実績": sold,
-                        "在庫": stock,
-                        "発注済": ordered,
-                        "理論必要数": base_needed,
-                        "発注数": "",     # 空欄
-                        "ロット": "",     # 空欄
-                        "数量": "",       # 空欄
-                        "単価": "",       # 空欄
-                        "総額": "",       # 空欄
-                        "仕入先": "",     # 空欄
-                        "ランク": rank
-                    })
-                    continue
-
-                # 価格あり：ロット最適化
-                options = valid_options.copy()
+        # 正規化・型揃え、上海分の控除、直近発注JAN（order_engine.py）
+        df_sales, df_master, df_warehouse, df_purchase, recent_jans = prepare_order_inputs(
+            df_sales, df_purchase, df_master, df_warehouse, df_history,
+            use_warehouse=(ai_mode == "JDモード"),
+        )
 
-                # A/B は base_needed=ceil(1.7S) をロットで切り上げ
-                # C/TEST は「不足分」= base_needed をロットで切り上げ
-                need_for_lot = base_needed
+        # 仕入候補の JAN 別索引（読み込みごとに1回だけ作成）
+        purchase_index = PurchaseIndex(df_purchase)
 
-                if base_rank in ["A", "B"]:
-                    bigger_lots = options[options["order_lot"] >= need_for_lot]
-                    if not bigger_lots.empty:
-                        best_option = bigger_lots.sort_values("order_lot").iloc[0]
-                    else:
-                        best_option = options.sort_values("order_lot", ascending=False).iloc[0]
-                else:
-                    # 従来ロジック
-                    options["diff"] = (options["order_lot"] - need_for_lot).abs()
-                    smaller_lots = options[options["order_lot"] <= need_for_lot]
-                    if not smaller_lots.empty:
-                        best_option = smaller_lots.loc[smaller_lots["diff"].idxmin()]
-                    else:
-                        near_lots = options[(options["order_lot"] > need_for_lot) & (options["order_lot"] <= need_for_lot * 1.5) & (options["order_lot"] != 1)]
-                        if not near_lots.empty:
-                            best_option = near_lots.loc[near_lots["diff"].idxmin()]
-                        else:
-                            one_lot = options[options["order_lot"] == 1]
-                            if not one_lot.empty:
-                                best_option = one_lot.iloc[0]
-                            else:
-                                best_option = options.sort_values("order_lot").iloc[0]
-
-
-                lot = int(best_option["order_lot"])
-                sets = math.ceil(need_for_lot / lot)
-                qty = sets * lot
-                total_cost = qty * float(best_option["price"])
-                
-                results.append({
-                    "jan": jan,
-                    "販売実績": sold,
-                    "在庫": stock,
-                    "発注済": ordered,
-                    "理論必要数": base_needed,
-                    "発注数": int(qty),                   # ← 整数
-                    "ロット": lot,                        # ← 整数
-                    "数量": int(sets),                    # ← 整数
-                    "単価": int(best_option["price"]),    # ← 整数
-                    "総額": int(total_cost),              # ← 整数
-                    "仕入先": best_option.get("supplier", "不明"),
-                    "ランク": rank
-                })
+        with st.spinner("🤖 発注AIが計算をしています..."):
+            # 判定本体（order_engine.py：JOIN + NumPy マスクで一括計算）
+            results = compute_order_results(
+                df_sales, df_master, df_warehouse, purchase_index, recent_jans,
+                use_warehouse=(ai_mode == "JDモード"),
+            )
 
             # === 出力整形 ===
-            if results:
-                result_df = pd.DataFrame(results)
-
-                # 商品名・取扱区分を結合
-                if "商品コード" in df_master.columns:
-                    df_master["商品コード"] = df_master["商品コード"].astype(str).str.strip()
-                    result_df["jan"] = result_df["jan"].astype(str).str.strip()
-                    df_temp = df_master[["商品コード", "商品名", "取扱区分"]].copy()
-                    df_temp.rename(columns={"商品コード": "jan"}, inplace=True)
-                    result_df = pd.merge(result_df, df_temp, on="jan", how="left")
-
-                # 弁天在庫（表示のみ）
-                df_benten = fetch_table("benten_stock")
+            if not results.empty:
+                # 弁天在庫（表示のみ。正規化した JAN で突き合わせる）
                 if not df_benten.empty:
-                    df_benten["jan"] = df_benten["jan"].astype(str).str.strip()
-                    df_benten = df_benten[["jan", "stock"]].rename(columns={"stock": "弁天在庫"})
-                    result_df = pd.merge(result_df, df_benten, on="jan", how="left")
-                    result_df["弁天在庫"] = result_df["弁天在庫"].fillna(0).astype(int)
-
-                # 列名統一
-                result_df.rename(columns={"在庫": "JD在庫"}, inplace=True)
-
-                # 表示フィルタ
-                if "商品名" in result_df.columns:
-                    result_df = result_df[result_df["商品名"].notna()]
-                if "取扱区分" in result_df.columns:
-                    result_df = result_df[result_df["取扱区分"] != "取扱中止"]
-                else:
+                    df_benten = df_benten.assign(jan=normalize_jan(df_benten["jan"])).drop_duplicates(subset=["jan"])
+                result_df = finalize_order_results(results, df_master, df_benten)
+                # 取扱区分は 商品コード で結合する（どちらかが無ければ結合されない）
+                if not {"商品コード", "取扱区分"} <= set(df_master.columns):
                     st.warning("⚠️『取扱区分』列が存在しません。")
 
-                # 表示順
-                column_order = ["jan", "商品名", "ランク", "販売実績", "JD在庫", "弁天在庫", "発注済",
-                                "理論必要数", "発注数", "ロット", "数量", "単価", "総額", "仕入先"]
-                result_df = result_df[[c for c in column_order if c in result_df.columns]]
-
                 st.success(f"✅ 発注対象: {len(result_df)} 件")
                 st.dataframe(result_df, use_container_width=True)
 
@@ -822,84 +805,67 @@ elif mode == "order_ai":
 elif mode == "search_item":
     st.subheader("🔍 商品情報検索モード")
 
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    HEADERS = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
+    master_cols = [
+        "商品コード", "jan", "ランク", "メーカー名", "商品名", "取扱区分",
+        "発注済", "average_cost", "purchase_cost", "ケース入数", "発注ロット", "重量"
+    ]
+    warehouse_cols = ["product_code", "stock_available"]
 
-    # ---------- データ取得 ----------
-    def fetch_item_master():
-        headers = {**HEADERS, "Prefer": "count=exact"}
-        dfs = []
-        offset, limit = 0, 1000
-        while True:
-            url = f"{SUPABASE_URL}/rest/v1/item_master?select=*&offset={offset}&limit={limit}"
-            res = requests.get(url, headers=headers)
-            if res.status_code == 416 or not res.json():
-                break
-            if res.status_code not in [200, 206]:
-                st.error(f"item_master の取得に失敗: {res.status_code} / {res.text}")
-                return pd.DataFrame()
-            dfs.append(pd.DataFrame(res.json()))
-            offset += limit
-        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
-    def fetch_warehouse_stock():
-        headers = {**HEADERS, "Prefer": "count=exact"}
-        dfs = []
-        offset, limit = 0, 1000
-        while True:
-            url = f"{SUPABASE_URL}/rest/v1/warehouse_stock?select=*&offset={offset}&limit={limit}"
-            res = requests.get(url, headers=headers)
-            if res.status_code == 416 or not res.json():
-                break
-            if res.status_code not in [200, 206]:
-                st.error(f"warehouse_stock の取得に失敗: {res.status_code} / {res.text}")
-                return pd.DataFrame()
-            dfs.append(pd.DataFrame(res.json()))
-            offset += limit
-        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
-    df_master = fetch_item_master()
-    df_warehouse = fetch_warehouse_stock()
-
-    if df_master.empty:
-        st.warning("商品情報データベースにデータが存在しません。")
-        st.stop()
+    # ---------- 検索UI（サーバ側絞り込み時は候補を DISTINCT キャッシュから） ----------
+    server_filtered = False
+    if SEARCH_SERVER_FILTER:
+        cond = common_search_ui(fetch_search_options(), language)
+        server_filtered = is_narrowing_search(cond)
 
-    # 型整形
-    df_master["jan"] = df_master["jan"].astype(str)
-    if "商品コード" in df_master.columns:
-        df_master["商品コード"] = df_master["商品コード"].astype(str)
-    if "商品名" in df_master.columns:
-        df_master["商品名"] = df_master["商品名"].astype(str)
-
-    if not df_warehouse.empty:
-        df_warehouse["product_code"] = df_warehouse["product_code"].astype(str)
-        df_warehouse["stock_available"] = pd.to_numeric(df_warehouse["stock_available"], errors="coerce").fillna(0).astype(int)
-        df_warehouse["stock_total"] = df_warehouse["stock_available"]
-
-        # JD在庫（warehouse_stock）を結合
-        df_master = df_master.merge(
-            df_warehouse[["product_code", "stock_total", "stock_available"]],
-            left_on="jan", right_on="product_code",
-            how="left"
-        )
-        df_master["在庫"] = df_master["stock_total"].fillna(0).astype(int)
-        df_master["利用可能"] = df_master["stock_available"].fillna(0).astype(int)
+    # ---------- データ取得 ----------
+    # item 360 が作成済みならそれを手元で絞り込む（再取得・再結合なし）。未作成で条件が狭いときだけサーバ側で絞り込む
+    df_360 = item_view.peek()
+    if server_filtered and df_360 is None:
+        # 条件に一致する商品と、その JD在庫だけを取得
+        df_master = fetch_item_master_filtered(cond, master_cols, order="商品コード.asc,jan.asc")
+        df_warehouse = fetch_rows_in("warehouse_stock", "product_code", normalize_jan(df_master["jan"]), warehouse_cols)
+
+        # 型整形（文字列・数量の型は取得時に揃っている）
+        df_master["jan"] = normalize_jan(df_master["jan"])
+
+        if not df_warehouse.empty:
+            df_warehouse["product_code"] = normalize_jan(df_warehouse["product_code"])
+            df_warehouse["stock_total"] = df_warehouse["stock_available"]
+
+            # JD在庫（warehouse_stock）を結合
+            df_master = df_master.merge(
+                df_warehouse[["product_code", "stock_total", "stock_available"]],
+                left_on="jan", right_on="product_code",
+                how="left"
+            )
+            df_master["在庫"] = df_master["stock_total"].fillna(0).astype(int)
+            df_master["利用可能"] = df_master["stock_available"].fillna(0).astype(int)
+        else:
+            df_master["在庫"] = 0
+            df_master["利用可能"] = 0
     else:
-        df_master["在庫"] = 0
-        df_master["利用可能"] = 0
+        server_filtered = False
+        df_360 = df_360 if df_360 is not None else fetch_item_360()
+        if df_360.empty:
+            st.warning("商品情報データベースにデータが存在しません。")
+            st.stop()
+
+        # JD在庫 は従来どおり product_code を JAN で照合した値
+        df_master = df_360[[c for c in master_cols if c in df_360.columns]].copy()
+        df_master["在庫"] = df_360["JD在庫_JAN"]
+        df_master["利用可能"] = df_360["JD在庫_JAN"]
 
     # 価格列（存在しなければ0で埋める）
     df_master["実績原価"] = pd.to_numeric(df_master.get("average_cost", 0), errors="coerce").fillna(0).astype(int)
     df_master["最安原価"] = pd.to_numeric(df_master.get("purchase_cost", 0), errors="coerce").fillna(0).astype(int)
 
-    # ---------- 検索UI ＋ 絞り込み（共通関数） ----------
-    df_view = apply_common_search_ui(df_master, language)
+    # ---------- 絞り込み（共通関数） ----------
+    if server_filtered:
+        df_view = df_master
+    elif SEARCH_SERVER_FILTER:
+        df_view = filter_search_frame(df_master, cond)
+    else:
+        df_view = apply_common_search_ui(df_master, language)
 
     # ---------- 表示 ----------
     view_cols = [
@@ -936,14 +902,6 @@ elif mode == "search_item":
 elif mode == "purchase_history":
     st.subheader("📜 発注履歴")
 
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    HEADERS = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-
     # ---------- 🔍 検索フォーム ----------
     col1, col2 = st.columns(2)
 
@@ -959,14 +917,12 @@ elif mode == "purchase_history":
             height=120,
         )
 
-    @st.cache_data(ttl=60)
     def fetch_purchase_history():
-        url = f"{SUPABASE_URL}/rest/v1/purchase_history?select=*"
-        res = requests.get(url, headers=HEADERS)
-        if res.status_code == 200:
-            return pd.DataFrame(res.json())
-        st.error("❌ 発注履歴データの取得に失敗しました")
-        return pd.DataFrame()
+        try:
+            return table_cache.get("purchase_history", ["jan", "quantity", "order_date", "order_id"]).copy()
+        except SupabaseError:
+            st.error("❌ 発注履歴データの取得に失敗しました")
+            return pd.DataFrame()
 
     df = fetch_purchase_history()
 
@@ -977,11 +933,11 @@ elif mode == "purchase_history":
     # ------------- 🧹 フィルタリング -------------
     import re
 
-    df["jan"]        = df["jan"].astype(str)
+    df["jan"]        = normalize_jan(df["jan"])
     df["order_date"] = pd.to_datetime(df["order_date"], errors="coerce").dt.date
 
     # ① 複数 JAN リストを整形
-    jan_list = [j.strip() for j in re.split(r"[,\n\r]+", jan_filter_multi) if j.strip()]
+    jan_list = [j for j in normalize_jan(re.split(r"[,\n\r]+", jan_filter_multi)) if j]
 
     if jan_list:  # 最優先
         df = df[df["jan"].isin(jan_list)]
@@ -1003,112 +959,15 @@ elif mode == "purchase_history":
 elif mode == "price_improve":
     st.subheader("💰 " + TEXT[language]["price_improve"])
 
-    # 認証用ヘッダー定義
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    HEADERS = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    def fetch_table(table_name):
-        headers = {**HEADERS, "Prefer": "count=exact"}
-        dfs = []
-        offset = 0
-        limit = 1000
-        while True:
-            url = f"{SUPABASE_URL}/rest/v1/{table_name}?select=*&offset={offset}&limit={limit}"
-            res = requests.get(url, headers=headers)
-            if res.status_code == 416 or not res.json():
-                break
-            if res.status_code not in [200, 206]:
-                st.error(f"{table_name} の取得に失敗: {res.status_code} / {res.text}")
-                return pd.DataFrame()
-            dfs.append(pd.DataFrame(res.json()))
-            offset += limit
-        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
     with st.spinner("📊 データを読み込み中..."):
-        df_sales = fetch_table("sales")
-        df_purchase = fetch_table("purchase_data")
-        df_item = fetch_table("item_master")
-
-    def normalize_jan(x):
-        try:
-            if re.fullmatch(r"\d+(\.0+)?", str(x)):
-                return str(int(float(x)))
-            else:
-                return str(x).strip()
-        except:
-            return ""
-
-    # 整形
-    df_sales["jan"] = df_sales["jan"].apply(normalize_jan)
-    df_purchase["jan"] = df_purchase["jan"].apply(normalize_jan)
-    df_item["jan"] = df_item["jan"].apply(normalize_jan)
-    df_purchase["price"] = pd.to_numeric(df_purchase["price"], errors="coerce").fillna(0)
-
-    # 現在価格判定
-    current_prices = {}
-    for _, row in df_sales.iterrows():
-        jan = row["jan"]
-        sold = row["quantity_sold"]
-        stock = row.get("stock_available", 0)
-        ordered = row.get("stock_ordered", 0)
-        options = df_purchase[df_purchase["jan"] == jan].copy()
-        if options.empty:
-            continue
-
-        if stock >= sold:
-            need_qty = 0
-        else:
-            need_qty = sold - stock + math.ceil(sold * 0.5) - ordered
-            need_qty = max(need_qty, 0)
+        df_sales = fetch_table("sales", ["jan", "quantity_sold", "stock_available", "stock_ordered"])
+        df_purchase = fetch_table("purchase_data", PURCHASE_COLUMNS)
+        df_item = fetch_table("item_master", ["jan", "item_code", "brand"])
 
-        if need_qty <= 0:
-            continue
-
-        options = options[options["order_lot"] > 0]
-        options["diff"] = (options["order_lot"] - need_qty).abs()
-
-        smaller_lots = options[options["order_lot"] <= need_qty]
-        if not smaller_lots.empty:
-            best_option = smaller_lots.loc[smaller_lots["diff"].idxmin()]
-        else:
-            near_lots = options[(options["order_lot"] > need_qty) & (options["order_lot"] <= need_qty * 1.5) & (options["order_lot"] != 1)]
-            if not near_lots.empty:
-                best_option = near_lots.loc[near_lots["diff"].idxmin()]
-            else:
-                one_lot = options[options["order_lot"] == 1]
-                if not one_lot.empty:
-                    best_option = one_lot.iloc[0]
-                else:
-                    best_option = options.sort_values("order_lot").iloc[0]
-
-        current_prices[jan] = best_option["price"]
-
-    # 最安値取得
-    min_prices = df_purchase.groupby("jan")["price"].min().to_dict()
-
-    rows = []
-    for jan, current_price in current_prices.items():
-        if jan in min_prices and min_prices[jan] < current_price:
-            item = df_item[df_item["jan"] == jan].head(1)
-            if not item.empty:
-                row = {
-                    "商品コード": item.iloc[0].get("item_code", ""),
-                    "JAN": jan,
-                    "メーカー名": item.iloc[0].get("brand", ""),
-                    "現在の仕入価格": current_price,
-                    "最安値の仕入価格": min_prices[jan],
-                    "差分": round(min_prices[jan] - current_price, 2)
-                }
-                rows.append(row)
-
-    if rows:
-        df_result = pd.DataFrame(rows)
+    # 改善対象の判定（order_engine.py）
+    df_result = compute_price_improve(df_sales, df_purchase, df_item)
 
+    if not df_result.empty:
         # ✅ 多言語カラム名に変換
         column_translation = {
             "日本語": {
@@ -1149,12 +1008,6 @@ elif mode == "price_improve":
 if mode == "csv_upload":
     st.subheader("📄 CSVアップロードモード")
 
-    def normalize_jan(x):
-        try:
-            return str(x).strip()
-        except:
-            return ""
-
     input_password = st.text_input("🔑 パスワードを入力してください", type="password")
     correct_password = st.secrets.get("UPLOAD_PASSWORD", "pass1234")
 
@@ -1162,19 +1015,12 @@ if mode == "csv_upload":
         st.warning("正しいパスワードを入力してください。")
         st.stop()
 
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    HEADERS = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    def preprocess_csv(df, table):
+    def preprocess_csv(df, table, show_columns=True):
         df.columns = df.columns.str.replace("　", "").str.replace("\ufeff", "").str.strip()
 
         if table == "sales":
-            st.write("📝 sales 列名:", df.columns.tolist())
+            if show_columns:
+                st.write("📝 sales 列名:", df.columns.tolist())
             item_col = None
             for col in df.columns:
                 if "アイテム" in col:
@@ -1197,7 +1043,7 @@ if mode == "csv_upload":
                 if col in df.columns:
                     df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
 
-            df["jan"] = df["jan"].apply(normalize_jan)
+            df["jan"] = normalize_jan(df["jan"])
 
         elif table == "purchase_data":
             for col in ["order_lot", "price"]:
@@ -1206,10 +1052,11 @@ if mode == "csv_upload":
                     df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
                     if col == "order_lot":
                         df[col] = df[col].round().astype(int)
-            df["jan"] = df["jan"].apply(normalize_jan)
+            df["jan"] = normalize_jan(df["jan"])
 
         elif table == "item_master":
-            st.write("📝 item_master 列名:", df.columns.tolist())
+            if show_columns:
+                st.write("📝 item_master 列名:", df.columns.tolist())
             upc_col = None
             for col in df.columns:
                 if "UPC" in col:
@@ -1236,7 +1083,7 @@ if mode == "csv_upload":
             }, inplace=True)
 
             df.drop(columns=["内部ID"], inplace=True, errors="ignore")
-            df["jan"] = df["jan"].apply(normalize_jan)
+            df["jan"] = normalize_jan(df["jan"])
 
             for col in ["ケース入数", "発注ロット", "在庫", "利用可能", "発注済"]:
                 if col in df.columns:
@@ -1244,51 +1091,112 @@ if mode == "csv_upload":
 
         return df
 
-    def upload_file(file, table_name):
-        if not file:
-            return
-        with st.spinner(f"📤 {file.name} アップロード中..."):
-            temp_path = f"/tmp/{file.name}"
-            with open(temp_path, "wb") as f:
-                f.write(file.read())
-            try:
-                df = pd.read_csv(
-                    temp_path,
-                    sep=",",
-                    engine="python",
-                    on_bad_lines="skip",
-                    encoding="utf-8-sig"
-                )
-                df = preprocess_csv(df, table_name)
+    # 1チャンクあたりの行数（パース → 前処理 → POST をこの単位で流す）
+    UPLOAD_CHUNK_ROWS = int(st.secrets.get("UPLOAD_CHUNK_ROWS", 50000))
+
+    # テーブルごとの重複排除キー（同じキーは後の行を残す）
+    UPLOAD_KEYS = {
+        "purchase_data": ["jan", "supplier", "order_lot"],
+        "item_master": ["商品コード"],
+    }
 
-                requests.delete(f"{SUPABASE_URL}/rest/v1/{table_name}?id=gt.0", headers=HEADERS)
+    def is_jan_header(col):
+        col = col.replace("　", "").replace("\ufeff", "").strip()
+        return "アイテム" in col or "UPC" in col or col == "jan"
 
-                if table_name == "purchase_data":
-                    df = df.drop_duplicates(subset=["jan", "supplier", "order_lot"], keep="last")
-                elif table_name == "item_master":
-                    df = df.drop_duplicates(subset=["商品コード"], keep="last")
-                    if "id" not in df.columns:
-                        df.insert(0, "id", range(1, len(df) + 1))
-                else:
-                    df = df.drop_duplicates(subset=["jan"], keep="last")
+    # 全件入れ替えで本体を空にするフィルタ（ステージングが使えない場合のみ）
+    DELETE_ALL = {
+        "warehouse_stock": "product_code=neq.null",
+        "benten_stock": "jan=neq.null",
+    }
 
-                df = df.replace({pd.NA: None, pd.NaT: None, float("nan"): None}).where(pd.notnull(df), None)
+    def begin_full_reload(table_name):
+        """
+        全件入れ替えの書き込み先を返す。<table>_staging があればそこへ書き、最後に
+        finish_full_reload で一括切り替え（読み手に空・書き込み途中のテーブルを見せない）。
+        ステージングが無ければ従来どおり本体を全削除して本体へ書く。
+        """
+        staging = supabase.begin_staged(table_name)
+        if staging:
+            return staging
+        supabase.delete(table_name, DELETE_ALL.get(table_name, "id=gt.0"))
+        return table_name
 
-                for i in range(0, len(df), 500):
-                    batch = df.iloc[i:i+500].to_dict(orient="records")
-                    res = requests.post(
-                        f"{SUPABASE_URL}/rest/v1/{table_name}",
-                        headers={**HEADERS, "Prefer": "resolution=merge-duplicates"},
-                        json=batch
-                    )
-                    if res.status_code not in [200, 201]:
-                        st.error(f"❌ {table_name} バッチPOST失敗: {res.status_code} {res.text}")
-                        return
+    def finish_full_reload(table_name, target):
+        if target != table_name:
+            supabase.swap_staged(table_name)
 
-                st.success(f"✅ {table_name} に {len(df)} 件アップロード完了")
+    def post_rows(target, df, job):
+        """target（本体 or ステージング）へ一括 POST（ワーカースレッドで実行。失敗時は SupabaseError）"""
+        supabase.bulk_insert(target, df, progress=job.add_progress)
 
-            except Exception as e:
-                st.error(f"❌ {table_name} アップロード中にエラー: {e}")
+    def stream_upload(table_name, chunks, key_cols, job):
+        """
+        前処理済みのチャンクを全件入れ替えで順に POST する（upload_jobs.stream_chunks）。
+        ジョブの中で動くので st.* は使わない。戻り値: 件数（失敗・データなしは例外）
+        """
+        return stream_chunks(
+            table_name, chunks, key_cols, job,
+            begin=lambda: begin_full_reload(table_name),
+            post=lambda target, df: post_rows(target, df, job),
+            delete_keys=lambda target, keys: supabase.delete(target, key_filters(key_cols, keys)),
+            finish=lambda target: finish_full_reload(table_name, target),
+            assign_ids=table_name == "item_master",
+        )
+
+    # 🧵 アップロードジョブ（プロセスで1つ。ブラウザを閉じても続き、失敗したら続きから再開できる）
+    @st.cache_resource
+    def get_upload_jobs():
+        return JobManager(
+            st.secrets.get("UPLOAD_CHECKPOINT_DIR", DEFAULT_CHECKPOINT_DIR),
+            max_workers=int(st.secrets.get("UPLOAD_JOB_WORKERS", 2)),
+        )
+
+    upload_jobs = get_upload_jobs()
+
+    def submit_upload(file, table_name, run, mode=""):
+        """
+        ファイルの内容ごとジョブに渡す。同じファイル・同じモードのジョブが既にあれば投入しない
+        （スクリプトの再実行のたびに二重にアップロードしない）。
+        """
+        data = file.getvalue()
+        upload_jobs.submit(job_id_for(table_name, data, mode), table_name, file.name, run, data)
+
+    def run_csv_upload(table_name):
+        """
+        CSV をバッファから直接チャンク単位で読み（C エンジン）、チャンクごとに前処理して POST するジョブ
+        """
+        def run(job):
+            source = io.BytesIO(job.source)
+            # JAN 列は文字列のまま読む（チャンクごとの型推定で "….0" にならないように）
+            header = pd.read_csv(source, nrows=0, encoding="utf-8-sig").columns
+            source.seek(0)
+            reader = pd.read_csv(
+                source,
+                sep=",",
+                engine="c",
+                on_bad_lines="skip",
+                encoding="utf-8-sig",
+                dtype={c: str for c in header if is_jan_header(c)},
+                chunksize=UPLOAD_CHUNK_ROWS,
+            )
+            chunks = (preprocess_csv(chunk, table_name, show_columns=False) for chunk in reader)
+            total = stream_upload(table_name, chunks, UPLOAD_KEYS.get(table_name, ["jan"]), job)
+            return f"✅ {table_name} に {total} 件アップロード完了"
+        return run
+
+    def upload_file(file, table_name):
+        if not file:
+            return
+        try:
+            # 列名の表示と必須列のチェックは見出しだけで先に行う（ジョブの中では st.* を使えない）
+            header = pd.read_csv(file, nrows=0, encoding="utf-8-sig")
+            file.seek(0)
+            preprocess_csv(header, table_name)
+        except Exception as e:
+            st.error(f"❌ {table_name} アップロード中にエラー: {e}")
+            return
+        submit_upload(file, table_name, run_csv_upload(table_name))
 
     sales_file = st.file_uploader("📎 sales.csv アップロード", type="csv")
     if sales_file:
@@ -1302,43 +1210,74 @@ if mode == "csv_upload":
     if item_file:
         upload_file(item_file, "item_master")
 
+    # 在庫ファイルは差分（変わった行だけ）を送る。オフにすると全削除 → 全件投入
+    delta_upload = st.checkbox("🔁 在庫は差分アップロード（変更行のみ送信）", value=True)
+    stock_mode = "delta" if delta_upload else "full"
+
+    def delta_message(table_name, stats):
+        return (
+            f"✅ {table_name} に差分を反映: 追加 {stats['inserted']} / 更新 {stats['updated']} / "
+            f"削除 {stats['deleted']} / 変更なし {stats['unchanged']} 件"
+        )
+
     # ✅ これもモード内に入れる！
     warehouse_file = st.file_uploader("🏢 倉庫在庫.xlsx アップロード", type=["xlsx"])
     if warehouse_file:
-        def preprocess_warehouse_stock(file):
-            df = pd.read_excel(file, sheet_name="倉庫在庫")
-            df_upload = df.iloc[:, [9, 13, 22]].copy()  # J, N, W
-            df_upload.columns = ["product_code", "stock_available", "jan"]
-            df_upload["product_code"] = df_upload["product_code"].astype(str).str.strip()
-            df_upload["jan"] = df_upload["jan"].astype(str).str.strip()
+        # 使う列（0始まりの列番号 → 列名）: J, N, W
+        WAREHOUSE_COLUMNS = {9: "product_code", 13: "stock_available", 22: "jan"}
+
+        def read_warehouse_stock_chunks(file):
+            """
+            「倉庫在庫」シートを読み取り専用で1行ずつ読み、J / N / W 列だけを
+            UPLOAD_CHUNK_ROWS 行ごとの DataFrame にして返す（シート全体は展開しない）。
+            """
+            wb = load_workbook(file, read_only=True, data_only=True)
+            try:
+                ws = wb["倉庫在庫"]
+                rows = []
+                # 1行目は見出し。W 列より右は読まない
+                for row in ws.iter_rows(min_row=2, max_col=max(WAREHOUSE_COLUMNS) + 1, values_only=True):
+                    if all(v is None for v in row):
+                        continue
+                    rows.append([row[i] if i < len(row) else None for i in WAREHOUSE_COLUMNS])
+                    if len(rows) >= UPLOAD_CHUNK_ROWS:
+                        yield preprocess_warehouse_stock(pd.DataFrame(rows, columns=list(WAREHOUSE_COLUMNS.values())))
+                        rows = []
+                if rows:
+                    yield preprocess_warehouse_stock(pd.DataFrame(rows, columns=list(WAREHOUSE_COLUMNS.values())))
+            finally:
+                wb.close()
+
+        def preprocess_warehouse_stock(df_upload):
+            # 空セル（None）は read_excel と同じく NaN として扱う
+            df_upload = df_upload.astype(object).where(df_upload.notna(), float("nan"))
+            df_upload["product_code"] = normalize_jan(df_upload["product_code"])
+            df_upload["jan"] = normalize_jan(df_upload["jan"])
             df_upload["stock_available"] = pd.to_numeric(df_upload["stock_available"], errors="coerce").fillna(0).round().astype(int)
             return df_upload
 
-        def upload_warehouse_stock(df):
-            try:
-                requests.delete(f"{SUPABASE_URL}/rest/v1/warehouse_stock?product_code=neq.null", headers=HEADERS)
-                df = df.drop_duplicates(subset=["product_code"], keep="last")
-                df = df.replace({pd.NA: None, pd.NaT: None, float("nan"): None}).where(pd.notnull(df), None)
-
-                for i in range(0, len(df), 500):
-                    batch = df.iloc[i:i+500].to_dict(orient="records")
-                    res = requests.post(
-                        f"{SUPABASE_URL}/rest/v1/warehouse_stock",
-                        headers={**HEADERS, "Prefer": "resolution=merge-duplicates"},
-                        json=batch
+        def run_warehouse_upload(delta):
+            def run(job):
+                chunks = read_warehouse_stock_chunks(io.BytesIO(job.source))
+                if delta:
+                    # 差分は全体と比べるので結合する（3列だけなので小さい）。再開時も最初から比べ直す
+                    parts = list(chunks)
+                    if not parts:
+                        raise ValueError("⚠️ warehouse_stock のデータ行がありません")
+                    df = pd.concat(parts, ignore_index=True)
+                    stats = apply_delta(
+                        supabase, "warehouse_stock", df, "product_code",
+                        ["stock_available", "jan"], numeric_cols=["stock_available"],
+                        progress=job.add_progress,
                     )
-                    if res.status_code not in [200, 201]:
-                        st.error(f"❌ warehouse_stock バッチPOST失敗: {res.status_code} {res.text}")
-                        return
+                    return delta_message("warehouse_stock", stats)
 
-                st.success(f"✅ warehouse_stock に {len(df)} 件アップロード完了")
+                # 全件入れ替えは読めたチャンクから順に送る
+                total = stream_upload("warehouse_stock", chunks, ["product_code"], job)
+                return f"✅ warehouse_stock に {total} 件アップロード完了"
+            return run
 
-            except Exception as e:
-                st.error(f"❌ warehouse_stock アップロード中にエラー: {e}")
-
-        with st.spinner("📤 倉庫在庫.xlsx を処理中..."):
-            df_warehouse = preprocess_warehouse_stock(warehouse_file)
-            upload_warehouse_stock(df_warehouse)
+        submit_upload(warehouse_file, "warehouse_stock", run_warehouse_upload(delta_upload), stock_mode)
 
     benten_file = st.file_uploader("🏭 BENTEN倉庫在庫（CSV）アップロード", type=["csv"])
     if benten_file:
@@ -1359,36 +1298,64 @@ if mode == "csv_upload":
 
             df = df[[upc_col, stock_col]].copy()
             df.rename(columns={upc_col: "jan", stock_col: "stock"}, inplace=True)
-            df["jan"] = df["jan"].astype(str).str.strip()
+            df["jan"] = normalize_jan(df["jan"])
             df["stock"] = pd.to_numeric(df["stock"], errors="coerce").fillna(0).round().astype(int)
             df["updated_at"] = pd.Timestamp.now().isoformat()
             return df
 
-        def upload_benten_stock(df):
-            try:
-                requests.delete(f"{SUPABASE_URL}/rest/v1/benten_stock?jan=neq.null", headers=HEADERS)
-                df = df.drop_duplicates(subset=["jan"], keep="last")
-                df = df.replace({pd.NA: None, pd.NaT: None, float("nan"): None}).where(pd.notnull(df), None)
-
-                for i in range(0, len(df), 500):
-                    batch = df.iloc[i:i+500].to_dict(orient="records")
-                    res = requests.post(
-                        f"{SUPABASE_URL}/rest/v1/benten_stock",
-                        headers={**HEADERS, "Prefer": "resolution=merge-duplicates"},
-                        json=batch
+        def run_benten_upload(delta):
+            def run(job):
+                df = preprocess_benten_stock(io.BytesIO(job.source))
+                if delta:
+                    # updated_at は比較しない（変わった行だけ新しい updated_at で上書きされる）
+                    stats = apply_delta(
+                        supabase, "benten_stock", df, "jan", ["stock"], numeric_cols=["stock"],
+                        progress=job.add_progress,
                     )
-                    if res.status_code not in [200, 201]:
-                        st.error(f"❌ benten_stock バッチPOST失敗: {res.status_code} {res.text}")
-                        return
+                    return delta_message("benten_stock", stats)
 
-                st.success(f"✅ benten_stock に {len(df)} 件アップロード完了")
+                total = stream_upload("benten_stock", [df], ["jan"], job)
+                return f"✅ benten_stock に {total} 件アップロード完了"
+            return run
 
-            except Exception as e:
-                st.error(f"❌ benten_stock アップロード中にエラー: {e}")
+        submit_upload(benten_file, "benten_stock", run_benten_upload(delta_upload), stock_mode)
+
+    # 📊 進捗パネル（2秒ごとにこの部分だけ再描画）
+    @st.fragment(run_every=2)
+    def upload_progress_panel():
+        jobs = upload_jobs.jobs()
+        if not jobs:
+            return
+        st.markdown("#### 📊 アップロード状況")
+        for job in jobs:
+            label = f"{job.name} → {job.table}"
+            rows_per_sec, bytes_per_sec = job.rates()
+            stats = (
+                f"{job.rows:,} 行 / {job.bytes / 1e6:.1f} MB・"
+                f"{rows_per_sec:,.0f} 行/秒・{bytes_per_sec / 1e6:.2f} MB/秒"
+            )
+            resumed = f"・チャンク {job.resumed_from} から再開" if job.resumed_from else ""
+
+            if job.status == "queued":
+                st.info(f"🕒 {label}: 待機中{resumed}")
+            elif job.status == "running":
+                st.info(f"⏳ {label}: {stats}・書き込み済みチャンク {job.chunks_done}{resumed}")
+            elif job.status == "done":
+                st.success(f"{job.message}（{label}・{job.elapsed():.1f} 秒・{stats}）")
+                if st.button("🔁 もう一度アップロード", key=f"upload_redo_{job.job_id}"):
+                    upload_jobs.forget(job.job_id)
+                    st.rerun()
+            else:
+                st.error(f"❌ {label} アップロード中にエラー: {job.error}（書き込み済みチャンク {job.chunks_done}）")
+                col1, col2 = st.columns(2)
+                if col1.button("⏯ 続きから再開", key=f"upload_resume_{job.job_id}"):
+                    upload_jobs.resume(job.job_id)
+                    st.rerun()
+                if col2.button("🗑 破棄", key=f"upload_forget_{job.job_id}"):
+                    upload_jobs.forget(job.job_id)
+                    st.rerun()
 
-        with st.spinner("📤 BENTEN倉庫CSV を処理中..."):
-            df_benten = preprocess_benten_stock(benten_file)
-            upload_benten_stock(df_benten)
+    upload_progress_panel()
 
 
 
@@ -1396,77 +1363,94 @@ if mode == "csv_upload":
 elif mode == "monthly_sales":
     st.subheader("📊 販売実績（直近1ヶ月）")
 
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    HEADERS = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    # ✅ データ取得関数
-    def fetch_data(table_name):
-        headers = {**HEADERS, "Prefer": "count=exact"}
-        dfs = []
-        offset, limit = 0, 1000
-        while True:
-            url = f"{SUPABASE_URL}/rest/v1/{table_name}?select=*&offset={offset}&limit={limit}"
-            res = requests.get(url, headers=headers)
-            if res.status_code == 416 or not res.json():
-                break
-            if res.status_code not in [200, 206]:
-                st.error(f"{table_name} の取得に失敗: {res.status_code} / {res.text}")
-                return pd.DataFrame()
-            dfs.append(pd.DataFrame(res.json()))
-            offset += limit
-        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
-
-    # データ取得
-    df_master = fetch_data("item_master")
-    df_sales = fetch_data("sales")
-    df_warehouse = fetch_data("warehouse_stock")
-
-    if df_master.empty or df_sales.empty or df_warehouse.empty:
-        st.warning("必要なデータが存在しません。")
-        st.stop()
+    master_cols = ["jan", "商品コード", "ランク", "メーカー名", "商品名", "取扱区分"]
+    sales_cols = ["jan", "quantity_sold", "stock_ordered"]
+    warehouse_cols = ["product_code", "stock_available"]
+
+    # 検索UI（サーバ側絞り込み時は候補を DISTINCT キャッシュから）
+    server_filtered = False
+    if SEARCH_SERVER_FILTER:
+        cond = common_search_ui(fetch_search_options(), language)
+        server_filtered = is_narrowing_search(cond)
+
+    engine = select_engine("monthly_sales")
+    started = time.perf_counter()
+
+    # データ取得（item 360 が作成済みならそれを使う。未作成で条件が狭いときだけサーバ側で絞り込む）
+    df_joined = None
+    df_360 = item_view.peek()
+    if server_filtered and df_360 is None:
+        # 条件に一致する商品と、その販売実績・在庫だけを取得（sales.jan / product_code は商品コード）
+        engine = ENGINE_PANDAS
+        df_master = fetch_item_master_filtered(cond, master_cols)
+        codes = df_master["商品コード"].astype(str)
+        df_sales = fetch_rows_in("sales", "jan", codes, sales_cols)
+        df_warehouse = fetch_rows_in("warehouse_stock", "product_code", codes, warehouse_cols)
+
+        # item_master 整形
+        df_master["jan"] = normalize_jan(df_master["jan"])
+        df_master["商品コード"] = normalize_jan(df_master["商品コード"])
+
+        # warehouse_stock（商品コードで照合）
+        df_warehouse["product_code"] = normalize_jan(df_warehouse["product_code"])
+        stock = df_warehouse.drop_duplicates(subset=["product_code"]).set_index("product_code")["stock_available"]
+        df_master["利用可能在庫"] = pd.to_numeric(df_master["商品コード"].map(stock), errors="coerce")
+        df_master = df_master.drop_duplicates(subset=["商品コード"]).rename(columns={"jan": "JAN"})
+    else:
+        server_filtered = False
+        df_360 = df_360 if df_360 is not None else fetch_item_360()
+        if df_360.empty:
+            st.warning("必要なデータが存在しません。")
+            st.stop()
 
-    # item_master 整形
-    df_master["jan"] = df_master["jan"].astype(str)
-    df_master["商品コード"] = df_master["商品コード"].astype(str)
-    df_master = df_master.rename(columns={"jan": "JAN"})
+        # item 360 の JD在庫 をそのまま使う（再結合なし）
+        df_master = (
+            df_360[master_cols + ["JD在庫"]]
+            .rename(columns={"JD在庫": "利用可能在庫"})
+            .drop_duplicates(subset=["商品コード"])
+            .rename(columns={"jan": "JAN"})
+        )
+        if engine == ENGINE_DUCKDB:
+            # sales の読み込み・結合・販売数 > 0 の絞り込みまで DuckDB で
+            df_joined = run_duckdb(duckdb_engine.monthly_sales, df_master)
+        if df_joined is None:
+            engine = ENGINE_PANDAS
+            df_sales = fetch_table("sales", sales_cols)
+            if df_sales.empty:
+                st.warning("必要なデータが存在しません。")
+                st.stop()
+
+    if df_joined is None:
+        # sales 整形
+        df_sales["商品コード"] = normalize_jan(df_sales["jan"])
+        df_sales.rename(columns={"quantity_sold": "販売数"}, inplace=True)
+
+        # --- マージ ---
+        df_joined = pd.merge(df_sales, df_master, on="商品コード", how="left")
+
+        # --- JAN ---
+        if "JAN" in df_joined.columns:
+            df_joined["jan"] = df_joined["JAN"]
+        else:
+            st.warning("⚠️ item_master 側からJANが取得できませんでした。")
 
-    # sales 整形
-    df_sales["商品コード"] = df_sales["jan"].astype(str)
-    df_sales.rename(columns={"quantity_sold": "販売数"}, inplace=True)
+        # --- 数値列（販売数は取得時に int32） ---
+        df_joined["発注済"] = pd.to_numeric(df_joined.get("stock_ordered", 0), errors="coerce").fillna(0).astype(int)
+        df_joined["利用可能"] = df_joined["利用可能在庫"].fillna(0).astype(int)
+        df_joined.drop(columns=["利用可能在庫"], inplace=True)
 
-    # warehouse_stock 整形
-    df_warehouse["product_code"] = df_warehouse["product_code"].astype(str)
-    df_warehouse = df_warehouse.rename(columns={
-        "product_code": "商品コード",
-        "stock_available": "利用可能在庫"
-    })
+        # 販売数 > 0 のみ
+        df_joined = df_joined[df_joined["販売数"] > 0]
 
-    # --- マージ ---
-    df_joined = pd.merge(df_sales, df_master, on="商品コード", how="left")
-    df_joined = pd.merge(df_joined, df_warehouse[["商品コード", "利用可能在庫"]], on="商品コード", how="left")
+    show_engine_timing("monthly_sales", engine, time.perf_counter() - started)
 
-    # --- JAN ---
-    if "JAN" in df_joined.columns:
-        df_joined["jan"] = df_joined["JAN"]
+    # ---------- 🔍 絞り込み（商品情報検索と共通） ----------
+    if server_filtered:
+        df_view = df_joined
+    elif SEARCH_SERVER_FILTER:
+        df_view = filter_search_frame(df_joined, cond)
     else:
-        st.warning("⚠️ item_master 側からJANが取得できませんでした。")
-
-    # --- 数値列 ---
-    df_joined["販売数"] = pd.to_numeric(df_joined["販売数"], errors="coerce").fillna(0).astype(int)
-    df_joined["発注済"] = pd.to_numeric(df_joined.get("stock_ordered", 0), errors="coerce").fillna(0).astype(int)
-    df_joined["利用可能"] = df_joined["利用可能在庫"].fillna(0).astype(int)
-    df_joined.drop(columns=["利用可能在庫"], inplace=True)
-
-    # 販売数 > 0 のみ
-    df_joined = df_joined[df_joined["販売数"] > 0]
-
-    # ---------- 🔍 検索UI ＋ 絞り込み（商品情報検索と共通） ----------
-    df_view = apply_common_search_ui(df_joined, language)
+        df_view = apply_common_search_ui(df_joined, language)
 
     # ---------- 📋 表示 ----------
     view_cols = [
@@ -1505,78 +1489,25 @@ elif mode == "rank_check":
     st.subheader("📌 ランク商品確認モード")
 
     # =========================
-    # データ取得
-    # =========================
-    df_item = fetch_table("item_master")
-    df_sales = fetch_table("sales")
-    df_stock = fetch_table("warehouse_stock")
-    df_benten = fetch_table("benten_stock")
-    df_history = fetch_table("purchase_history")
-    
-    # =========================
-    # 必須/任意 テーブル判定
+    # データ取得（商品・JD在庫・弁天在庫・上海控除後の発注済は item 360 から）
     # =========================
-    required = {
-        "item_master": df_item,
-        "sales": df_sales,
-        "warehouse_stock": df_stock,
-    }
-    
-    optional = {
-        "benten_stock": df_benten,
-        "purchase_history": df_history,
-    }
-    
+    df_item = fetch_item_360()
+
     # 必須が空なら止める
-    empty_required = [name for name, df in required.items() if df is None or df.empty]
-    if empty_required:
-        st.warning(f"必要なテーブルが空です（必須）: {', '.join(empty_required)}")
+    if df_item is None or df_item.empty:
+        st.warning("必要なテーブルが空です（必須）: item_master")
         st.stop()
-    
-    # 任意が空なら 0行DFを用意して続行
-    if df_benten is None or df_benten.empty:
-        # jan / stock だけあれば後続の merge が成立する
-        df_benten = pd.DataFrame(columns=["jan", "stock"])
-    
-    if df_history is None or df_history.empty:
-        # jan / quantity / memo があれば後続処理が成立する
-        df_history = pd.DataFrame(columns=["jan", "quantity", "memo"])
-
-    # =========================
-    # データ整形（item_master）
-    # =========================
-    df_item["jan"] = df_item["jan"].astype(str).str.strip()
-    df_item.loc[df_item["jan"].isin(["", "nan", "None", "NULL"]), "jan"] = None
-    df_item["ランク"] = df_item["ランク"].astype(str).str.strip()
-    df_item["商品名"] = df_item["商品名"].astype(str)
-    df_item["メーカー名"] = df_item["メーカー名"].astype(str)
-
-    # =========================
-    # 発注済（上海除外）
-    # =========================
-    df_history["quantity"] = pd.to_numeric(df_history["quantity"], errors="coerce").fillna(0).astype(int)
-    df_history["memo"] = df_history["memo"].astype(str).fillna("")
-    df_history["jan"] = df_history["jan"].astype(str).str.strip()
-
-    df_shanghai = df_history[df_history["memo"].str.contains("上海", na=False)]
-    df_shanghai_grouped = (
-        df_shanghai.groupby("jan")["quantity"]
-        .sum()
-        .reset_index(name="shanghai_quantity")
-    )
-
-    df_item["発注済"] = pd.to_numeric(df_item["発注済"], errors="coerce").fillna(0).astype(int)
-    df_item = df_item.merge(df_shanghai_grouped, on="jan", how="left")
-    df_item["shanghai_quantity"] = df_item["shanghai_quantity"].fillna(0).astype(int)
-    df_item["発注済"] = (df_item["発注済"] - df_item["shanghai_quantity"]).clip(lower=0)
 
     # =========================
     # 対象商品（JANありは必須。ランクは全部OK：TEST含む）
     # =========================
-    df_ab = df_item[df_item["jan"].notnull()].copy()
-
-    df_ab["JAN"] = df_ab["jan"].astype(str).str.strip()
-    df_ab = df_ab.drop_duplicates(subset=["JAN"])
+    df_ab = (
+        df_item[~df_item["jan"].isin(["", "nan", "None", "NULL"])]
+        .drop_duplicates(subset=["jan"])
+        .rename(columns={"jan": "JAN"})
+    )
+    # ランクは前後の空白を除いて比較する（ランク候補と同じ値にする）
+    df_ab["ランク"] = df_ab["ランク"].astype(str).str.strip()
 
     # =========================
     # フィルターUI（ランク候補を自動生成）
@@ -1613,36 +1544,14 @@ elif mode == "rank_check":
         st.warning("⚠️ ランクが登録されていないため、ランクフィルタを表示できません。")
         selected_ranks = []
 
+    check_1_0 = st.checkbox("✅ 発注アラート1.0のみ表示", value=False)
+    check_1_2 = st.checkbox("✅ 発注アラート1.2のみ表示", value=False)
 
-    # =========================
-    # sales → JAN（実績30日）
-    # =========================
-    df_sales["JAN"] = df_sales["jan"].astype(str).str.strip()
-
-    df_sales_30 = (
-        df_sales.groupby("JAN", as_index=False)["quantity_sold"]
-        .sum()
-        .rename(columns={"quantity_sold": "実績（30日）"})
-    )
-
-    # =========================
-    # 在庫
-    # =========================
-    df_stock["JAN"] = df_stock["jan"].astype(str).str.strip()
-    df_stock = df_stock.rename(columns={"stock_available": "JD在庫"})
-
-    df_benten["JAN"] = df_benten["jan"].astype(str).str.strip()
-    df_benten = df_benten.rename(columns={"stock": "弁天在庫"})
+    engine = select_engine("rank_check")
+    started = time.perf_counter()
 
     # =========================
-    # 発注済
-    # =========================
-    df_item_sub = df_item[["jan", "発注済"]].copy()
-    df_item_sub["JAN"] = df_item_sub["jan"].astype(str).str.strip()
-    df_item_sub = df_item_sub[["JAN", "発注済"]]
-
-    # =========================
-    # マージ
+    # マージ（在庫・発注済は item 360 の列をそのまま使う）
     # =========================
     base_cols = [
         "JAN",
@@ -1650,60 +1559,84 @@ elif mode == "rank_check":
         "メーカー名",
         "ランク",
         "ケース入数",
-        "発注ロット"
+        "発注ロット",
+        "purchase_cost",
+        "発注済_修正後",
+        "JD在庫_倉庫JAN",
+        "弁天在庫",
     ]
 
-    if "purchase_cost" in df_ab.columns:
-        base_cols.append("purchase_cost")
-
-    df_merged = (
-        df_ab[base_cols]
-        .rename(columns={"purchase_cost": "最安原価"})
-        .merge(df_sales_30, on="JAN", how="left")
-        .merge(df_item_sub, on="JAN", how="left")
-        .merge(df_stock[["JAN", "JD在庫"]], on="JAN", how="left")
-        .merge(df_benten[["JAN", "弁天在庫"]], on="JAN", how="left")
+    # JD在庫 は従来どおり warehouse_stock.jan を JAN で照合した値
+    df_base = df_ab[base_cols].rename(
+        columns={"purchase_cost": "最安原価", "発注済_修正後": "発注済", "JD在庫_倉庫JAN": "JD在庫"}
     )
+    df_base["最安原価"] = pd.to_numeric(df_base["最安原価"], errors="coerce")
+
+    df_result = None
+    if engine == ENGINE_DUCKDB:
+        # sales の集計（実績30日）・結合・発注アラート・条件フィルターまで DuckDB で
+        df_result = run_duckdb(
+            duckdb_engine.rank_check, df_base, selected_ranks,
+            name=name_filter,
+            maker=None if selected_maker == "すべて" else selected_maker,
+            alert_1_0=check_1_0, alert_1_2=check_1_2,
+        )
 
-    # =========================
-    # 欠損補完
-    # =========================
-    df_merged["実績（30日）"] = df_merged["実績（30日）"].fillna(0)
-    df_merged["発注済"] = df_merged["発注済"].fillna(0).astype(int)
-    df_merged["JD在庫"] = df_merged["JD在庫"].fillna(0)
-    df_merged["弁天在庫"] = df_merged["弁天在庫"].fillna(0)
-    df_merged["最安原価"] = pd.to_numeric(df_merged.get("最安原価"), errors="coerce")
+    if df_result is None:
+        engine = ENGINE_PANDAS
+        df_sales = fetch_table("sales", ["jan", "quantity_sold"])
+        if df_sales.empty:
+            st.warning("必要なテーブルが空です（必須）: sales")
+            st.stop()
 
-    # =========================
-    # 発注アラート
-    # =========================
-    df_merged["発注アラート1.0"] = df_merged["実績（30日）"] > (
-        df_merged["JD在庫"] + df_merged["弁天在庫"] + df_merged["発注済"]
-    )
+        # =========================
+        # sales → JAN（実績30日）
+        # =========================
+        df_sales["JAN"] = normalize_jan(df_sales["jan"])
 
-    df_merged["発注アラート1.2"] = (df_merged["実績（30日）"] * 1.2) > (
-        df_merged["JD在庫"] + df_merged["弁天在庫"] + df_merged["発注済"]
-    )
+        df_sales_30 = (
+            df_sales.groupby("JAN", as_index=False)["quantity_sold"]
+            .sum()
+            .rename(columns={"quantity_sold": "実績（30日）"})
+        )
 
-    # =========================
-    # 条件フィルター
-    # =========================
-    check_1_0 = st.checkbox("✅ 発注アラート1.0のみ表示", value=False)
-    check_1_2 = st.checkbox("✅ 発注アラート1.2のみ表示", value=False)
+        df_merged = df_base.merge(df_sales_30, on="JAN", how="left")
+
+        # =========================
+        # 欠損補完
+        # =========================
+        df_merged["実績（30日）"] = df_merged["実績（30日）"].fillna(0)
+
+        # =========================
+        # 発注アラート
+        # =========================
+        df_merged["発注アラート1.0"] = df_merged["実績（30日）"] > (
+            df_merged["JD在庫"] + df_merged["弁天在庫"] + df_merged["発注済"]
+        )
+
+        df_merged["発注アラート1.2"] = (df_merged["実績（30日）"] * 1.2) > (
+            df_merged["JD在庫"] + df_merged["弁天在庫"] + df_merged["発注済"]
+        )
 
-    df_result = df_merged[df_merged["ランク"].isin(selected_ranks)].copy()
+        # =========================
+        # 条件フィルター
+        # =========================
+        df_result = df_merged[df_merged["ランク"].isin(selected_ranks)].copy()
 
-    if name_filter:
-        df_result = df_result[df_result["商品名"].str.contains(name_filter, case=False, na=False)]
+        if name_filter:
+            # 部分一致（記号を正規表現として扱わない。DuckDB と同じ）
+            df_result = df_result[df_result["商品名"].str.contains(name_filter, case=False, na=False, regex=False)]
 
-    if selected_maker != "すべて":
-        df_result = df_result[df_result["メーカー名"] == selected_maker]
+        if selected_maker != "すべて":
+            df_result = df_result[df_result["メーカー名"] == selected_maker]
 
-    if check_1_0:
-        df_result = df_result[df_result["発注アラート1.0"]]
+        if check_1_0:
+            df_result = df_result[df_result["発注アラート1.0"]]
 
-    if check_1_2:
-        df_result = df_result[df_result["発注アラート1.2"]]
+        if check_1_2:
+            df_result = df_result[df_result["発注アラート1.2"]]
+
+    show_engine_timing("rank_check", engine, time.perf_counter() - started)
 
     # =========================
     # 出力
@@ -1730,15 +1663,7 @@ elif mode == "rank_check":
 elif mode == "difficult_items":
     st.subheader("🚫 入荷困難商品モード")
 
-    SUPABASE_URL = st.secrets["SUPABASE_URL"]
-    SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-    HEADERS = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    df = fetch_table("difficult_items")
+    df = fetch_table("difficult_items", ["item_key", "reason", "note", "created_at", "updated_at", "id"])
     if not df.empty:
         df["created_at"] = pd.to_datetime(df["created_at"]).dt.strftime("%Y-%m-%d %H:%M:%S")
         df["updated_at"] = pd.to_datetime(df["updated_at"]).dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -1779,16 +1704,9 @@ elif mode == "difficult_items":
                     record["action"] = "delete"
                     record["action_at"] = datetime.datetime.now(ZoneInfo("Asia/Tokyo")).isoformat()
         
-                    res1 = requests.post(
-                        f"{SUPABASE_URL}/rest/v1/difficult_items_history",
-                        headers={**HEADERS, "Prefer": "return=representation"},
-                        json=record
-                    )
+                    res1 = supabase.insert("difficult_items_history", record, prefer="return=representation")
         
-                    res2 = requests.delete(
-                        f"{SUPABASE_URL}/rest/v1/difficult_items?id=eq.{_id}",
-                        headers=HEADERS
-                    )
+                    res2 = supabase.delete("difficult_items", f"id=eq.{_id}")
         
                 st.success("✅ 削除完了！")
                 st.rerun()
@@ -1808,11 +1726,7 @@ elif mode == "difficult_items":
                 "note": note
             }
 
-            res = requests.post(
-                f"{SUPABASE_URL}/rest/v1/difficult_items",
-                headers={**HEADERS, "Prefer": "return=representation"},
-                json=payload
-            )
+            res = supabase.insert("difficult_items", payload, prefer="return=representation")
             st.write("登録POST:", res.status_code, res.text)
 
             if res.status_code in [200, 201]:
@@ -1824,11 +1738,7 @@ elif mode == "difficult_items":
                 record["action"] = "insert"
                 record["action_at"] = datetime.datetime.now(ZoneInfo("Asia/Tokyo")).isoformat()
 
-                res2 = requests.post(
-                    f"{SUPABASE_URL}/rest/v1/difficult_items_history",
-                    headers={**HEADERS, "Prefer": "return=representation"},
-                    json=record
-                )
+                res2 = supabase.insert("difficult_items_history", record, prefer="return=representation")
 
                 st.success("✅ 登録しました！")
                 st.rerun()
@@ -1954,12 +1864,12 @@ elif mode == "order":
 
     # ---------- 発注書生成 ----------
     if df_order is not None and not df_order.empty:
-        df_item = fetch_table("item_master")
+        df_item = fetch_table("item_master", ["jan", "商品コード", "商品名", "納税スケジュール"])
         df_item.columns = df_item.columns.str.strip().str.lower()
 
         # JAN整形（先頭00000を削除）
-        df_order["jan"] = df_order["jan"].astype(str).str.strip().str.replace(r"^0{5,}", "", regex=True)
-        df_item["jan"] = df_item["jan"].astype(str).str.strip().str.replace(r"^0{5,}", "", regex=True)
+        df_order["jan"] = normalize_jan(df_order["jan"], leading_zeros=5)
+        df_item["jan"] = normalize_jan(df_item["jan"], leading_zeros=5)
 
         # 税率判定関数
         def get_tax_rate(schedule):
@@ -2020,50 +1930,102 @@ elif mode == "order":
 elif mode == "store_profit":
     st.subheader("🏪 店舗別粗利一覧")
 
-    # Supabase からデータ取得
-    df = fetch_table("store_profit_lines")
+    # =========================
+    # データ取得（期間一覧 → 選択期間の店舗別集計だけ）
+    # =========================
+    # 期間一覧・店舗別集計はサーバ側の RPC で取得し、明細や original_line は読まない。
+    # RPC が未作成のプロジェクトでは、期間列だけ / 選択期間の明細だけを取得して pandas で集計する。
+    #
+    #   create or replace function store_profit_periods()
+    #   returns table(report_period text) language sql stable as $$
+    #     select distinct report_period from store_profit_lines
+    #     where report_period is not null order by 1 $$;
+    #
+    #   create or replace function store_profit_store_summary(p_period text)
+    #   returns table(store text, qty bigint, revenue bigint, defined_cost bigint, gross_profit bigint)
+    #   language sql stable as $$
+    #     select store, sum(trunc(qty))::bigint, sum(trunc(revenue))::bigint,
+    #            sum(trunc(defined_cost))::bigint, sum(trunc(gross_profit))::bigint
+    #     from store_profit_lines
+    #     where report_period = p_period and line_type = 'detail'
+    #     group by store $$;
+    SUM_COLS = ["qty", "revenue", "defined_cost", "gross_profit"]
+
+    def fetch_store_profit_periods():
+        r = supabase.rpc("store_profit_periods")
+        if r.status_code == 200:
+            return sorted({row["report_period"] for row in r.json() if row.get("report_period") is not None})
+        if not is_missing_function(r):
+            st.error(f"期間一覧の取得に失敗: {r.status_code} / {r.text}")
+            return []
+        df_periods = fetch_table("store_profit_lines", ["report_period"])
+        if "report_period" not in df_periods.columns:
+            return []
+        return sorted(df_periods["report_period"].dropna().unique())
+
+    def fetch_store_profit_lines(period):
+        return fetch_table(
+            "store_profit_lines", ["store"] + SUM_COLS,
+            filters=[("report_period", f"eq.{period}"), ("line_type", "eq.detail")],
+        )
 
-    if df is None or df.empty:
-        st.warning("store_profit_lines が空か、読み出せていません。")
-        st.info("次を確認してください：\n"
-                "1) Supabaseにデータがあるか（SQLで SELECT count(*)）\n"
-                "2) RLSが有効なら、匿名キー(anon)に対してSELECT許可ポリシーがあるか\n"
-                "3) fetch_table が 'store_profit_lines' を正しいプロジェクトに向けているか")
-        st.stop()
+    def fetch_store_profit_summary(period, engine=ENGINE_PANDAS):
+        if engine == ENGINE_DUCKDB:
+            # 明細を取得して DuckDB で店舗別に集計（RPC は使わない）
+            dfd = fetch_store_profit_lines(period)
+            if dfd.empty:
+                return pd.DataFrame(columns=["store"] + SUM_COLS)
+            grouped = run_duckdb(duckdb_engine.store_summary, dfd)
+            if grouped is not None:
+                return grouped
+
+        r = supabase.rpc("store_profit_store_summary", {"p_period": period})
+        if r.status_code == 200:
+            return pd.DataFrame(r.json(), columns=["store"] + SUM_COLS)
+        if not is_missing_function(r):
+            st.error(f"店舗別集計の取得に失敗: {r.status_code} / {r.text}")
+            st.stop()
 
-    # 列の存在チェック
-    required_cols = {"report_period","line_type","store","qty","revenue","defined_cost","gross_profit","original_line"}
-    missing = required_cols - set(df.columns)
-    if missing:
-        st.error(f"必要列が足りません: {missing}")
-        st.stop()
+        dfd = fetch_store_profit_lines(period)
+        if dfd.empty:
+            return pd.DataFrame(columns=["store"] + SUM_COLS)
+
+        # 列の存在チェック（数値列は取得時に int 化済み）
+        missing = {"store", *SUM_COLS} - set(dfd.columns)
+        if missing:
+            st.error(f"必要列が足りません: {missing}")
+            st.stop()
+
+        return (
+            dfd.groupby("store", as_index=False, observed=True)
+               .agg(qty=("qty","sum"),
+                    revenue=("revenue","sum"),
+                    defined_cost=("defined_cost","sum"),
+                    gross_profit=("gross_profit","sum"))
+        )
 
     # 期間選択
-    periods = sorted(df["report_period"].dropna().unique())
+    periods = fetch_store_profit_periods()
     if len(periods) == 0:
-        st.warning("report_period が見つかりません。アップロード時の period を確認してください。")
+        st.warning("store_profit_lines が空か、読み出せていません。")
+        st.info("次を確認してください：\n"
+                "1) Supabaseにデータがあるか（SQLで SELECT count(*)）\n"
+                "2) RLSが有効なら、匿名キー(anon)に対してSELECT許可ポリシーがあるか\n"
+                "3) アップロード時の report_period（period）が入っているか")
         st.stop()
     sel_period = st.selectbox("対象期間を選択", periods, index=len(periods)-1)
 
-    dfp = df[df["report_period"] == sel_period]
-
-    # 店舗別集計（detailのみ）
-    dfd = dfp[dfp["line_type"] == "detail"].copy()
-    if dfd.empty:
+    # 店舗別集計（detailのみ。pandas は集計用 RPC、無ければ明細を pandas で集計）
+    engine = select_engine("store_profit")
+    started = time.perf_counter()
+    grouped = fetch_store_profit_summary(sel_period, engine)
+    show_engine_timing("store_profit", engine, time.perf_counter() - started)
+    if grouped.empty:
         st.warning("この期間の明細行（line_type='detail'）がありません。CSVの取り込みを確認してください。")
         st.stop()
 
-    # 数値型に変換（念のため）
-    for c in ["qty","revenue","defined_cost","gross_profit"]:
-        dfd[c] = pd.to_numeric(dfd[c], errors="coerce").fillna(0).astype(int)
-
-    grouped = (
-        dfd.groupby("store", as_index=False)
-           .agg(qty=("qty","sum"),
-                revenue=("revenue","sum"),
-                defined_cost=("defined_cost","sum"),
-                gross_profit=("gross_profit","sum"))
-    )
+    for c in SUM_COLS:
+        grouped[c] = pd.to_numeric(grouped[c], errors="coerce").fillna(0).astype(int)
     grouped["gross_margin"] = (grouped["gross_profit"] / grouped["revenue"] * 100).fillna(0).round(2)
 
         # ---- 合計（全店）テーブルを先に表示する ---------------------------------
@@ -2229,21 +2191,63 @@ elif mode == "store_profit":
         mime="text/csv",
     )
 
-    csv_original = "\n".join(dfp["original_line"].tolist())
-    st.download_button(
-        "📥 元CSVをダウンロード（完全復元）",
-        csv_original,
-        file_name=f"store_profit_original_{sel_period}.csv",
-        mime="text/csv",
-    )
+    # 元CSV（original_line）は容量が大きいので、押されたときだけ選択期間分を取得する
+    original_key = f"store_profit_original_{sel_period}"
+    if original_key not in st.session_state:
+        if st.button("📄 元CSVを準備（完全復元）"):
+            try:
+                df_original = supabase.fetch_table(
+                    "store_profit_lines", ["original_line"],
+                    filters=[("report_period", f"eq.{sel_period}")],
+                )
+            except SupabaseError as e:
+                st.error(f"store_profit_lines の取得に失敗: {e.status_code} / {e.text}")
+                st.stop()
+            st.session_state[original_key] = "\n".join(df_original.get("original_line", pd.Series(dtype=str)).tolist())
+    if original_key in st.session_state:
+        st.download_button(
+            "📥 元CSVをダウンロード（完全復元）",
+            st.session_state[original_key],
+            file_name=f"store_profit_original_{sel_period}.csv",
+            mime="text/csv",
+        )
 
 elif mode == "daily_sales":
     st.subheader("📆 店舗別前日売上（最新日）")
 
-    df = fetch_table("store_profit_daily_lines")
-    if df is None or df.empty:
-        st.warning("store_profit_daily_lines が空か、読み出せていません。")
+    DAILY_COLS = ["report_date", "line_type", "store", "item", "item_name", "qty", "revenue", "defined_cost", "gross_profit"]
+    # 取得済みの日付をいくつ手元に残すか（日付ごとのローリングキャッシュ）
+    DAILY_CACHE_DAYS = int(st.secrets.get("DAILY_CACHE_DAYS", 14))
+
+    def fetch_latest_report_date():
+        """最新の report_date だけを1行取得（無ければ None）"""
+        df_latest, _ = supabase.select_frame(
+            "store_profit_daily_lines", ["report_date"],
+            [("report_date", "not.is.null")], order="report_date.desc", limit=1,
+        )
+        return None if df_latest.empty else df_latest["report_date"].iloc[0]
+
+    # 画面は最新日だけを表示する（最新日は追加・更新されることがあるので短い TTL）
+    @st.cache_data(ttl=300, max_entries=DAILY_CACHE_DAYS)
+    def fetch_daily_detail(report_date):
+        """指定日の detail 行だけを取得（日付ごとにキャッシュし、古い日付から捨てる）"""
+        return supabase.fetch_table(
+            "store_profit_daily_lines", DAILY_COLS,
+            filters=[("report_date", f"eq.{report_date}"), ("line_type", "eq.detail")],
+        )
+
+    # 最新日を先に聞いてから、その日の明細だけを取得
+    try:
+        latest_report_date = fetch_latest_report_date()
+        if latest_report_date is None:
+            st.warning("store_profit_daily_lines が空か、読み出せていません。")
+            st.stop()
+        df = fetch_daily_detail(latest_report_date)
+    except SupabaseError as e:
+        st.error(f"store_profit_daily_lines の取得に失敗: {e.status_code} / {e.text}")
         st.stop()
+    if df.empty:
+        df = pd.DataFrame(columns=DAILY_COLS)
 
     required = {"report_date","line_type","store","item","qty","revenue","defined_cost","gross_profit"}
     missing = required - set(df.columns)
@@ -2251,13 +2255,12 @@ elif mode == "daily_sales":
         st.error(f"必要列が足りません: {missing}")
         st.stop()
 
+    # qty / revenue / defined_cost / gross_profit は取得時に int 化済み
     df["report_date"] = pd.to_datetime(df["report_date"], errors="coerce").dt.date
-    for c in ["qty","revenue","defined_cost","gross_profit"]:
-        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0).astype(int)
 
-    # 最新日だけ
-    latest_date = df["report_date"].max()
-    cur = df[df["report_date"] == latest_date].copy()
+    # 最新日だけ（取得時に絞り込み済み）
+    latest_date = pd.to_datetime(latest_report_date, errors="coerce").date()
+    cur = df.copy()
 
     # detailのみ + 「合計/総計/計で始まる疑似明細」や EMPTY を除外
     pat_agg = r"^(合計|総計|計)\b"
@@ -2297,11 +2300,17 @@ elif mode == "daily_sales":
     )
 
     # ─ 店舗別：detail のみから集計 ─
-    cur_g = (cur_detail.groupby("store", as_index=False)
-                .agg(qty=("qty","sum"),
-                     revenue=("revenue","sum"),
-                     defined_cost=("defined_cost","sum"),
-                     gross_profit=("gross_profit","sum")))
+    engine = select_engine("daily_sales")
+    started = time.perf_counter()
+    cur_g = run_duckdb(duckdb_engine.store_summary, cur_detail) if engine == ENGINE_DUCKDB else None
+    if cur_g is None:
+        engine = ENGINE_PANDAS
+        cur_g = (cur_detail.groupby("store", as_index=False, observed=True)
+                    .agg(qty=("qty","sum"),
+                         revenue=("revenue","sum"),
+                         defined_cost=("defined_cost","sum"),
+                         gross_profit=("gross_profit","sum")))
+    show_engine_timing("daily_sales", engine, time.perf_counter() - started)
     cur_g["gross_margin"] = (
         (cur_g["gross_profit"] / cur_g["revenue"].replace({0: pd.NA}) * 100)
         .astype(float).round(2).fillna(0.0)
@@ -2350,10 +2359,6 @@ elif mode == "expiry_manage":
     # =========================
     st.subheader("🧊 賞味期限管理" if language == "日本語" else "🧊 保质期管理")
 
-    # --- Supabase（このファイル上部で定義済み：SUPABASE_URL_PRE / HEADERS_PRE を使う） ---
-    SUPABASE_URL = SUPABASE_URL_PRE
-    HEADERS = HEADERS_PRE
-
     # ---------- ラベル ----------
     LABEL = {
         "日本語": {
@@ -2482,15 +2487,6 @@ elif mode == "expiry_manage":
     # =========================
     # パース
     # =========================
-    def normalize_jan_cell(x) -> str | None:
-        if x is None:
-            return None
-        s = str(x).strip()
-        if not s:
-            return None
-        s = re.sub(r"\D", "", s)
-        return s if s else None
-
     def parse_date_cell(x):
         """
         Lark Sheets の日付は
@@ -2526,21 +2522,19 @@ elif mode == "expiry_manage":
     # Supabase upsert（REST）
     # =========================
     def supabase_truncate_item_expiry():
-        url = f"{SUPABASE_URL}/rest/v1/rpc/truncate_item_expiry"
-        r = requests.post(url, headers=HEADERS, json={}, timeout=60)
+        r = supabase.rpc("truncate_item_expiry", timeout=60)
         if r.status_code not in [200, 204]:
             raise RuntimeError(f"Supabase truncate failed: {r.status_code} {r.text}")
+        # RPC はテーブル名を持たないので、ここで明示的にキャッシュを破棄
+        supabase.notify_write("item_expiry")
 
     def supabase_upsert_item_expiry(rows: list[dict]) -> int:
         if not rows:
             return 0
-        url = f"{SUPABASE_URL}/rest/v1/item_expiry"
-        headers = {**HEADERS, "Prefer": "resolution=merge-duplicates,return=representation"}
-        r = requests.post(url, headers=headers, json=rows, timeout=60)
-        if r.status_code not in [200, 201]:
-            raise RuntimeError(f"Supabase upsert failed: {r.status_code} {r.text}")
-        data = r.json()
-        return len(data) if isinstance(data, list) else len(rows)
+        try:
+            return supabase.bulk_insert("item_expiry", rows)
+        except SupabaseError as e:
+            raise RuntimeError(f"Supabase upsert failed: {e.status_code} {e.text}")
 
     def sync_lark_to_supabase() -> dict:
         # ★ 同期時は Supabase 側を全削除してから upsert
@@ -2559,10 +2553,11 @@ elif mode == "expiry_manage":
 
         upserts = []
         errors = []
+        # A列（JAN）は列ごとまとめて正規化（数字以外は除去、数値セルの ".0" も除去）
+        jans = normalize_jan([row[0] if len(row) > 0 else None for row in values[1:]], digits_only=True)
 
         for row_idx, row in enumerate(values[1:], start=2):
             try:
-                a = row[0] if len(row) > 0 else None
                 b = row[1] if len(row) > 1 else None
                 c = row[2] if len(row) > 2 else None
                 d = row[3] if len(row) > 3 else None
@@ -2570,7 +2565,7 @@ elif mode == "expiry_manage":
                 f = row[5] if len(row) > 5 else None
                 g = row[6] if len(row) > 6 else None
 
-                jan = normalize_jan_cell(a)
+                jan = jans.iat[row_idx - 2]
                 if not jan:
                     continue
 
@@ -2596,9 +2591,7 @@ elif mode == "expiry_manage":
             except Exception as ex:
                 errors.append({"row": row_idx, "raw": row, "error": str(ex)})
 
-        upserted_total = 0
-        for i in range(0, len(upserts), 500):
-            upserted_total += supabase_upsert_item_expiry(upserts[i:i+500])
+        upserted_total = supabase_upsert_item_expiry(upserts)
 
         return {"upserted": upserted_total, "errors": errors}
 
@@ -2629,14 +2622,12 @@ elif mode == "expiry_manage":
     # =========================
     # 一覧取得（Supabase → pandas）
     # =========================
-    @st.cache_data(ttl=60)
     def fetch_item_expiry():
-        url = f"{SUPABASE_URL}/rest/v1/item_expiry?select=*"
-        r = requests.get(url, headers=HEADERS, timeout=60)
-        if r.status_code != 200:
-            st.error(f"{LABEL['fetch_failed_item_expiry']}: {r.status_code} / {r.text}")
+        try:
+            return table_cache.get("item_expiry").copy()
+        except SupabaseError as e:
+            st.error(f"{LABEL['fetch_failed_item_expiry']}: {e.status_code} / {e.text}")
             return pd.DataFrame()
-        return pd.DataFrame(r.json())
 
     def chunk_list(lst, size=500):
         for i in range(0, len(lst), size):
@@ -2657,11 +2648,7 @@ elif mode == "expiry_manage":
 
         for chunk in chunk_list(jans, 500):
             joined = ",".join(chunk)
-            url = (
-                f"{SUPABASE_URL}/rest/v1/warehouse_stock"
-                f"?select=jan,stock_available&jan=in.({joined})"
-            )
-            r = requests.get(url, headers=HEADERS, timeout=60)
+            r = supabase.select("warehouse_stock", f"select=jan,stock_available&jan=in.({joined})")
             if r.status_code != 200:
                 st.error(f"{LABEL['fetch_failed_warehouse']}: {r.status_code} / {r.text}")
                 continue
@@ -2674,7 +2661,7 @@ elif mode == "expiry_manage":
         if df_stock.empty:
             return pd.DataFrame(columns=["jan", "stock_available"])
 
-        df_stock["jan"] = df_stock["jan"].astype(str).str.strip()
+        df_stock["jan"] = normalize_jan(df_stock["jan"])
         df_stock["stock_available"] = pd.to_numeric(df_stock["stock_available"], errors="coerce").fillna(0).astype(int)
 
         # JAN重複があり得るなら安全に集約
@@ -2690,8 +2677,8 @@ elif mode == "expiry_manage":
         st.info(LABEL["no_data"])
         st.stop()
 
-    df["jan"] = df["jan"].astype(str).str.strip()
-    jans = df["jan"].dropna().astype(str).str.strip().unique().tolist()
+    df["jan"] = normalize_jan(df["jan"])
+    jans = [j for j in df["jan"].unique() if j]
     df_stock = fetch_warehouse_stock_by_jans(jans)
 
     # left join：item_expiry を主にして在庫を付与
@@ -2703,7 +2690,6 @@ elif mode == "expiry_manage":
     # =========================
     # 表示用加工
     # =========================
-    df["jan"] = df["jan"].astype(str).str.strip()
     df["name"] = df["name"].astype(str).fillna("").str.strip()
 
     expiry_cols = ["expiry_1", "expiry_2", "expiry_3", "expiry_4", "expiry_5"]
@@ -0,0 +1,506 @@
+"""
+発注AI判定 / 仕入価格改善リストの計算エンジン（ベクトル化版）
+
+Streamlit に依存しない純粋な関数だけを置く。DataFrame を受け取り DataFrame を返す。
+main.py の各モードと benchmarks/ の計測スクリプトの両方から使う。
+
+  compute_order_ai       : 発注AI判定（prepare → compute → finalize）
+  compute_price_improve  : 仕入価格改善リスト（prepare → current price → list）
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from jan_codes import normalize_jan
+
+# ランク倍率（C/TESTで使用。A/Bは新仕様により未使用）
+RANK_MULTIPLIER = {
+    "Aランク": 1.0,  # 未使用
+    "Bランク": 1.2,  # 未使用（発注数は1.7S、発注点1.2Sに変更）
+    "Cランク": 1.0,
+    "TEST": 1.5,
+    "NEW": 1.5
+}
+
+RESULT_COLUMNS = [
+    "jan", "販売実績", "在庫", "発注済", "理論必要数",
+    "発注数", "ロット", "数量", "単価", "総額", "仕入先", "ランク"
+]
+
+# 価格が無い/ロット無効のとき空欄にする列
+BLANK_COLUMNS = ["発注数", "ロット", "数量", "単価", "総額", "仕入先"]
+
+
+def _first_value_map(df: pd.DataFrame, key: str, value: str) -> pd.Series:
+    """
+    key ごとに先頭行の value を返す Series（index=key）
+    従来の df[df[key] == jan].iloc[0] と同じ「最初の1行」を採用する。
+    """
+    return df.drop_duplicates(subset=[key], keep="first").set_index(key)[value]
+
+
+def base_rank_series(rank: pd.Series) -> pd.Series:
+    """
+    normalize_rank_base のベクトル版
+    "Aランク★" → "A" / "Bランク" → "B" / "Cランク" → "C" / それ以外 → ""
+    """
+    return (
+        rank.astype(str)
+        .str.strip()
+        .str.extract(r"^(A|B|C)ランク", expand=False)
+        .fillna("")
+    )
+
+
+class PurchaseIndex:
+    """
+    purchase_data の JAN 別索引（読み込みごとに1回だけ作る）
+
+    ロット > 0 の行を (JAN, ロット, 元の行順) で並べ、
+    キー = JANコード × LOT_SPAN + ロット の昇順配列として保持する。
+    JAN ごとの範囲は start/end で O(1)、ロット条件の検索は二分探索（np.searchsorted）。
+    同じロットが複数ある場合は purchase_data で先に出てくる行を採用する。
+    """
+
+    def __init__(self, df_purchase: pd.DataFrame):
+        jan = df_purchase["jan"].astype(str).to_numpy(dtype=object)
+        lot = pd.to_numeric(df_purchase["order_lot"], errors="coerce").fillna(0).astype("int64").to_numpy()
+        price = pd.to_numeric(df_purchase["price"], errors="coerce").to_numpy(dtype=float)
+        if "supplier" in df_purchase.columns:
+            supplier = df_purchase["supplier"].to_numpy(dtype=object)
+        else:
+            supplier = np.full(len(df_purchase), "不明", dtype=object)
+        self._build(jan, lot, price, supplier)
+
+    def _build(self, jan, lot, price, supplier):
+        keep = lot > 0
+        jan, lot, price, supplier = jan[keep], lot[keep], price[keep], supplier[keep]
+
+        codes, uniques = pd.factorize(jan)
+        order = np.lexsort((np.arange(len(lot)), lot, codes))
+
+        self.jans = pd.Index(uniques)
+        self.lot_span = int(lot.max()) + 2 if len(lot) else 2
+        self.lot = lot[order]
+        self.price = price[order]
+        self.supplier = supplier[order]
+        self.code = codes[order].astype("int64")
+        self.key = self.code * self.lot_span + self.lot
+
+        group = np.arange(len(uniques), dtype="int64")
+        self._start = np.searchsorted(self.key, group * self.lot_span, side="left")
+        self._end = np.searchsorted(self.key, (group + 1) * self.lot_span, side="left")
+        self._priced = None
+
+    def priced(self) -> "PurchaseIndex":
+        """価格あり（NaN でなく > 0）の行だけの索引（発注AI用、初回のみ作成）"""
+        if self._priced is None:
+            ok = ~np.isnan(self.price) & (self.price > 0)
+            sub = PurchaseIndex.__new__(PurchaseIndex)
+            sub._build(self.jans.to_numpy()[self.code[ok]], self.lot[ok], self.price[ok], self.supplier[ok])
+            self._priced = sub
+        return self._priced
+
+    def __len__(self):
+        return len(self.lot)
+
+    def lookup(self, jans) -> np.ndarray:
+        """JAN 配列 → 索引内のコード（無ければ -1）"""
+        return self.jans.get_indexer(pd.Index(jans, dtype=object).astype(str))
+
+    def bounds(self, codes: np.ndarray):
+        """コードごとの [start, end)。-1（候補なし）は空範囲"""
+        codes = np.asarray(codes, dtype="int64")
+        found = codes >= 0
+        safe = np.where(found, codes, 0)
+        if len(self._start) == 0:
+            zero = np.zeros(len(codes), dtype="int64")
+            return zero, zero
+        start = np.where(found, self._start[safe], 0)
+        end = np.where(found, self._end[safe], 0)
+        return start, end
+
+    def _search(self, codes, lots, side):
+        lots = np.clip(np.asarray(lots), 0, self.lot_span - 1).astype("int64")
+        return np.searchsorted(self.key, np.maximum(codes, 0) * self.lot_span + lots, side=side)
+
+    def _first_of_lot(self, pos):
+        """pos と同じロットの先頭位置（同ロットは元の行順で最初の行）"""
+        return np.searchsorted(self.key, self.key[np.clip(pos, 0, max(len(self.key) - 1, 0))], side="left")
+
+    def select_cover(self, codes, need) -> np.ndarray:
+        """
+        A/B 用: ロット >= need の最小ロット。無ければ最大ロット。候補なしは -1
+        """
+        codes = np.asarray(codes, dtype="int64")
+        start, end = self.bounds(codes)
+        has = end > start
+        if not len(self.key):
+            return np.full(len(codes), -1, dtype="int64")
+
+        pos = self._search(codes, need, "left")
+        largest = self._first_of_lot(end - 1)
+        pos = np.where(pos < end, pos, largest)
+        return np.where(has, pos, -1)
+
+    def select_nearest(self, codes, need) -> np.ndarray:
+        """
+        C/TEST・価格改善用: ロット <= need の最大ロット
+        → need < ロット <= need*1.5（ロット1除く）の最小ロット → ロット1 → 最小ロット。候補なしは -1
+        """
+        codes = np.asarray(codes, dtype="int64")
+        need = np.asarray(need)
+        start, end = self.bounds(codes)
+        has = end > start
+        if not len(self.key):
+            return np.full(len(codes), -1, dtype="int64")
+
+        above = self._search(codes, need, "right")
+        smaller = self._first_of_lot(above - 1)
+        has_smaller = above > start
+
+        near_lot = self.lot[np.clip(above, 0, len(self.lot) - 1)]
+        has_near = (above < end) & (near_lot <= need * 1.5) & (near_lot != 1)
+
+        # ロット1 / 最小ロットはどちらもグループ先頭（ロット昇順のため）
+        pos = np.where(has_smaller, smaller, np.where(has_near, above, start))
+        return np.where(has, pos, -1)
+
+
+def compute_order_results(
+    df_sales: pd.DataFrame,
+    df_master: pd.DataFrame,
+    df_warehouse: pd.DataFrame,
+    purchase_index: PurchaseIndex,
+    recent_jans,
+    use_warehouse: bool = True,
+    rank_multiplier: dict = RANK_MULTIPLIER,
+) -> pd.DataFrame:
+    """
+    発注AIの判定本体。戻り値は従来の results（list of dict）を DataFrame にしたものと同じ。
+
+    前提（main.py 側で整形済み）:
+      df_sales     : jan / quantity_sold / stock_available / 発注済（上海控除後）
+      df_master    : jan / ランク
+      df_warehouse : product_code / stock_available（use_warehouse=True のとき）
+      purchase_index : purchase_data から作った PurchaseIndex
+    """
+    if df_sales.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    s = df_sales[["jan", "quantity_sold", "発注済"]].copy()
+    s["_pos"] = np.arange(len(s))
+
+    # 在庫取得
+    if use_warehouse:
+        stock_map = _first_value_map(df_warehouse, "product_code", "stock_available")
+        s["stock"] = s["jan"].map(stock_map).fillna(0).astype("int64")
+    else:
+        s["stock"] = df_sales["stock_available"].to_numpy()
+
+    # ランク取得（先頭行、NaN は空文字）
+    if "ランク" in df_master.columns:
+        rank_map = _first_value_map(df_master, "jan", "ランク").astype(object)
+        rank_map = rank_map.where(rank_map.isna(), rank_map.astype(str)).fillna("")
+        s["rank"] = s["jan"].map(rank_map).fillna("")
+    else:
+        s["rank"] = ""
+    s["base_rank"] = base_rank_series(s["rank"])
+
+    # 直近発注スキップ
+    s = s[~s["jan"].isin(set(recent_jans))]
+
+    sold = s["quantity_sold"].to_numpy()
+    stock = s["stock"].to_numpy()
+    ordered = s["発注済"].to_numpy()
+    is_ab = s["base_rank"].isin(["A", "B"]).to_numpy()
+    current_total = stock + ordered
+
+    # ===== 発注点判定 =====
+    # A/B: 在庫+発注済 が ceil(実績×1.2) を「下回ったら」発注
+    # C/TEST: 在庫+発注済 が floor(実績×0.7) 以下なら発注
+    rp_ab = np.maximum(np.ceil(sold * 1.2), 1)
+    rp_c = np.maximum(np.floor(sold * 0.7), 1)
+    reorder = np.where(is_ab, current_total < rp_ab, current_total <= rp_c)
+
+    # ===== 発注数の基準 =====
+    # A/B: ceil(実績×1.7)（最低1個の特例あり）
+    needed_ab = np.maximum(np.ceil(sold * 1.7), 0).astype("int64")
+    needed_ab = np.where((stock <= 1) & (sold >= 1) & (needed_ab <= 0), 1, needed_ab)
+    # C/TEST: ceil(実績×倍率) - 在庫 - 発注済
+    mult = s["rank"].map(rank_multiplier).fillna(1.0).to_numpy()
+    need_raw = np.ceil(sold * mult).astype("int64") - stock - ordered
+    needed_c = np.where((stock <= 1) & (sold >= 1) & (need_raw <= 0), 1, np.maximum(need_raw, 0))
+
+    base_needed = np.where(is_ab, needed_ab, needed_c)
+    keep = reorder & (is_ab | (needed_c > 0))
+
+    cand = s[keep].copy()
+    cand["need"] = base_needed[keep]
+    cand["is_ab"] = is_ab[keep]
+
+    # 仕入候補から最適ロットを選択（価格あり・ロット > 0 のみ）
+    index = purchase_index.priced()
+    codes = index.lookup(cand["jan"].to_numpy())
+    need = cand["need"].to_numpy()
+    pos = np.where(
+        cand["is_ab"].to_numpy(),
+        index.select_cover(codes, need),
+        index.select_nearest(codes, need),
+    )
+
+    has_option = pos >= 0
+    safe = np.where(has_option, pos, 0)
+    if len(index):
+        lot = np.where(has_option, index.lot[safe], 1)
+        price = np.where(has_option, index.price[safe], 0.0)
+        supplier = np.where(has_option, index.supplier[safe], "")
+    else:
+        lot = np.ones(len(cand), dtype="int64")
+        price = np.zeros(len(cand))
+        supplier = np.full(len(cand), "", dtype=object)
+    sets = np.ceil(need / lot).astype("int64")
+    qty = sets * lot
+
+    result = pd.DataFrame({
+        "jan": cand["jan"].to_numpy(),
+        "販売実績": cand["quantity_sold"].to_numpy(),
+        "在庫": cand["stock"].to_numpy(),
+        "発注済": cand["発注済"].to_numpy(),
+        "理論必要数": need,
+        "発注数": qty,
+        "ロット": lot,
+        "数量": sets,
+        "単価": np.trunc(price).astype("int64"),
+        "総額": np.trunc(qty * price).astype("int64"),
+        "仕入先": supplier,
+        "ランク": cand["rank"].to_numpy(),
+    })
+
+    # 価格が無い/ロット無効 → 空欄で出力
+    if not has_option.all():
+        blank = ~has_option
+        for c in BLANK_COLUMNS:
+            result[c] = result[c].astype(object)
+            result.loc[blank, c] = ""
+
+    return result
+
+
+def current_purchase_prices(df_sales: pd.DataFrame, purchase_index: PurchaseIndex) -> pd.Series:
+    """
+    仕入価格改善リスト用: 不足分に対して現在選ばれる仕入価格を JAN ごとに返す。
+    不足分 = 実績 - 在庫 + ceil(実績×0.5) - 発注済（在庫 >= 実績なら 0）
+    同じ JAN が複数行ある場合は最後の行の結果（従来の dict 上書きと同じ）。
+    """
+    sold = pd.to_numeric(df_sales["quantity_sold"], errors="coerce").fillna(0).to_numpy()
+    stock = pd.to_numeric(df_sales.get("stock_available", 0), errors="coerce")
+    ordered = pd.to_numeric(df_sales.get("stock_ordered", 0), errors="coerce")
+    stock = np.broadcast_to(np.nan_to_num(np.asarray(stock, dtype=float)), sold.shape)
+    ordered = np.broadcast_to(np.nan_to_num(np.asarray(ordered, dtype=float)), sold.shape)
+
+    need = np.where(stock >= sold, 0, np.maximum(sold - stock + np.ceil(sold * 0.5) - ordered, 0))
+
+    codes = purchase_index.lookup(df_sales["jan"].to_numpy())
+    pos = purchase_index.select_nearest(codes, need)
+    ok = (need > 0) & (pos >= 0)
+
+    picked = pd.DataFrame({
+        "jan": df_sales["jan"].to_numpy()[ok],
+        "price": purchase_index.price[pos[ok]],
+    })
+    return picked.groupby("jan", sort=False)["price"].last()
+
+
+# =========================
+# 発注AI判定
+# =========================
+def prepare_order_inputs(
+    df_sales: pd.DataFrame,
+    df_purchase: pd.DataFrame,
+    df_master: pd.DataFrame,
+    df_warehouse: pd.DataFrame,
+    df_history: pd.DataFrame,
+    today: date = None,
+    use_warehouse: bool = True,
+):
+    """
+    正規化・型揃え、上海分の発注済控除、直近（本日/昨日）発注JANの抽出。
+    入力はコピーして扱う（呼び出し元の DataFrame は変更しない）。
+    return: (df_sales, df_master, df_warehouse, df_purchase, recent_jans)
+    """
+    df_sales = df_sales.copy()
+    df_purchase = df_purchase.copy()
+    df_master = df_master.copy()
+    df_warehouse = df_warehouse.copy()
+
+    df_sales["jan"] = normalize_jan(df_sales["jan"])
+    df_purchase["jan"] = normalize_jan(df_purchase["jan"])
+    df_master["jan"] = normalize_jan(df_master["jan"])
+    df_sales["quantity_sold"] = pd.to_numeric(df_sales["quantity_sold"], errors="coerce").fillna(0).astype(int)
+    df_sales["stock_available"] = pd.to_numeric(df_sales["stock_available"], errors="coerce").fillna(0).astype(int)
+
+    if use_warehouse:
+        df_warehouse["product_code"] = normalize_jan(df_warehouse["product_code"])
+        df_warehouse["stock_available"] = pd.to_numeric(df_warehouse["stock_available"], errors="coerce").fillna(0).astype(int)
+
+    # 発注履歴（上海除外/直近判定に使用）
+    if df_history is None or df_history.empty:
+        df_history = pd.DataFrame(columns=["jan", "quantity", "memo", "order_date"])
+    else:
+        df_history = df_history.copy()
+    df_history["quantity"] = pd.to_numeric(df_history["quantity"], errors="coerce").fillna(0).astype(int)
+    df_history["memo"] = df_history["memo"].astype(str).fillna("")
+    df_history["jan"] = normalize_jan(df_history["jan"])
+
+    # 「上海」分を item_master 発注済から控除（item 360 の df_master は控除済みの 発注済_修正後 を持っている）
+    if "発注済_修正後" not in df_master.columns:
+        df_shanghai = df_history[df_history["memo"].str.contains("上海", na=False)]
+        df_shanghai_grouped = df_shanghai.groupby("jan")["quantity"].sum().reset_index(name="shanghai_quantity")
+        if "発注済" not in df_master.columns:
+            df_master["発注済"] = 0
+        df_master = df_master.merge(df_shanghai_grouped, on="jan", how="left")
+        df_master["shanghai_quantity"] = df_master["shanghai_quantity"].fillna(0).astype(int)
+        df_master["発注済_修正後"] = (pd.to_numeric(df_master["発注済"], errors="coerce").fillna(0) - df_master["shanghai_quantity"]).clip(lower=0)
+
+    # sales に反映
+    df_sales.drop(columns=["発注済"], errors="ignore", inplace=True)
+    df_sales = df_sales.merge(df_master[["jan", "発注済_修正後"]], on="jan", how="left")
+    df_sales["発注済"] = df_sales["発注済_修正後"].fillna(0).astype(int)
+
+    # purchase_data 型揃え
+    df_purchase["order_lot"] = pd.to_numeric(df_purchase["order_lot"], errors="coerce").fillna(0).astype(int)
+    df_purchase["price"] = pd.to_numeric(df_purchase["price"], errors="coerce")
+
+    # 直近（本日/昨日）発注の除外対象
+    today = today or date.today()
+    yesterday = today - timedelta(days=1)
+    order_date = pd.to_datetime(df_history["order_date"], errors="coerce").dt.date
+    recent_jans = (
+        df_history.loc[order_date.isin([today, yesterday]), "jan"]
+        .unique().tolist()
+    )
+
+    return df_sales, df_master, df_warehouse, df_purchase, recent_jans
+
+
+def finalize_order_results(results: pd.DataFrame, df_master: pd.DataFrame, df_benten: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    出力整形: 商品名・取扱区分の結合、弁天在庫（表示のみ）、取扱中止の除外、列順。
+    """
+    result_df = results.copy()
+
+    # 商品名・取扱区分を結合
+    if "商品コード" in df_master.columns:
+        df_temp = df_master[["商品コード", "商品名", "取扱区分"]].copy()
+        df_temp["商品コード"] = df_temp["商品コード"].astype(str).str.strip()
+        df_temp.rename(columns={"商品コード": "jan"}, inplace=True)
+        result_df["jan"] = result_df["jan"].astype(str).str.strip()
+        result_df = pd.merge(result_df, df_temp, on="jan", how="left")
+
+    # 弁天在庫（表示のみ）
+    if df_benten is not None and not df_benten.empty:
+        df_benten = df_benten[["jan", "stock"]].copy()
+        df_benten["jan"] = df_benten["jan"].astype(str).str.strip()
+        df_benten = df_benten.rename(columns={"stock": "弁天在庫"})
+        result_df = pd.merge(result_df, df_benten, on="jan", how="left")
+        result_df["弁天在庫"] = result_df["弁天在庫"].fillna(0).astype(int)
+
+    # 列名統一
+    result_df.rename(columns={"在庫": "JD在庫"}, inplace=True)
+
+    # 表示フィルタ
+    if "商品名" in result_df.columns:
+        result_df = result_df[result_df["商品名"].notna()]
+    if "取扱区分" in result_df.columns:
+        result_df = result_df[result_df["取扱区分"] != "取扱中止"]
+
+    # 表示順
+    column_order = ["jan", "商品名", "ランク", "販売実績", "JD在庫", "弁天在庫", "発注済",
+                    "理論必要数", "発注数", "ロット", "数量", "単価", "総額", "仕入先"]
+    return result_df[[c for c in column_order if c in result_df.columns]]
+
+
+def compute_order_ai(
+    df_sales: pd.DataFrame,
+    df_purchase: pd.DataFrame,
+    df_master: pd.DataFrame,
+    df_warehouse: pd.DataFrame,
+    df_history: pd.DataFrame = None,
+    df_benten: pd.DataFrame = None,
+    today: date = None,
+    use_warehouse: bool = True,
+) -> pd.DataFrame:
+    """
+    発注AI判定の一括実行。Supabase の各テーブルをそのまま渡せば、画面に出す発注一覧を返す。
+    発注対象が無ければ空の DataFrame。
+    """
+    df_sales, df_master, df_warehouse, df_purchase, recent_jans = prepare_order_inputs(
+        df_sales, df_purchase, df_master, df_warehouse, df_history, today=today, use_warehouse=use_warehouse
+    )
+    purchase_index = PurchaseIndex(df_purchase)
+    results = compute_order_results(
+        df_sales, df_master, df_warehouse, purchase_index, recent_jans, use_warehouse=use_warehouse
+    )
+    if results.empty:
+        return results
+    return finalize_order_results(results, df_master, df_benten)
+
+
+# =========================
+# 仕入価格改善リスト
+# =========================
+PRICE_IMPROVE_COLUMNS = ["商品コード", "JAN", "メーカー名", "現在の仕入価格", "最安値の仕入価格", "差分"]
+
+
+def prepare_price_improve_inputs(df_sales: pd.DataFrame, df_purchase: pd.DataFrame, df_item: pd.DataFrame):
+    """
+    JAN 正規化（"4901234567890.0" → "4901234567890"）と価格の数値化。入力はコピーして扱う。
+    return: (df_sales, df_purchase, df_item)
+    """
+    df_sales = df_sales.copy()
+    df_purchase = df_purchase.copy()
+    df_item = df_item.copy()
+
+    df_sales["jan"] = normalize_jan(df_sales["jan"], leading_zeros=1)
+    df_purchase["jan"] = normalize_jan(df_purchase["jan"], leading_zeros=1)
+    df_item["jan"] = normalize_jan(df_item["jan"], leading_zeros=1)
+    df_purchase["price"] = pd.to_numeric(df_purchase["price"], errors="coerce").fillna(0)
+    return df_sales, df_purchase, df_item
+
+
+def build_price_improve_list(current_prices: pd.Series, df_purchase: pd.DataFrame, df_item: pd.DataFrame) -> pd.DataFrame:
+    """
+    現在価格より安い仕入候補がある JAN の一覧（item_master に存在するものだけ）。
+    """
+    min_prices = df_purchase.groupby("jan")["price"].min()
+
+    df_cur = current_prices.rename("現在の仕入価格").reset_index()
+    df_cur["最安値の仕入価格"] = df_cur["jan"].map(min_prices)
+    df_cur = df_cur[df_cur["最安値の仕入価格"] < df_cur["現在の仕入価格"]]
+
+    item_first = df_item.drop_duplicates(subset=["jan"], keep="first").set_index("jan")
+    df_cur = df_cur[df_cur["jan"].isin(item_first.index)]
+    if df_cur.empty:
+        return pd.DataFrame(columns=PRICE_IMPROVE_COLUMNS)
+
+    return pd.DataFrame({
+        "商品コード": df_cur["jan"].map(item_first["item_code"]) if "item_code" in item_first.columns else "",
+        "JAN": df_cur["jan"],
+        "メーカー名": df_cur["jan"].map(item_first["brand"]) if "brand" in item_first.columns else "",
+        "現在の仕入価格": df_cur["現在の仕入価格"],
+        "最安値の仕入価格": df_cur["最安値の仕入価格"],
+        "差分": (df_cur["最安値の仕入価格"] - df_cur["現在の仕入価格"]).round(2),
+    }).reset_index(drop=True)
+
+
+def compute_price_improve(df_sales: pd.DataFrame, df_purchase: pd.DataFrame, df_item: pd.DataFrame) -> pd.DataFrame:
+    """
+    仕入価格改善リストの一括実行。改善対象が無ければ空の DataFrame。
+    """
+    df_sales, df_purchase, df_item = prepare_price_improve_inputs(df_sales, df_purchase, df_item)
+    purchase_index = PurchaseIndex(df_purchase)
+    current_prices = current_purchase_prices(df_sales, purchase_index)
+    return build_price_improve_list(current_prices, df_purchase, df_item)
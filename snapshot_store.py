@@ -0,0 +1,357 @@
+"""
+ローカルのカラムナ・スナップショット（Parquet）と updated_at による差分同期
+
+主要テーブルの全件を app サーバのディスクに Parquet で持ち、読み込みはローカルからメモリマップで行う。
+同期では、前回の最終 updated_at（ウォーターマーク）より新しい行と、その後の削除の記録（tombstone）だけを
+取得して反映する。ネットワークの転送量はテーブルの大きさではなく変更量に比例する。
+
+main.py では SNAPSHOT_STORE=True のときだけ st.cache_resource で1つ作り（起動時にバックグラウンドで
+スナップショットのあるテーブルを同期）、TableCache の loader から read() を呼ぶ。TTL ごとの再取得がそのまま
+差分同期になる。書き込み（SupabaseClient の write listener）で invalidate() を呼び、次の読み込みで必ず同期する。
+pyarrow が無い環境では使わない（AVAILABLE=False）。
+
+Parquet に持つのは、これまでに読まれた列（＋キー列・updated_at）だけ。足りない列が読まれたら
+列を広げて全件を取り直す（全件取得でも select=* にはしない）。
+
+サーバ側の準備（Supabase の SQL エディタで1回だけ。テーブルとキー列は SNAPSHOT_TABLES）:
+
+  -- 挿入・更新のたびに updated_at = now()
+  alter table sales add column if not exists updated_at timestamptz not null default now();
+  create or replace function touch_updated_at() returns trigger language plpgsql as $$
+  begin new.updated_at := now(); return new; end $$;
+  create trigger sales_touch before update on sales for each row execute function touch_updated_at();
+
+  -- 削除の記録（tombstone）。古い行は定期的に消してよい（TOMBSTONE_RETENTION より前）
+  create table deleted_rows (table_name text not null, key text not null, deleted_at timestamptz not null default now());
+  create index on deleted_rows (table_name, deleted_at);
+  create or replace function record_deleted_row() returns trigger language plpgsql as $$
+  begin
+    insert into deleted_rows (table_name, key) values (TG_TABLE_NAME, to_jsonb(old) ->> TG_ARGV[0]);
+    return old;
+  end $$;
+  create trigger sales_deleted after delete on sales for each row execute function record_deleted_row('id');
+
+  -- 上の列・トリガーがあるかをアプリから確かめる
+  create or replace function snapshot_triggers()
+  returns table(table_name text, has_updated_at boolean, has_touch boolean, has_tombstone boolean)
+  language sql stable security definer as $$
+    select c.relname::text,
+           exists (select 1 from pg_attribute a
+                   where a.attrelid = c.oid and a.attname = 'updated_at' and not a.attisdropped),
+           exists (select 1 from pg_trigger t join pg_proc p on p.oid = t.tgfoid
+                   where t.tgrelid = c.oid and not t.tgisinternal and t.tgenabled <> 'D'
+                     and p.proname = 'touch_updated_at'),
+           exists (select 1 from pg_trigger t join pg_proc p on p.oid = t.tgfoid
+                   where t.tgrelid = c.oid and not t.tgisinternal and t.tgenabled <> 'D'
+                     and p.proname = 'record_deleted_row')
+    from pg_class c
+    where c.relnamespace = 'public'::regnamespace and c.relkind = 'r' $$;
+
+snapshot_triggers が無い・updated_at 列か更新トリガーが無いテーブルはスナップショットを使わない
+（in で False。呼び出し側はサーバから読む。トリガーが無いと upsert でウォーターマークが進まず、
+古い行を読み続けるため）。削除トリガーが無いテーブルは、キー列だけを全件取得して
+サーバから消えたキーを検出する。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+from supabase_client import is_missing_function, is_undefined_table
+from table_schema import apply_schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_DIR = "/tmp/snapshots"
+
+# スナップショットを持つテーブル → 行を一意に決めるキー列
+SNAPSHOT_TABLES = {
+    "item_master": "id",
+    "sales": "id",
+    "purchase_data": "id",
+    "warehouse_stock": "product_code",
+    "purchase_history": "id",
+}
+
+WATERMARK_COLUMN = "updated_at"
+TOMBSTONE_TABLE = "deleted_rows"
+# 列・トリガーの確認に使う RPC
+READY_FUNCTION = "snapshot_triggers"
+# 差分はウォーターマークより少し前から取る（コミットが遅れた行を取りこぼさない。重なった行は上書きされるだけ）
+OVERLAP = pd.Timedelta(minutes=2)
+# 前回の同期がこれより古ければ（tombstone が消されているかもしれないので）全件を取り直す
+TOMBSTONE_RETENTION = pd.Timedelta(days=7)
+# 1回の差分で消える行がこの割合を超えたら（全件入れ替えのアップロード）全件を取り直す
+FULL_RELOAD_RATIO = 0.5
+# 同じテーブルの同期はこの秒数に1回まで（射影違いの読み込みが続いても同期は1回。書き込み後は invalidate で解除）
+MIN_SYNC_INTERVAL = 10
+
+
+def _max_timestamp(values):
+    """ISO 文字列の列の最大値（UTC の Timestamp）。無ければ None"""
+    ts = pd.to_datetime(values, utc=True, errors="coerce", format="ISO8601").max()
+    return None if pd.isna(ts) else ts
+
+
+class SnapshotStore:
+    def __init__(self, client, root: str = DEFAULT_SNAPSHOT_DIR, tables: dict = None):
+        self.client = client
+        self.root = root
+        self.tables = tables or SNAPSHOT_TABLES
+        os.makedirs(root, exist_ok=True)
+        self.sync_stats = {}
+        self._locks = {table: threading.Lock() for table in self.tables}
+        # テーブル → 最後の同期を始めた時刻 / 最後に書き込みを通知された時刻（time.monotonic）
+        self._synced = {}
+        self._written = {}
+        self._has_tombstones = None
+        self._ready = None
+        self._ready_lock = threading.Lock()
+
+    def __contains__(self, table):
+        """スナップショットを使えるテーブルか（updated_at 列と更新トリガーがサーバにある）"""
+        return table in self.tables and table in self._ready_tables()
+
+    # ---------- 公開 ----------
+    def read(self, table: str, columns=None) -> pd.DataFrame:
+        """差分同期してから columns だけをローカルの Parquet から読む（失敗時は SupabaseError）"""
+        with self._locks[table]:
+            self._sync_if_stale(table, columns)
+            path = self._path(table)
+            names = pq.read_schema(path).names
+            cols = None if columns is None else [c for c in columns if c in names]
+            return pq.read_table(path, columns=cols, memory_map=True).to_pandas()
+
+    def parquet_path(self, table: str, columns=None) -> str:
+        """差分同期してから Parquet ファイルのパスを返す（DuckDB などで直接読むとき。columns は含める列）"""
+        with self._locks[table]:
+            self._sync_if_stale(table, columns)
+            return self._path(table)
+
+    def invalidate(self, table: str):
+        """書き込みがあったテーブルは、次の読み込みで MIN_SYNC_INTERVAL を待たずに同期する"""
+        self._written[table] = time.monotonic()
+
+    def sync_all(self):
+        """スナップショットのあるテーブルを同期（起動時にバックグラウンドで呼ぶ。失敗はログだけ）"""
+        for table in self.tables:
+            try:
+                if table not in self or self._load_meta(table) is None:
+                    # まだ読まれていないテーブルは、最初の読み込みで必要な列だけを取る
+                    continue
+                with self._locks[table]:
+                    started = time.monotonic()
+                    self._sync(table)
+                    self._synced[table] = started
+            except Exception:
+                logger.exception("snapshot sync failed: %s", table)
+
+    # ---------- 同期 ----------
+    def _sync_if_stale(self, table, columns=None):
+        meta = self._load_meta(table)
+        synced = self._synced.get(table, float("-inf"))
+        if (
+            time.monotonic() - synced > MIN_SYNC_INTERVAL
+            # 同期を始めた後に書き込みがあった（同期中の書き込みも取りこぼさない）
+            or self._written.get(table, float("-inf")) >= synced
+            or self._projection(table, meta, columns) != self._projection(table, meta)
+        ):
+            started = time.monotonic()
+            self._sync(table, columns)
+            self._synced[table] = started
+
+    def _projection(self, table, meta, columns=()):
+        """
+        Parquet に持つ列（None は全列）。いまの列に columns が足りなければ広げた列。
+        キー列と updated_at は常に含める
+        """
+        current = meta.get("columns") if meta is not None else []
+        if current is None or columns is None:
+            return None
+        needed = {self.tables[table], WATERMARK_COLUMN, *columns}
+        if needed <= set(current):
+            return current
+        return sorted(needed | set(current))
+
+    def _sync(self, table, columns=()):
+        started = time.perf_counter()
+        key = self.tables[table]
+        meta = self._load_meta(table)
+        projection = self._projection(table, meta, columns)
+        now = pd.Timestamp.now(tz="UTC")
+        if (
+            meta is None
+            or not os.path.exists(self._path(table))
+            or meta.get("watermark") is None
+            or projection != meta.get("columns")
+            or now - pd.Timestamp(meta["synced_at"]) > TOMBSTONE_RETENTION
+        ):
+            return self._full(table, projection, started)
+
+        since = pd.Timestamp(meta["watermark"]) - OVERLAP
+        changed = self.client.fetch_table(
+            table, columns=projection, filters=[(WATERMARK_COLUMN, f"gt.{since.isoformat()}")],
+        )
+        deleted, deleted_watermark = self._deleted_keys(table, key, meta)
+
+        if changed.empty and not deleted:
+            meta["synced_at"] = now.isoformat()
+            meta["deleted_watermark"] = deleted_watermark
+            self._save_meta(table, meta)
+            return self._record(table, "delta", started, meta["rows"], 0, 0)
+        if len(deleted) > FULL_RELOAD_RATIO * max(meta["rows"], 1):
+            return self._full(table, projection, started)
+
+        local = pq.read_table(self._path(table), memory_map=True).to_pandas()
+        keys = local[key].astype(str)
+        drop = keys.isin(deleted)
+        n_deleted = int(drop.sum())
+        if not changed.empty:
+            drop |= keys.isin(set(changed[key].astype(str)))
+        # サーバにいま在る行（changed）は、同じキーの tombstone より優先する
+        merged = (
+            pd.concat([local[~drop], changed], ignore_index=True)
+            .sort_values(key, kind="stable", ignore_index=True)
+        )
+        # 結合で category が object に戻ることがあるので、宣言どおりの型に揃え直す
+        merged = apply_schema(table, merged)
+
+        watermark = _max_timestamp(changed.get(WATERMARK_COLUMN, pd.Series(dtype=object)))
+        meta = {
+            "watermark": max(watermark, pd.Timestamp(meta["watermark"])).isoformat() if watermark else meta["watermark"],
+            "deleted_watermark": deleted_watermark,
+            "synced_at": now.isoformat(),
+            "rows": len(merged),
+            "columns": projection,
+        }
+        self._write(table, merged, meta)
+        return self._record(table, "delta", started, len(merged), len(changed), n_deleted)
+
+    def _full(self, table, projection, started):
+        df = self.client.fetch_table(table, columns=projection)
+        watermark = _max_timestamp(df[WATERMARK_COLUMN]) if WATERMARK_COLUMN in df.columns else None
+        meta = {
+            "watermark": watermark.isoformat() if watermark else None,
+            "deleted_watermark": self._latest_deletion(table) or (watermark.isoformat() if watermark else None),
+            "synced_at": pd.Timestamp.now(tz="UTC").isoformat(),
+            "rows": len(df),
+            "columns": projection,
+        }
+        self._write(table, df, meta)
+        return self._record(table, "full", started, len(df), len(df), 0)
+
+    def _ready_tables(self) -> dict:
+        """テーブル名 → snapshot_triggers の行（updated_at 列と更新トリガーがあるテーブルだけ）"""
+        if self._ready is None:
+            with self._ready_lock:
+                if self._ready is None:
+                    try:
+                        res = self.client.rpc(READY_FUNCTION)
+                    except Exception:
+                        logger.exception("snapshot: %s failed", READY_FUNCTION)
+                        return {}
+                    if is_missing_function(res):
+                        logger.warning("snapshot: %s is not defined; snapshots are disabled", READY_FUNCTION)
+                        self._ready = {}
+                    elif res.status_code != 200:
+                        # 一時的な失敗は次の読み込みで確かめ直す（それまではサーバから読む）
+                        return {}
+                    else:
+                        self._ready = {
+                            row["table_name"]: row for row in res.json()
+                            if row["table_name"] in self.tables and row["has_updated_at"] and row["has_touch"]
+                        }
+                        for table in set(self.tables) - set(self._ready):
+                            logger.warning("snapshot: %s has no updated_at column or trigger; reading from server", table)
+        return self._ready
+
+    def _tombstones_available(self, table) -> bool:
+        """deleted_rows があり、table に削除トリガーがあるか"""
+        if not self._ready_tables().get(table, {}).get("has_tombstone"):
+            return False
+        if self._has_tombstones is None:
+            res = self.client.select(TOMBSTONE_TABLE, "select=key&limit=1")
+            self._has_tombstones = not (is_undefined_table(res) or res.status_code == 404)
+        return self._has_tombstones
+
+    def _latest_deletion(self, table):
+        if not self._tombstones_available(table):
+            return None
+        res = self.client.select(
+            TOMBSTONE_TABLE,
+            [("select", "deleted_at"), ("table_name", f"eq.{table}"), ("order", "deleted_at.desc"), ("limit", "1")],
+        )
+        if res.status_code != 200 or not res.json():
+            return None
+        return res.json()[0]["deleted_at"]
+
+    def _deleted_keys(self, table, key, meta):
+        """前回の同期以降に消えたキー（文字列の set）と、新しい tombstone のウォーターマーク"""
+        if not self._tombstones_available(table):
+            # キー列だけを全件取得し、ローカルにあってサーバに無いキーを削除扱いにする
+            local = pq.read_table(self._path(table), columns=[key], memory_map=True).to_pandas()
+            server = self.client.fetch_table(table, columns=[key])
+            server_keys = set(server[key].astype(str)) if key in server.columns else set()
+            return set(local[key].astype(str)) - server_keys, meta.get("deleted_watermark")
+
+        since = pd.Timestamp(meta.get("deleted_watermark") or meta["watermark"]) - OVERLAP
+        df = self.client.fetch_table(
+            TOMBSTONE_TABLE,
+            columns=["key", "deleted_at"],
+            filters=[("table_name", f"eq.{table}"), ("deleted_at", f"gt.{since.isoformat()}")],
+        )
+        if df.empty:
+            return set(), meta.get("deleted_watermark")
+        latest = _max_timestamp(df["deleted_at"])
+        return set(df["key"].astype(str)), latest.isoformat() if latest else meta.get("deleted_watermark")
+
+    def _record(self, table, mode, started, rows, changed, deleted):
+        self.sync_stats[table] = {
+            "mode": mode,
+            "rows": rows,
+            "changed": changed,
+            "deleted": deleted,
+            "seconds": time.perf_counter() - started,
+        }
+        logger.info(
+            "snapshot %s: %s sync, %d rows (%d changed / %d deleted) in %.3fs",
+            table, mode, rows, changed, deleted, self.sync_stats[table]["seconds"],
+        )
+
+    # ---------- ファイル ----------
+    def _path(self, table):
+        return os.path.join(self.root, f"{table}.parquet")
+
+    def _meta_path(self, table):
+        return os.path.join(self.root, f"{table}.json")
+
+    def _write(self, table, df, meta):
+        """Parquet とメタ情報を一時ファイル経由で置き換える（書き込み途中のファイルを読ませない）"""
+        path = self._path(table)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._save_meta(table, meta)
+
+    def _load_meta(self, table):
+        try:
+            with open(self._meta_path(table), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, table, meta):
+        path = self._meta_path(table)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,584 @@
+"""
+Supabase（PostgREST）への読み書きをまとめた共通クライアント
+
+main.py では st.cache_resource でプロセスに1つだけ作り、全モードで使い回す。
+requests.Session の keep-alive / コネクションプールを共有するので、
+ページごとに TLS 接続を張り直さない。
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from table_schema import apply_schema
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import pyarrow as pa
+    ARROW = True
+except ImportError:
+    ARROW = False
+
+logger = logging.getLogger(__name__)
+
+# (接続タイムアウト, 読み込みタイムアウト) 秒
+DEFAULT_TIMEOUT = (5, 60)
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_BATCH_SIZE = 500
+# CSV 本文での一括書き込みは1リクエストあたりの行数を大きくできる
+DEFAULT_CSV_BATCH_SIZE = 5000
+# 一括書き込みの同時 POST 数 / 429・5xx・通信エラー時の再試行回数と待ち時間（秒、回ごとに倍）
+DEFAULT_WRITE_WORKERS = 4
+DEFAULT_WRITE_RETRIES = 3
+DEFAULT_WRITE_BACKOFF = 0.5
+# 主キーがあるテーブルは、総件数がこれを超えるとキーセット方式で取得する
+DEFAULT_KEYSET_THRESHOLD = 20000
+
+# テーブルごとの設定（未指定の項目はクライアントの既定値）
+# key: キーセット方式の取得に使う一意・非 NULL の列（主キー）。一意でない列を指定すると、
+#      ページ境界で同じ値の行を読み飛ばす（warehouse_stock.product_code / benten_stock.jan は不可）
+# order: key の無いテーブルで、ページ取得の並び順を一意に決める列（主キーの列すべて）。
+#        key も order も無いテーブルは並列に取得せず、1本のストリームで順にページを読む
+#        （ORDER BY の無い並列の OFFSET は、ページ間で行が重複・欠落することがある）
+TABLE_SETTINGS = {
+    "sales": {"max_workers": 8, "key": "id"},
+    "purchase_data": {"key": "id"},
+    "store_profit_lines": {"max_workers": 8, "timeout": (5, 120)},
+    "store_profit_daily_lines": {"max_workers": 8, "timeout": (5, 120)},
+    "item_master": {"max_workers": 8, "key": "id"},
+    "item_expiry": {"timeout": (5, 60), "order": ["jan"]},
+}
+
+
+class SupabaseError(Exception):
+    """PostgREST がエラーを返したとき（status_code / text を保持）"""
+
+    def __init__(self, table, status_code, text):
+        super().__init__(f"{table}: {status_code} / {text}")
+        self.table = table
+        self.status_code = status_code
+        self.text = text
+
+
+def is_missing_column(res) -> bool:
+    """select の列が存在しないときの PostgREST エラー（400 / code 42703）か"""
+    if res.status_code != 400:
+        return False
+    try:
+        return res.json().get("code") == "42703"
+    except ValueError:
+        return False
+
+
+def is_missing_function(res) -> bool:
+    """RPC の関数が存在しないときの PostgREST エラー（404 / code PGRST202）か"""
+    if res.status_code != 404:
+        return False
+    try:
+        return res.json().get("code") == "PGRST202"
+    except ValueError:
+        return False
+
+
+def is_retryable(status_code) -> bool:
+    """一時的なエラー（429 / 5xx）か"""
+    return status_code == 429 or status_code >= 500
+
+
+def is_unsent(error) -> bool:
+    """接続できずに失敗した（リクエストがサーバに届いていない）通信エラーか"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def prepare_frame(df: pd.DataFrame, body: str) -> pd.DataFrame:
+    """
+    書き込み前の整形を全体に1回だけ行う（バッチごとには行わない）。
+    - 欠損のせいで float になった整数列は Int64 に戻す（"12.0" を整数列に送らない）
+    - json: object 化して欠損を None に（to_dict がそのまま null を出す）
+    - csv: 欠損は to_csv の na_rep（"NULL"）で出すのでそのまま
+    """
+    df = df.copy()
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_float_dtype(s):
+            vals = s.dropna()
+            if (vals == vals.round()).all() and (vals.abs() < 2 ** 53).all():
+                df[c] = s.astype("Int64")
+    if body == "json":
+        df = df.astype(object).where(df.notna(), None)
+    return df
+
+
+def is_undefined_table(res) -> bool:
+    """テーブルが存在しないときのエラー（code 42P01）か"""
+    if res.status_code < 400:
+        return False
+    try:
+        return res.json().get("code") == "42P01"
+    except ValueError:
+        return False
+
+
+def decode_page(res):
+    """
+    レスポンス本文（JSON 配列）を1回だけパースして列形式にする。
+    pyarrow があれば Arrow の Table（列ごとのバッファ。ページの結合も Arrow のまま）、無ければ DataFrame。
+    Arrow の JSON リーダーは日付らしい文字列を timestamp に推論してしまう（report_date などをフィルタ値に
+    使えなくなる）ので、パースは orjson で行い、型は JSON の型のまま Arrow に渡す。
+    """
+    rows = _loads(res.content) if res.content else []
+    if ARROW:
+        try:
+            return pa.Table.from_pylist(rows)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 1列に型の違う値が混ざるページ（通常は無い）は pandas で受ける
+            pass
+    return pd.DataFrame(rows)
+
+
+def frame_from_pages(pages) -> pd.DataFrame:
+    """decode_page の結果をページ順に結合して DataFrame にする（すべて Arrow なら Arrow のまま結合してから1回だけ変換）"""
+    if ARROW and all(isinstance(p, pa.Table) for p in pages):
+        try:
+            # 全部 NULL の列（null 型）や int/double の違いはページ間で揃える
+            return pa.concat_tables(pages, promote_options="permissive").to_pandas()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    return pd.concat(
+        [p.to_pandas() if ARROW and isinstance(p, pa.Table) else p for p in pages],
+        ignore_index=True,
+    )
+
+
+def _last_value(page, column):
+    """ページの最後の行の column の値"""
+    if ARROW and isinstance(page, pa.Table):
+        return page.column(column)[-1].as_py()
+    return page[column].iloc[-1]
+
+
+def pg_quote(value) -> str:
+    """PostgREST のフィルタ値をダブルクォートで囲む（カンマ・括弧・ピリオドを含む値用）"""
+    s = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{s}"'
+
+
+def in_filter(values) -> str:
+    """値のリスト → "in.(...)" """
+    return "in.(" + ",".join(pg_quote(v) for v in values) + ")"
+
+
+def parse_content_range_total(content_range):
+    """
+    PostgREST の Content-Range（例: "0-999/12345"）から総件数を取り出す。
+    総件数が無い（"*"）/ 解釈できない場合は None
+    """
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[-1].strip()
+    return int(total) if total.isdigit() else None
+
+
+class SupabaseClient:
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout=DEFAULT_TIMEOUT,
+        table_settings: dict = None,
+        keyset_threshold: int = DEFAULT_KEYSET_THRESHOLD,
+        write_workers: int = DEFAULT_WRITE_WORKERS,
+    ):
+        self.url = url.rstrip("/")
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.keyset_threshold = keyset_threshold
+        self.write_workers = write_workers
+        # テーブルごとの直近の全件取得の統計（方式・ページ数・ページごとの秒数）
+        self.fetch_stats = {}
+        self.table_settings = {**TABLE_SETTINGS, **(table_settings or {})}
+        self._write_listeners = []
+        self.headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json"
+        }
+
+        # 並列ページ取得・並列書き込みの同時接続数ぶんプールを確保
+        pool_size = max([max_workers, write_workers] + [s.get("max_workers", 0) for s in self.table_settings.values()])
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # ---------- 設定 ----------
+    def settings(self, table: str) -> dict:
+        s = self.table_settings.get(table, {})
+        return {
+            "page_size": s.get("page_size", self.page_size),
+            "max_workers": s.get("max_workers", self.max_workers),
+            "timeout": s.get("timeout", self.timeout),
+            "key": s.get("key"),
+            "order": s.get("order"),
+            "keyset_threshold": s.get("keyset_threshold", self.keyset_threshold),
+        }
+
+    # ---------- 書き込み通知 ----------
+    def add_write_listener(self, func):
+        """insert / delete が成功したとき func(table) を呼ぶ（キャッシュ破棄用）"""
+        self._write_listeners.append(func)
+
+    def notify_write(self, table: str):
+        for func in self._write_listeners:
+            func(table)
+
+    def _written(self, table, res):
+        if res.status_code < 300:
+            self.notify_write(table)
+        return res
+
+    # ---------- 低レベル ----------
+    def request(self, method: str, path: str, params=None, json=None, data=None, headers=None, timeout=None, table=None):
+        """/rest/v1/{path} へのリクエスト。Response をそのまま返す（ステータス判定は呼び出し側）"""
+        timeout = timeout or (self.settings(table)["timeout"] if table else self.timeout)
+        return self.session.request(
+            method,
+            f"{self.url}/rest/v1/{path}",
+            params=params,
+            json=json,
+            data=data,
+            headers={**self.headers, **(headers or {})},
+            timeout=timeout,
+        )
+
+    def select(self, table: str, params="select=*", headers=None):
+        """1回の GET（ページングなし）。params はクエリ文字列 or dict"""
+        if isinstance(params, str):
+            return self.request("GET", f"{table}?{params}", headers=headers, table=table)
+        return self.request("GET", table, params=params, headers=headers, table=table)
+
+    def select_frame(self, table: str, columns=None, filters=None, order: str = None, limit: int = None):
+        """
+        サーバ側で絞り込んだ結果を1回の GET で取得する。
+        filters: [(列, "ilike.*abc*"), ("or", "(a.eq.1,b.eq.2)"), ...]
+        戻り値: (DataFrame, 条件に一致した総件数)。失敗時は SupabaseError
+        無い列の扱いは fetch_table と同じ（select=* で取り直して存在する列だけに絞る）
+        """
+        params = [("select", ",".join(columns) if columns else "*")]
+        params += list(filters or [])
+        if order:
+            params.append(("order", order))
+        if limit:
+            params.append(("limit", str(limit)))
+        res = self.select(table, params, headers={"Prefer": "count=exact"})
+        if columns and is_missing_column(res):
+            df, total = self.select_frame(table, None, filters, order, limit)
+            return df[[c for c in columns if c in df.columns]], total
+        if res.status_code not in [200, 206]:
+            raise SupabaseError(table, res.status_code, res.text)
+        df = apply_schema(table, frame_from_pages([decode_page(res)]))
+        total = parse_content_range_total(res.headers.get("Content-Range"))
+        return df, (len(df) if total is None else total)
+
+    def select_in(self, table: str, column: str, values, columns=None, chunk_size: int = 500):
+        """
+        column が values のいずれかに一致する行を in.() で取得する（URL 長を抑えるためチャンク分割・並列）。
+        失敗時は SupabaseError
+        """
+        values = list(dict.fromkeys(v for v in values if v is not None and str(v) != ""))
+        if not values:
+            return pd.DataFrame(columns=columns or [])
+        chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+        def get_chunk(chunk):
+            df, _ = self.select_frame(table, columns, [(column, in_filter(chunk))])
+            return df
+
+        with ThreadPoolExecutor(max_workers=self.settings(table)["max_workers"]) as executor:
+            dfs = list(executor.map(get_chunk, chunks))
+        # チャンクごとに category の値が違うので、結合後に型を揃え直す
+        df = apply_schema(table, pd.concat(dfs, ignore_index=True))
+        if columns and df.empty:
+            return pd.DataFrame(columns=columns)
+        return df
+
+    def insert(self, table: str, rows, prefer: str = None):
+        headers = {"Prefer": prefer} if prefer else None
+        return self._written(table, self.request("POST", table, json=rows, headers=headers, table=table))
+
+    def bulk_insert(
+        self,
+        table: str,
+        rows,
+        prefer: str = "resolution=merge-duplicates",
+        batch_size: int = None,
+        max_workers: int = None,
+        retries: int = DEFAULT_WRITE_RETRIES,
+        backoff: float = DEFAULT_WRITE_BACKOFF,
+        on_conflict: str = None,
+        body: str = "csv",
+        progress=None,
+    ) -> int:
+        """
+        rows（DataFrame or dict のリスト）を batch_size 件ずつ、最大 max_workers 本並列で POST する。
+        DataFrame は既定で CSV 本文（text/csv、欠損は NULL）で送り、dict の生成と JSON 化を省く。
+        body="json" またはdict のリストは JSON で送る。batch_size の既定は CSV 5000 件 / JSON 500 件。
+        429 / 5xx / 通信エラーは backoff 秒から倍々で retries 回まで再試行（Retry-After があれば従う）。
+        ただし送信後の通信エラー（読み込みタイムアウト・切断）は書き込み済みのことがあるので、
+        INSERT では再試行しない（id が serial のテーブルに行が重複する）。on_conflict の upsert だけ再試行する。
+        それ以外の失敗（またはリトライ切れ）は、まだ送っていないバッチを取りやめて SupabaseError。
+        on_conflict: upsert の衝突判定に使う列（省略時は主キー）
+        progress(件数, バイト数): バッチが書き込めるたびに呼ぶ（ワーカースレッドから呼ばれる）
+        戻り値: 送信した件数
+        """
+        max_workers = max_workers or self.write_workers
+        path = f"{table}?on_conflict={on_conflict}" if on_conflict else table
+        n = len(rows)
+        if n == 0:
+            return 0
+        is_frame = isinstance(rows, pd.DataFrame)
+        if not is_frame:
+            body = "json"
+        batch_size = batch_size or (DEFAULT_CSV_BATCH_SIZE if body == "csv" else DEFAULT_BATCH_SIZE)
+        if is_frame:
+            rows = prepare_frame(rows, body)
+        stop = threading.Event()
+
+        def encode(start):
+            """バッチ → (リクエストの kwargs, 件数)"""
+            if not is_frame:
+                batch = rows[start:start + batch_size]
+                return {"json": batch}, len(batch)
+            batch = rows.iloc[start:start + batch_size]
+            if body == "csv":
+                data = batch.to_csv(index=False, na_rep="NULL", lineterminator="\n").encode("utf-8")
+                return {"data": data, "headers": {"Prefer": prefer, "Content-Type": "text/csv"}}, len(batch)
+            return {"json": batch.to_dict(orient="records")}, len(batch)
+
+        def post(start):
+            if stop.is_set():
+                return 0
+            kwargs, count = encode(start)
+            kwargs.setdefault("headers", {"Prefer": prefer})
+            for attempt in range(retries + 1):
+                try:
+                    res = self.request("POST", path, table=table, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == retries or not (on_conflict or is_unsent(e)):
+                        stop.set()
+                        raise SupabaseError(table, None, str(e))
+                    time.sleep(backoff * 2 ** attempt)
+                    continue
+                if res.status_code < 300:
+                    if progress:
+                        progress(count, len(res.request.body or b""))
+                    return count
+                if not is_retryable(res.status_code) or attempt == retries:
+                    stop.set()
+                    raise SupabaseError(table, res.status_code, res.text)
+                retry_after = res.headers.get("Retry-After", "")
+                time.sleep(float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # map は最初の失敗で例外を投げる（残りは stop を見て送らずに終わる）
+                return sum(executor.map(post, range(0, n, batch_size)))
+        finally:
+            self.notify_write(table)
+
+    def delete(self, table: str, filters):
+        """filters: "id=gt.0" のような PostgREST のフィルタ文字列 or [(列, "in.(...)"), ...]"""
+        if isinstance(filters, str):
+            return self._written(table, self.request("DELETE", f"{table}?{filters}", table=table))
+        return self._written(table, self.request("DELETE", table, params=filters, table=table))
+
+    def rpc(self, name: str, payload: dict = None, timeout=None):
+        return self.request("POST", f"rpc/{name}", json=payload or {}, timeout=timeout)
+
+    # ---------- ステージング経由の全件入れ替え ----------
+    # <table>_staging を本体と同じ定義で作り、次の2つの関数を用意しておく。
+    # swap_staging は1トランザクションで本体を入れ替えるので、読み手は常に旧データか新データの
+    # どちらか一方だけを見る（MVCC により、コミットまでは旧データが読める）。
+    #
+    #   create table sales_staging (like sales including all);  -- 対象テーブルごと
+    #
+    #   create or replace function truncate_staging(p_table text) returns void
+    #   language plpgsql security definer as $$
+    #   begin
+    #     if p_table not in ('sales', 'purchase_data', 'item_master', 'warehouse_stock', 'benten_stock') then
+    #       raise exception 'unsupported table %', p_table;
+    #     end if;
+    #     execute format('truncate table %I', p_table || '_staging');
+    #   end $$;
+    #
+    #   create or replace function swap_staging(p_table text) returns void
+    #   language plpgsql security definer as $$
+    #   begin
+    #     if p_table not in ('sales', 'purchase_data', 'item_master', 'warehouse_stock', 'benten_stock') then
+    #       raise exception 'unsupported table %', p_table;
+    #     end if;
+    #     execute format('delete from %I', p_table);
+    #     execute format('insert into %I select * from %I', p_table, p_table || '_staging');
+    #     execute format('truncate table %I', p_table || '_staging');
+    #   end $$;
+    def begin_staged(self, table: str):
+        """
+        ステージングを空にしてその名前を返す。
+        関数またはステージングテーブルが無い場合は None（呼び出し側は従来の全削除 → 投入に戻す）
+        """
+        res = self.rpc("truncate_staging", {"p_table": table})
+        if is_missing_function(res) or is_undefined_table(res):
+            return None
+        if res.status_code >= 300:
+            raise SupabaseError(table, res.status_code, res.text)
+        return f"{table}_staging"
+
+    def swap_staged(self, table: str):
+        """ステージングの内容で本体を1トランザクションで入れ替える"""
+        res = self.rpc("swap_staging", {"p_table": table}, timeout=(5, 300))
+        if res.status_code >= 300:
+            raise SupabaseError(table, res.status_code, res.text)
+        self.notify_write(table)
+
+    # ---------- テーブル全件取得 ----------
+    def fetch_table(self, table: str, columns=None, page_size: int = None, max_workers: int = None, filters=None) -> pd.DataFrame:
+        """
+        テーブル全件取得。失敗時は SupabaseError
+        columns: 取得する列のリスト（None は select=*）。
+        filters: [(列, "eq.xxx"), ...]。指定時は一致する行だけを同じ方式でページ取得する。
+        テーブルに無い列が含まれていた場合は select=* で取り直し、存在する列だけに絞る
+        （CSV 由来で列構成が揃わないテーブルがあるため、呼び出し側は「あれば使う」列も指定できる）。
+
+        主キー（TABLE_SETTINGS の "key"）を設定したテーブルは主キー順に取得し、
+        総件数が keyset_threshold を超える場合はキーセット方式（key=gt.<直前ページの最後の値>）で順に読む。
+        OFFSET の深いページで遅くならず、取得中にアップロードが走っても行の重複・欠落が起きにくい。
+        key の無いテーブルは TABLE_SETTINGS の "order" の列順で、1ページ目の Content-Range の総件数から
+        残りのページを並列取得し、ページ順に結合する。並び順の決まらないテーブル（key も order も無い）は
+        並列にせず、空ページまで順番に取得する。
+        ページ数とページごとの所要時間は fetch_stats[table] に残す（ログにも出力）。
+        各ページの本文は1回だけパースし（decode_page）、全ページを Arrow のまま結合してから DataFrame にする。
+        列の型は table_schema の宣言どおりに揃えて返す。
+        """
+        conf = self.settings(table)
+        page_size = page_size or conf["page_size"]
+        max_workers = max_workers or conf["max_workers"]
+        key = conf["key"]
+        order = [key] if key else conf["order"]
+
+        select = list(columns) if columns else None
+        if select and key and key not in select:
+            select.append(key)
+        base = [("select", ",".join(select) if select else "*")] + list(filters or [])
+        if order:
+            base.append(("order", ",".join(f"{c}.asc" for c in order)))
+
+        latencies = []
+
+        def get_page(params, limit, count=False):
+            started = time.perf_counter()
+            res = self.select(
+                table,
+                base + params + [("limit", str(limit))],
+                headers={"Prefer": "count=exact"} if count else None,
+            )
+            latencies.append(time.perf_counter() - started)
+            return res
+
+        def decode(res):
+            """ページの行（終端なら None）。失敗時は SupabaseError"""
+            if res.status_code == 416:
+                return None
+            if res.status_code not in [200, 206]:
+                raise SupabaseError(table, res.status_code, res.text)
+            page = decode_page(res)
+            return page if len(page) else None
+
+        # 総件数は1ページ目だけで数える（毎ページ count するとサーバ側で毎回全件を数えてしまう）
+        res = get_page([("offset", "0")], page_size, count=True)
+        if columns and is_missing_column(res):
+            df = self.fetch_table(table, None, page_size, max_workers, filters)
+            return df[[c for c in columns if c in df.columns]]
+        page = decode(res)
+        if page is None:
+            return pd.DataFrame()
+        pages = [page]
+
+        # サーバ側の max-rows で1ページが短く返る場合は、その件数を刻み幅にする
+        step = min(page_size, len(page))
+        total = parse_content_range_total(res.headers.get("Content-Range"))
+
+        def read_offsets(offset):
+            while True:
+                page = decode(get_page([("offset", str(offset))], step))
+                if page is None:
+                    break
+                pages.append(page)
+                offset += step
+
+        if key and (total is None or total > conf["keyset_threshold"]):
+            mode = "keyset"
+            while len(pages[-1]) >= step:
+                last = _last_value(pages[-1], key)
+                if last is None:
+                    # key に NULL があった（昇順では NULL は末尾）。gt.None にせず、残りは OFFSET で読む
+                    logger.warning("fetch %s: NULL in key column %s, falling back to offset paging", table, key)
+                    mode = "keyset+offset"
+                    read_offsets(sum(len(p) for p in pages))
+                    break
+                page = decode(get_page([(key, f"gt.{last}")], step))
+                if page is None:
+                    break
+                pages.append(page)
+        elif total is None or not order:
+            # 総件数が取れない・並び順が決まらない場合は空ページまで順番に取得
+            mode = "offset"
+            read_offsets(step)
+        else:
+            mode = "parallel"
+            if total > step:
+                offsets = range(step, total, step)
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    # map は投入順で結果を返すので、そのまま結合すればページ順になる（デコードもワーカー内で）
+                    for page in executor.map(lambda o: decode(get_page([("offset", str(o))], step)), offsets):
+                        if page is None:
+                            break
+                        pages.append(page)
+
+        df = frame_from_pages(pages)
+        if select and key not in columns:
+            df = df.drop(columns=[key], errors="ignore")
+        df = apply_schema(table, df)
+
+        self.fetch_stats[table] = {
+            "mode": mode,
+            "rows": len(df),
+            "pages": len(latencies),
+            "page_seconds": latencies,
+            "avg_page_seconds": sum(latencies) / len(latencies),
+            "max_page_seconds": max(latencies),
+        }
+        logger.info(
+            "fetch %s: %d rows / %d pages (%s), avg %.3fs max %.3fs per page",
+            table, len(df), len(latencies), mode,
+            self.fetch_stats[table]["avg_page_seconds"], self.fetch_stats[table]["max_page_seconds"],
+        )
+        return df
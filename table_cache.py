@@ -0,0 +1,134 @@
+"""
+テーブルのスナップショットキャッシュ（プロセス共通・全セッション共有）
+
+main.py では st.cache_resource で1つだけ作る。
+キーは (テーブル名, 列の射影, フィルタ)。TTL を過ぎたエントリは古い値をそのまま返しつつ
+バックグラウンドで再取得する（stale-while-revalidate）。
+書き込みがあったテーブルは invalidate() で即座に破棄する。
+同じキーの読み込みが実行中なら、後から来た呼び出しはそれを待って同じ DataFrame を受け取る
+（複数セッションが同時に同じテーブルを開いても、サーバへの全件取得は1回だけ）。
+
+返す DataFrame は全セッションで共有しているので、呼び出し側で変更しないこと
+（main.py の fetch_table はコピーを返す）。
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+
+
+class _Entry:
+    __slots__ = ("frame", "loaded_at", "refreshing")
+
+    def __init__(self, frame, loaded_at):
+        self.frame = frame
+        self.loaded_at = loaded_at
+        self.refreshing = False
+
+
+class TableCache:
+    def __init__(self, loader, ttl: float = DEFAULT_TTL, table_ttl: dict = None):
+        """
+        loader(table, columns, filters) -> DataFrame（失敗時は例外）
+        table_ttl: テーブルごとの TTL（秒）。未指定は ttl
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.table_ttl = table_ttl or {}
+        self._entries = {}
+        self._versions = {}
+        # 実行中の読み込み: key → (版番号, Future)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(table: str, columns=None, filters=None):
+        return (table, tuple(columns) if columns else None, tuple(filters) if filters else None)
+
+    def version(self, table: str) -> int:
+        """書き込み（invalidate）のたびに増えるテーブルの版番号"""
+        with self._lock:
+            return self._versions.get(table, 0)
+
+    def get(self, table: str, columns=None, filters=None):
+        """filters: [(列, "eq.xxx"), ...]（PostgREST のフィルタ。期間などで絞った部分スナップショット用）"""
+        key = self.key(table, columns, filters)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expired = now - entry.loaded_at > self.table_ttl.get(table, self.ttl)
+                if expired and not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(target=self._refresh, args=(key,), daemon=True).start()
+                return entry.frame
+        return self._load(key)
+
+    def peek(self, table: str, columns=None, filters=None):
+        """読み込み済みならその DataFrame、無ければ None（読み込みも再取得もしない）"""
+        with self._lock:
+            entry = self._entries.get(self.key(table, columns, filters))
+            return entry.frame if entry is not None else None
+
+    def invalidate(self, table: str):
+        """table の全射影・全フィルタを破棄し、版番号を進める（読み込み中の結果も保存させない）"""
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+            for key in [k for k in self._entries if k[0] == table]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            for table in {k[0] for k in self._entries}:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            self._entries.clear()
+
+    # ---------- 内部 ----------
+    def _load(self, key):
+        table, columns, filters = key
+        with self._lock:
+            version = self._versions.get(table, 0)
+            inflight = self._inflight.get(key)
+            # 同じ版の読み込みが実行中なら相乗りする（書き込み後に来た呼び出しは古い読み込みを待たない）
+            if inflight is not None and inflight[0] == version:
+                future = inflight[1]
+                owner = False
+            else:
+                future = Future()
+                self._inflight[key] = (version, future)
+                owner = True
+        if not owner:
+            logger.debug("table cache: waiting for in-flight load %s", key)
+            return future.result()
+
+        try:
+            frame = self.loader(table, list(columns) if columns else None, list(filters) if filters else None)
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key, (None, None))[1] is future:
+                    del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            # 読み込み中に書き込みがあった場合は保存しない（途中状態を残さない）
+            if self._versions.get(table, 0) == version:
+                self._entries[key] = _Entry(frame, time.monotonic())
+            if self._inflight.get(key, (None, None))[1] is future:
+                del self._inflight[key]
+        future.set_result(frame)
+        return frame
+
+    def _refresh(self, key):
+        try:
+            self._load(key)
+        except Exception:
+            logger.exception("table cache refresh failed: %s", key)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
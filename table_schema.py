@@ -0,0 +1,148 @@
+"""
+テーブルごとの列の型（取得時に1回だけ適用する）
+
+SupabaseClient の fetch_table / select_frame がページを結合した直後に apply_schema() を呼ぶ。
+各モードで繰り返していた astype(str) / pd.to_numeric / fillna(0).astype(int) を取得時の1回にまとめ、
+キャッシュに載る DataFrame を小さくする（int32・category・Arrow の文字列）。
+スナップショットの差分マージ後にも同じ型に揃え直す。
+
+  INT          : 数値化して欠損は 0、小数は切り捨て（どのモードも fillna(0).astype(int) で使っていた列）。
+                 int32 に収まらない値があれば int64
+  NULLABLE_INT : 欠損を残す整数（Int32）。整数でない値・範囲外の値があれば float のまま
+  CATEGORY     : 値の種類が少ない文字列
+  STRING       : Arrow の文字列（pyarrow が無い / 古い pandas では object のまま）
+
+テーブルに無い列・取得していない列は何もしない。ここに無い列（id・価格・日付など）も取得したままの型。
+"""
+
+import numpy as np
+import pandas as pd
+
+INT = "int"
+NULLABLE_INT = "nullable_int"
+CATEGORY = "category"
+STRING = "string"
+
+TABLE_SCHEMAS = {
+    "sales": {
+        "jan": STRING,
+        "handling_type": CATEGORY,
+        "quantity_sold": INT,
+        "stock_total": INT,
+        "stock_available": INT,
+        "stock_ordered": INT,
+    },
+    "item_master": {
+        "jan": STRING,
+        "商品コード": STRING,
+        "商品名": STRING,
+        "メーカー名": CATEGORY,
+        "ランク": CATEGORY,
+        "取扱区分": CATEGORY,
+        "ケース入数": NULLABLE_INT,
+        "発注ロット": NULLABLE_INT,
+        "重量": NULLABLE_INT,
+        "在庫": INT,
+        "利用可能": INT,
+        "発注済": INT,
+    },
+    "purchase_data": {
+        "jan": STRING,
+        "supplier": CATEGORY,
+        "order_lot": INT,
+    },
+    "warehouse_stock": {
+        "product_code": STRING,
+        "jan": STRING,
+        "stock_available": INT,
+    },
+    "benten_stock": {
+        "jan": STRING,
+        "stock": INT,
+    },
+    "purchase_history": {
+        "jan": STRING,
+        "quantity": INT,
+        "memo": STRING,
+        "order_id": STRING,
+    },
+    "store_profit_lines": {
+        "report_period": STRING,
+        "line_type": STRING,
+        "store": CATEGORY,
+        "item": STRING,
+        "item_name": STRING,
+        "qty": INT,
+        "revenue": INT,
+        "defined_cost": INT,
+        "gross_profit": INT,
+        "original_line": STRING,
+    },
+    "item_expiry": {
+        "jan": STRING,
+        "name": STRING,
+    },
+}
+# 日次の明細は store_profit_lines と同じ列
+TABLE_SCHEMAS["store_profit_daily_lines"] = TABLE_SCHEMAS["store_profit_lines"]
+
+_INT32 = np.iinfo(np.int32)
+
+
+def _arrow_string_dtype():
+    """欠損を NaN で表す Arrow の文字列型（pandas 3 の既定の str と同じ）。使えなければ None"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)  # pandas 2.3 以降
+    except TypeError:
+        pass
+    try:
+        return pd.StringDtype("pyarrow_numpy")  # pandas 2.1 / 2.2
+    except (TypeError, ValueError):
+        return None
+
+
+ARROW_STRING = _arrow_string_dtype()
+
+
+def _fits_int32(values: pd.Series) -> bool:
+    return values.empty or (values.min() >= _INT32.min and values.max() <= _INT32.max)
+
+
+def _to_int(s: pd.Series) -> pd.Series:
+    v = np.trunc(pd.to_numeric(s, errors="coerce").fillna(0).astype("float64"))
+    return v.astype("int32" if _fits_int32(v) else "int64")
+
+
+def _to_nullable_int(s: pd.Series) -> pd.Series:
+    v = pd.to_numeric(s, errors="coerce")
+    vals = v.dropna().astype("float64")
+    if (vals == vals.round()).all() and _fits_int32(vals):
+        return v.astype("Int32")
+    return v
+
+
+def _convert(s: pd.Series, kind: str) -> pd.Series:
+    if kind == INT:
+        return s if s.dtype == "int32" else _to_int(s)
+    if kind == NULLABLE_INT:
+        return s if s.dtype == "Int32" else _to_nullable_int(s)
+    if kind == CATEGORY:
+        return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype("category")
+    if kind == STRING and ARROW_STRING is not None:
+        return s if s.dtype == ARROW_STRING else s.astype(ARROW_STRING)
+    return s
+
+
+def apply_schema(table: str, df: pd.DataFrame) -> pd.DataFrame:
+    """table の宣言どおりに列の型を揃える（df をそのまま書き換えて返す。宣言の無いテーブルは何もしない）"""
+    schema = TABLE_SCHEMAS.get(table)
+    if not schema or df is None or df.empty:
+        return df
+    for col, kind in schema.items():
+        if col in df.columns:
+            df[col] = _convert(df[col], kind)
+    return df
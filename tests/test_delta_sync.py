@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from delta_sync import apply_delta, diff_rows, row_hashes
+
+
+def _stock(rows):
+    return pd.DataFrame(rows, columns=["product_code", "jan", "stock_available"])
+
+
+def test_row_hashes_ignore_formatting_differences():
+    a = _stock([("A1", "4901", 10), ("B2", None, 5)])
+    b = _stock([(" A1 ", "4901 ", "10.0"), ("B2", np.nan, 5.0)])
+    ha = row_hashes(a, "product_code", ["jan", "stock_available"], numeric_cols=["stock_available"])
+    hb = row_hashes(b, "product_code", ["jan", "stock_available"], numeric_cols=["stock_available"])
+    assert ha.index.tolist() == ["A1", "B2"]
+    assert hb.index.tolist() == ["A1", "B2"]
+    assert (ha == hb).all()
+
+
+def test_row_hashes_detect_value_changes_and_keep_last_duplicate():
+    df = _stock([("A1", "4901", 10), ("A1", "4901", 11), ("B2", "4902", 5)])
+    h = row_hashes(df, "product_code", ["jan", "stock_available"], numeric_cols=["stock_available"])
+    last = row_hashes(df.iloc[[1]], "product_code", ["jan", "stock_available"], numeric_cols=["stock_available"])
+    assert len(h) == 2
+    assert h["A1"] == last["A1"]
+    first = row_hashes(df.iloc[[0]], "product_code", ["jan", "stock_available"], numeric_cols=["stock_available"])
+    assert first["A1"] != last["A1"]
+
+
+def test_diff_rows():
+    current = _stock([("A1", "4901", 10), ("B2", "4902", 5), ("C3", "4903", 1)])
+    new = _stock([("A1", "4901", 10), ("B2", "4902", 6), ("D4", "4904", 7), ("D4", "4904", 8)])
+    inserts, updates, deleted = diff_rows(new, current, "product_code", ["jan", "stock_available"], ["stock_available"])
+    assert inserts["product_code"].tolist() == ["D4"]
+    assert inserts["stock_available"].tolist() == [8]
+    assert updates["product_code"].tolist() == ["B2"]
+    assert deleted == ["C3"]
+
+
+def test_diff_rows_against_empty_current_inserts_everything():
+    new = _stock([("A1", "4901", 10)])
+    inserts, updates, deleted = diff_rows(new, pd.DataFrame(), "product_code", ["stock_available"])
+    assert len(inserts) == 1 and updates.empty and deleted == []
+
+
+class Response:
+    status_code = 204
+    text = ""
+
+
+class FakeClient:
+    def __init__(self):
+        self.upserts = []
+        self.deletes = []
+
+    def bulk_insert(self, table, df, prefer=None, on_conflict=None, progress=None):
+        self.upserts.append((table, on_conflict, df["product_code"].tolist()))
+
+    def delete(self, table, filters):
+        self.deletes.append((table, filters))
+        return Response()
+
+
+def test_apply_delta_sends_only_changes():
+    client = FakeClient()
+    current = _stock([("A1", "4901", 10), ("B2", "4902", 5), ("C3", "4903", 1)])
+    new = _stock([("A1", "4901", 10), ("B2", "4902", 6), ("D4", "4904", 7)])
+    stats = apply_delta(
+        client, "warehouse_stock", new, "product_code", ["jan", "stock_available"],
+        numeric_cols=["stock_available"], current=current,
+    )
+    assert stats == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+    assert client.upserts == [("warehouse_stock", "product_code", ["D4", "B2"])]
+    assert client.deletes == [("warehouse_stock", [("product_code", 'in.("C3")')])]
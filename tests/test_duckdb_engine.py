@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+import duckdb_engine
+from benchmarks.synthetic import generate_tables
+from jan_codes import normalize_jan
+
+
+class FakeCache:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def get(self, table, columns=None):
+        df = self.tables[table]
+        return df if columns is None else df[columns]
+
+
+@pytest.fixture(scope="module")
+def data():
+    t = generate_tables(400, seed=3)
+    master = t["item_master"]
+    items = pd.DataFrame({
+        "JAN": normalize_jan(master["jan"]),
+        "商品名": master["商品名"].where(master.index % 9 != 0, "特価(限定) " + master["商品名"]),
+        "メーカー名": master["メーカー名"],
+        "ランク": master["ランク"].astype(str),
+        "ケース入数": master["ケース入数"],
+        "発注ロット": master["発注ロット"],
+        "発注済": pd.to_numeric(master["発注済"], errors="coerce").fillna(0).astype(int),
+        "JD在庫": 0,
+        "弁天在庫": 0,
+        "最安原価": pd.to_numeric(master["purchase_cost"], errors="coerce"),
+    }).drop_duplicates(subset=["JAN"]).sample(frac=1, random_state=0)
+    engine = duckdb_engine.QueryEngine(FakeCache({"sales": t["sales"]}), threads=2)
+    return engine, items, t["sales"]
+
+
+def _pandas_rank_check(items, sales, ranks, name=""):
+    """main.py の pandas の処理と同じ"""
+    sales = sales.assign(JAN=normalize_jan(sales["jan"]))
+    sales_30 = (
+        sales.groupby("JAN", as_index=False)["quantity_sold"].sum()
+        .rename(columns={"quantity_sold": "実績（30日）"})
+    )
+    df = items.merge(sales_30, on="JAN", how="left")
+    df["実績（30日）"] = df["実績（30日）"].fillna(0)
+    df = df[df["ランク"].isin(ranks)]
+    if name:
+        df = df[df["商品名"].str.contains(name, case=False, na=False, regex=False)]
+    return df
+
+
+@pytest.mark.parametrize("name", ["", "商品1", "(限定)", "特価(限"])
+def test_rank_check_matches_pandas_order(data, name):
+    engine, items, sales = data
+    ranks = ["Aランク", "Bランク", "TEST"]
+    got = duckdb_engine.rank_check(engine, items, ranks, name=name)
+    expected = _pandas_rank_check(items, sales, ranks, name)
+    assert len(expected) > 0
+    assert got["JAN"].tolist() == expected["JAN"].tolist()
+    assert got["実績（30日）"].tolist() == expected["実績（30日）"].astype(float).tolist()
+    assert "_row" not in got.columns
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_tables
+from item_view import build_item_360
+from jan_codes import normalize_jan
+
+
+def _tables():
+    t = generate_tables(500, seed=1)
+    master = t["item_master"].copy()
+    # 商品コードと JAN が違う商品、倉庫の jan が product_code と違う行、商品名・ランクの欠損や空白
+    master.loc[::7, "商品コード"] = "X" + master.loc[::7, "jan"].astype(str)
+    master.loc[::11, "商品名"] = np.nan
+    master.loc[::13, "ランク"] = "Aランク "
+    warehouse = t["warehouse_stock"].copy()
+    warehouse.loc[::5, "jan"] = "0" + warehouse.loc[::5, "jan"].astype(str) + "9"
+    return master, warehouse, t["benten_stock"], t["purchase_history"]
+
+
+def _merged_stock(master_keys, warehouse, warehouse_key):
+    """従来の各モードの結合（normalize_jan したキーで left merge、照合できなければ 0）"""
+    wh = pd.DataFrame({
+        "key": normalize_jan(warehouse[warehouse_key]),
+        "stock": pd.to_numeric(warehouse["stock_available"], errors="coerce"),
+    })
+    left = pd.DataFrame({"key": normalize_jan(master_keys)})
+    return left.merge(wh, on="key", how="left")["stock"].fillna(0).astype(int).tolist()
+
+
+def test_jd_stock_keeps_each_mode_key():
+    master, warehouse, benten, history = _tables()
+    df = build_item_360(master, warehouse, benten, history)
+    assert len(df) == len(master)
+    # monthly_sales: product_code = 商品コード
+    assert df["JD在庫"].tolist() == _merged_stock(master["商品コード"], warehouse, "product_code")
+    # search_item: product_code = jan
+    assert df["JD在庫_JAN"].tolist() == _merged_stock(master["jan"], warehouse, "product_code")
+    # rank_check: warehouse_stock.jan = jan
+    assert df["JD在庫_倉庫JAN"].tolist() == _merged_stock(master["jan"], warehouse, "jan")
+    assert df["JD在庫"].tolist() != df["JD在庫_JAN"].tolist()
+    assert df["JD在庫_JAN"].tolist() != df["JD在庫_倉庫JAN"].tolist()
+
+
+def test_missing_names_stay_missing():
+    master, warehouse, benten, history = _tables()
+    df = build_item_360(master, warehouse, benten, history)
+    assert df["商品名"].isna().sum() == master["商品名"].isna().sum() > 0
+    assert not (df["商品名"].astype(object) == "nan").any()
+
+
+def test_rank_values_are_kept_as_is():
+    master, warehouse, benten, history = _tables()
+    df = build_item_360(master, warehouse, benten, history)
+    assert (df["ランク"].astype(object) == "Aランク ").sum() == (master["ランク"] == "Aランク ").sum()
+
+
+def test_shanghai_quantity_is_subtracted():
+    master = pd.DataFrame({"jan": ["1", "2"], "商品コード": ["1", "2"], "発注済": [10, 3]})
+    history = pd.DataFrame({"jan": ["1", "2", "2"], "quantity": [4, 5, 1], "memo": ["上海", "上海便", "国内"]})
+    df = build_item_360(master, None, None, history)
+    assert df["上海数量"].tolist() == [4, 5]
+    assert df["発注済_修正後"].tolist() == [6, 0]
+    assert df["JD在庫"].tolist() == [0, 0]
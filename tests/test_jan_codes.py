@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from jan_codes import normalize_jan
+
+
+def test_basic_rules():
+    values = [" 4901234567890 ", "４９０１２３４５６７８９０", "4901234567890.0", "49 0123", None, np.nan, "ABC-1"]
+    assert normalize_jan(values).tolist() == [
+        "4901234567890", "4901234567890", "4901234567890", "490123", "", "", "ABC-1",
+    ]
+
+
+def test_float_column():
+    s = pd.Series([4901234567890.0, np.nan, 12.5])
+    assert normalize_jan(s).tolist() == ["4901234567890", "", "12.5"]
+
+
+def test_keeps_index_and_na_value():
+    s = pd.Series(["1", None], index=[10, 20])
+    out = normalize_jan(s, na_value=None)
+    assert out.index.tolist() == [10, 20]
+    assert out.tolist() == ["1", None]
+
+
+def test_empty_input():
+    assert normalize_jan([]).tolist() == []
+    assert normalize_jan([None, None]).tolist() == ["", ""]
+
+
+@pytest.mark.parametrize("value, n, expected", [
+    ("0004901234567", 1, "4901234567"),
+    ("00000123", 5, "123"),
+    ("0000123", 5, "0000123"),
+    ("0000", 1, "0"),
+    ("00000", 5, "0"),
+    ("0", 1, "0"),
+    ("0ABC", 1, "0ABC"),
+    ("00000ABC", 5, "00000ABC"),
+    ("０００１２", 1, "12"),
+    ("0012.0", 1, "12"),
+])
+def test_leading_zeros_only_for_digits(value, n, expected):
+    assert normalize_jan([value], leading_zeros=n).tolist() == [expected]
+
+
+def test_digits_only():
+    assert normalize_jan(["JAN:4901-2345", "abc"], digits_only=True).tolist() == ["49012345", ""]
+    assert normalize_jan(["A0012"], leading_zeros=1, digits_only=True).tolist() == ["12"]
+
+
+def test_matches_per_value_rules_on_many_values():
+    rng = np.random.default_rng(0)
+    pool = ["4901234567890", "04901234567890", "00000012", "12.0", " 7 ", "ＡＢ", "0X", None]
+    values = rng.choice(np.array(pool, dtype=object), 5000).tolist()
+    out = normalize_jan(values, leading_zeros=1)
+    expected = {v: normalize_jan([v], leading_zeros=1).iat[0] for v in pool}
+    assert out.tolist() == [expected[v] for v in values]
@@ -0,0 +1,160 @@
+"""
+ベクトル化した order_engine と、従来の1行ずつのループ（baseline の main.py）の結果が一致するか
+"""
+
+import math
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_tables
+from order_engine import (
+    RANK_MULTIPLIER,
+    RESULT_COLUMNS,
+    PurchaseIndex,
+    compute_order_results,
+    compute_price_improve,
+    current_purchase_prices,
+    prepare_order_inputs,
+    prepare_price_improve_inputs,
+)
+
+TODAY = date(2026, 10, 1)
+
+
+def _rank_base(rank):
+    s = str(rank).strip()
+    for base in ("A", "B", "C"):
+        if s.startswith(f"{base}ランク"):
+            return base
+    return ""
+
+
+def _nearest(options, need):
+    """C/TEST・価格改善のロット選択（従来の smaller → near → ロット1 → 最小ロット）"""
+    options = options.assign(diff=(options["order_lot"] - need).abs())
+    smaller = options[options["order_lot"] <= need]
+    if not smaller.empty:
+        return smaller.loc[smaller["diff"].idxmin()]
+    near = options[(options["order_lot"] > need) & (options["order_lot"] <= need * 1.5) & (options["order_lot"] != 1)]
+    if not near.empty:
+        return near.loc[near["diff"].idxmin()]
+    one = options[options["order_lot"] == 1]
+    if not one.empty:
+        return one.iloc[0]
+    # 同じロットは先に出てくる行（安定ソート）
+    return options.sort_values("order_lot", kind="stable").iloc[0]
+
+
+def _reference_order_results(df_sales, df_master, df_warehouse, df_purchase, recent_jans, use_warehouse=True):
+    results = []
+    for _, row in df_sales.iterrows():
+        jan, sold, ordered = row["jan"], row["quantity_sold"], row["発注済"]
+        if use_warehouse:
+            stock_row = df_warehouse[df_warehouse["product_code"] == jan]
+            stock = stock_row["stock_available"].values[0] if not stock_row.empty else 0
+        else:
+            stock = row["stock_available"]
+        rank_row = df_master[df_master["jan"] == jan]
+        rank = str(rank_row.iloc[0]["ランク"]) if not rank_row.empty and pd.notna(rank_row.iloc[0]["ランク"]) else ""
+        base_rank = _rank_base(rank)
+        if jan in recent_jans:
+            continue
+
+        current_total = stock + ordered
+        if base_rank in ["A", "B"]:
+            if current_total >= max(math.ceil(sold * 1.2), 1):
+                continue
+            base_needed = max(math.ceil(sold * 1.7), 0)
+            if stock <= 1 and sold >= 1 and base_needed <= 0:
+                base_needed = 1
+        else:
+            if current_total > max(math.floor(sold * 0.7), 1):
+                continue
+            need_raw = math.ceil(sold * RANK_MULTIPLIER.get(rank, 1.0)) - stock - ordered
+            base_needed = 1 if (stock <= 1 and sold >= 1 and need_raw <= 0) else max(need_raw, 0)
+            if base_needed <= 0:
+                continue
+
+        options = df_purchase[df_purchase["jan"] == jan]
+        options = options[(options["order_lot"] > 0) & options["price"].notna() & (options["price"] > 0)]
+        out = {"jan": jan, "販売実績": sold, "在庫": stock, "発注済": ordered, "理論必要数": base_needed, "ランク": rank}
+        if options.empty:
+            results.append({**out, "発注数": "", "ロット": "", "数量": "", "単価": "", "総額": "", "仕入先": ""})
+            continue
+
+        if base_rank in ["A", "B"]:
+            bigger = options[options["order_lot"] >= base_needed]
+            if not bigger.empty:
+                best = bigger.sort_values("order_lot", kind="stable").iloc[0]
+            else:
+                best = options[options["order_lot"] == options["order_lot"].max()].iloc[0]
+        else:
+            best = _nearest(options, base_needed)
+
+        lot = int(best["order_lot"])
+        sets = math.ceil(base_needed / lot)
+        qty = sets * lot
+        results.append({
+            **out, "発注数": int(qty), "ロット": lot, "数量": int(sets), "単価": int(best["price"]),
+            "総額": int(qty * float(best["price"])), "仕入先": best["supplier"],
+        })
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def _reference_current_prices(df_sales, df_purchase):
+    prices = {}
+    for _, row in df_sales.iterrows():
+        jan, sold = row["jan"], row["quantity_sold"]
+        stock, ordered = row.get("stock_available", 0), row.get("stock_ordered", 0)
+        options = df_purchase[(df_purchase["jan"] == jan) & (df_purchase["order_lot"] > 0)]
+        need = 0 if stock >= sold else max(sold - stock + math.ceil(sold * 0.5) - ordered, 0)
+        if options.empty or need <= 0:
+            continue
+        prices[jan] = _nearest(options, need)["price"]
+    return prices
+
+
+def _records(df):
+    """値の比較用（numpy の数値型を Python の値に揃える）"""
+    return [
+        tuple(v.item() if isinstance(v, np.generic) else v for v in row)
+        for row in df[RESULT_COLUMNS].itertuples(index=False, name=None)
+    ]
+
+
+@pytest.fixture(scope="module", params=[0, 1, 2])
+def tables(request):
+    return generate_tables(300, seed=request.param, today=TODAY)
+
+
+@pytest.mark.parametrize("use_warehouse", [True, False])
+def test_order_results_match_row_loop(tables, use_warehouse):
+    df_sales, df_master, df_warehouse, df_purchase, recent_jans = prepare_order_inputs(
+        tables["sales"], tables["purchase_data"], tables["item_master"],
+        tables["warehouse_stock"], tables["purchase_history"], today=TODAY, use_warehouse=use_warehouse,
+    )
+    got = compute_order_results(
+        df_sales, df_master, df_warehouse, PurchaseIndex(df_purchase), recent_jans, use_warehouse=use_warehouse,
+    )
+    expected = _reference_order_results(df_sales, df_master, df_warehouse, df_purchase, recent_jans, use_warehouse)
+    assert len(expected) > 0
+    assert _records(got) == _records(expected)
+
+
+def test_current_prices_match_row_loop(tables):
+    df_sales, df_purchase, _ = prepare_price_improve_inputs(
+        tables["sales"], tables["purchase_data"], tables["item_master"],
+    )
+    got = current_purchase_prices(df_sales, PurchaseIndex(df_purchase))
+    expected = _reference_current_prices(df_sales, df_purchase)
+    assert got.to_dict() == pytest.approx(expected)
+
+
+def test_price_improve_lists_only_cheaper_known_items(tables):
+    df = compute_price_improve(tables["sales"], tables["purchase_data"], tables["item_master"])
+    assert list(df.columns) == ["商品コード", "JAN", "メーカー名", "現在の仕入価格", "最安値の仕入価格", "差分"]
+    assert (df["最安値の仕入価格"] < df["現在の仕入価格"]).all()
+    assert df["JAN"].isin(tables["item_master"]["jan"]).all()
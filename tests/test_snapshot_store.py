@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import snapshot_store
+from snapshot_store import SnapshotStore
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeClient:
+    """sales だけを持つサーバ。updated_at 列・トリガーの有無を指定できる"""
+
+    def __init__(self, ready=True, has_function=True):
+        self.ready = ready
+        self.has_function = has_function
+        self.sales = pd.DataFrame({
+            "id": [1, 2, 3],
+            "jan": ["a", "b", "c"],
+            "quantity_sold": [1, 2, 3],
+            "memo": ["x", "y", "z"],
+            "updated_at": ["2026-10-01T00:00:00+00:00"] * 3,
+        })
+        self.fetched = []
+
+    def rpc(self, name, payload=None, timeout=None):
+        if not self.has_function:
+            return Response(404, {"code": "PGRST202"})
+        return Response(200, [
+            {"table_name": "sales", "has_updated_at": True, "has_touch": self.ready, "has_tombstone": False},
+        ])
+
+    def fetch_table(self, table, columns=None, filters=None):
+        self.fetched.append((table, columns))
+        df = self.sales
+        for col, cond in filters or []:
+            op, value = cond.split(".", 1)
+            assert op == "gt"
+            df = df[pd.to_datetime(df[col], utc=True, format="ISO8601") > pd.Timestamp(value)]
+        return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+    def update(self, row_id, **values):
+        i = self.sales.index[self.sales["id"] == row_id][0]
+        for col, v in values.items():
+            self.sales.loc[i, col] = v
+        self.sales.loc[i, "updated_at"] = pd.Timestamp.now(tz="UTC").isoformat()
+
+
+def make_store(tmp_path, client):
+    return SnapshotStore(client, str(tmp_path), tables={"sales": "id"})
+
+
+def test_table_without_trigger_or_function_is_not_used(tmp_path):
+    assert "sales" not in make_store(tmp_path, FakeClient(ready=False))
+    assert "sales" not in make_store(tmp_path, FakeClient(has_function=False))
+    assert "sales" in make_store(tmp_path, FakeClient())
+
+
+def test_full_load_keeps_projection(tmp_path):
+    client = FakeClient()
+    store = make_store(tmp_path, client)
+    df = store.read("sales", ["jan", "quantity_sold"])
+    assert list(df.columns) == ["jan", "quantity_sold"]
+    assert client.fetched == [("sales", ["id", "jan", "quantity_sold", "updated_at"])]
+
+    # 足りない列が読まれたら列を広げて取り直す
+    df = store.read("sales", ["memo"])
+    assert list(df["memo"]) == ["x", "y", "z"]
+    assert client.fetched[-1] == ("sales", ["id", "jan", "memo", "quantity_sold", "updated_at"])
+
+
+def test_invalidate_forces_sync_within_interval(tmp_path):
+    client = FakeClient()
+    store = make_store(tmp_path, client)
+    store.read("sales", ["jan", "quantity_sold"])
+
+    client.update(2, quantity_sold=20)
+    # MIN_SYNC_INTERVAL 内は同期しない
+    assert list(store.read("sales", ["quantity_sold"])["quantity_sold"]) == [1, 2, 3]
+
+    store.invalidate("sales")
+    assert list(store.read("sales", ["quantity_sold"])["quantity_sold"]) == [1, 20, 3]
+    assert store.sync_stats["sales"]["mode"] == "delta"
@@ -0,0 +1,141 @@
+import json
+import threading
+
+import pandas as pd
+import pytest
+import requests
+
+from supabase_client import SupabaseClient, SupabaseError, parse_content_range_total
+
+
+class Response:
+    def __init__(self, rows, total=None, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(rows).encode()
+        self.text = self.content.decode()
+        self.headers = {"Content-Range": f"0-{len(rows) - 1}/{total}"} if total is not None else {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeSession:
+    """PostgREST の GET を真似る（gt. で絞り、order があれば NULL を末尾に並べ、limit / offset でページを切る）"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        params = dict(params)
+        with self._lock:
+            self.params.append(params)
+        rows = self.rows
+        for col, cond in params.items():
+            if cond.startswith("gt."):
+                rows = [r for r in rows if r[col] is not None and r[col] > type(r[col])(cond[3:])]
+        if "order" in params:
+            cols = [c.rsplit(".", 1)[0] for c in params["order"].split(",")]
+            rows = sorted(rows, key=lambda r: [(r[c] is None, r[c] or 0) for c in cols])
+        offset = int(params.get("offset", 0))
+        page = rows[offset:offset + int(params["limit"])]
+        count = headers and headers.get("Prefer") == "count=exact"
+        return Response(page, total=len(self.rows) if count else None)
+
+
+def make_client(rows):
+    client = SupabaseClient("https://example.supabase.co", "key", page_size=2, max_workers=4)
+    client.session = FakeSession(rows)
+    return client
+
+
+def test_parse_content_range_total():
+    assert parse_content_range_total("0-999/12345") == 12345
+    assert parse_content_range_total("0-999/*") is None
+    assert parse_content_range_total(None) is None
+
+
+def test_table_with_order_setting_is_fetched_in_order():
+    rows = [{"jan": j, "name": n} for j, n in [("3", "c"), ("1", "a"), ("5", "e"), ("2", "b"), ("4", "d")]]
+    client = make_client(rows)
+    df = client.fetch_table("item_expiry")
+    assert list(df["jan"]) == ["1", "2", "3", "4", "5"]
+    assert all(p["order"] == "jan.asc" for p in client.session.params)
+    assert client.fetch_stats["item_expiry"]["mode"] == "parallel"
+
+
+def test_table_without_order_is_fetched_sequentially():
+    rows = [{"report_period": "2026-09", "original_line": f"line {i}"} for i in range(5)]
+    client = make_client(rows)
+    df = client.fetch_table("store_profit_lines", ["original_line"])
+    assert list(df["original_line"]) == [f"line {i}" for i in range(5)]
+    assert all("order" not in p for p in client.session.params)
+    assert client.fetch_stats["store_profit_lines"]["mode"] == "offset"
+
+
+@pytest.mark.parametrize("threshold, mode", [(0, "keyset"), (100, "parallel")])
+def test_keyed_table_orders_by_key(threshold, mode):
+    rows = [{"id": i, "jan": str(i)} for i in [4, 2, 5, 1, 3]]
+    client = make_client(rows)
+    client.keyset_threshold = threshold
+    df = client.fetch_table("sales", ["jan"])
+    assert list(df.columns) == ["jan"]
+    assert list(df["jan"]) == ["1", "2", "3", "4", "5"]
+    assert client.fetch_stats["sales"]["mode"] == mode
+
+
+def test_keyset_falls_back_to_offset_at_null_key():
+    # 昇順では NULL は末尾に来るので、NULL を含むページ以降は gt. で絞れない
+    rows = [{"id": i, "jan": str(n)} for n, i in enumerate([None, 1, None])]
+    client = make_client(rows)
+    client.keyset_threshold = 0
+    df = client.fetch_table("sales", ["jan"])
+    assert sorted(df["jan"]) == ["0", "1", "2"]
+    assert not any(v == "gt.None" for p in client.session.params for v in p.values())
+    assert client.fetch_stats["sales"]["mode"] == "keyset+offset"
+
+
+@pytest.mark.parametrize("table, column", [("warehouse_stock", "product_code"), ("benten_stock", "jan")])
+def test_non_unique_key_tables_do_not_use_keyset(table, column):
+    # 同じ値が複数行ある列で gt. を使うと、ページ境界の行を読み飛ばす
+    rows = [{column: v, "stock": i} for i, v in enumerate(["A", "A", "A", "B", "B"])]
+    client = make_client(rows)
+    client.keyset_threshold = 0
+    df = client.fetch_table(table)
+    assert sorted(df["stock"]) == [0, 1, 2, 3, 4]
+    assert client.fetch_stats[table]["mode"] == "offset"
+
+
+class FlakySession:
+    """最初の POST で error を投げ、以降は 201 を返す"""
+
+    def __init__(self, error):
+        self.error = error
+        self.posts = 0
+
+    def request(self, method, url, **kwargs):
+        self.posts += 1
+        if self.posts == 1:
+            raise self.error
+        res = Response([], status_code=201)
+        res.request = type("Request", (), {"body": kwargs.get("data")})()
+        return res
+
+
+@pytest.mark.parametrize("error, on_conflict, posts", [
+    (requests.ConnectTimeout("connect"), None, 2),
+    (requests.ReadTimeout("read"), None, 1),
+    (requests.ReadTimeout("read"), "jan", 2),
+])
+def test_bulk_insert_retries_only_when_safe(error, on_conflict, posts):
+    # 送信後のタイムアウトは書き込み済みのことがあるので、INSERT は送り直さない
+    client = SupabaseClient("https://example.supabase.co", "key", write_workers=1)
+    client.session = FlakySession(error)
+    rows = pd.DataFrame({"jan": ["1", "2"]})
+    if posts == 1:
+        with pytest.raises(SupabaseError):
+            client.bulk_insert("sales", rows, on_conflict=on_conflict, backoff=0)
+    else:
+        assert client.bulk_insert("sales", rows, on_conflict=on_conflict, backoff=0) == 2
+    assert client.session.posts == posts
@@ -0,0 +1,123 @@
+import threading
+import time
+
+from table_cache import TableCache
+
+
+class SlowLoader:
+    """呼ばれた回数を数え、release されるまで戻らない loader"""
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, table, columns, filters):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        self.started.set()
+        assert self.release.wait(5)
+        return {"table": table, "columns": columns, "load": n}
+
+
+def _run(threads):
+    for t in threads:
+        t.start()
+    return threads
+
+
+def test_concurrent_misses_share_one_load():
+    loader = SlowLoader()
+    cache = TableCache(loader)
+    results = []
+    threads = _run([threading.Thread(target=lambda: results.append(cache.get("sales", ["jan"]))) for _ in range(8)])
+    assert loader.started.wait(5)
+    time.sleep(0.05)
+    loader.release.set()
+    for t in threads:
+        t.join(5)
+    assert loader.calls == 1
+    assert len(results) == 8 and all(r is results[0] for r in results)
+    # 2回目以降はキャッシュから
+    assert cache.get("sales", ["jan"]) is results[0]
+    assert loader.calls == 1
+
+
+def test_different_projections_load_separately():
+    loader = SlowLoader()
+    loader.release.set()
+    cache = TableCache(loader)
+    assert cache.get("sales", ["jan"])["columns"] == ["jan"]
+    assert cache.get("sales", ["jan", "quantity_sold"])["columns"] == ["jan", "quantity_sold"]
+    assert loader.calls == 2
+
+
+def test_load_started_before_invalidate_is_not_shared_or_stored():
+    loader = SlowLoader()
+    cache = TableCache(loader)
+    first = []
+    t = _run([threading.Thread(target=lambda: first.append(cache.get("sales")))])[0]
+    assert loader.started.wait(5)
+
+    cache.invalidate("sales")
+    second = []
+    t2 = _run([threading.Thread(target=lambda: second.append(cache.get("sales")))])[0]
+    time.sleep(0.05)
+    loader.release.set()
+    t.join(5)
+    t2.join(5)
+
+    # 書き込み後の呼び出しは古い読み込みに相乗りしない
+    assert loader.calls == 2
+    assert first[0]["load"] != second[0]["load"]
+    assert cache.peek("sales") is second[0]
+
+
+def test_failed_load_is_raised_to_all_waiters_and_retried():
+    calls = []
+    gate = threading.Event()
+
+    def loader(table, columns, filters):
+        calls.append(table)
+        gate.wait(5)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    cache = TableCache(loader)
+    errors = []
+
+    def get():
+        try:
+            cache.get("sales")
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = _run([threading.Thread(target=get) for _ in range(4)])
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1 and len(errors) == 4
+    assert cache.get("sales") == "ok"
+
+
+def test_expired_entry_is_returned_while_refreshing():
+    loads = []
+
+    def loader(table, columns, filters):
+        loads.append(time.monotonic())
+        return len(loads)
+
+    cache = TableCache(loader, ttl=0)
+    assert cache.get("sales") == 1
+    time.sleep(0.01)
+    # 期限切れでも古い値をすぐ返し、バックグラウンドで再取得する
+    assert cache.get("sales") == 1
+    for _ in range(100):
+        if cache.peek("sales") == 2:
+            break
+        time.sleep(0.01)
+    assert cache.peek("sales") == 2
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from table_schema import ARROW_STRING, apply_schema
+
+
+def test_int_columns_fill_missing_and_truncate():
+    df = apply_schema("sales", pd.DataFrame({"quantity_sold": ["3", None, 2.9, "x", -1.5]}))
+    assert df["quantity_sold"].dtype == "int32"
+    assert df["quantity_sold"].tolist() == [3, 0, 2, 0, -1]
+
+
+def test_int_column_too_large_for_int32_is_int64():
+    df = apply_schema("sales", pd.DataFrame({"quantity_sold": [1, 2 ** 40]}))
+    assert df["quantity_sold"].dtype == "int64"
+    assert df["quantity_sold"].tolist() == [1, 2 ** 40]
+
+
+def test_nullable_int_keeps_missing():
+    df = apply_schema("item_master", pd.DataFrame({"ケース入数": [12, None, "24"], "重量": [1.5, None, 2]}))
+    assert df["ケース入数"].dtype == "Int32"
+    assert df["ケース入数"].isna().tolist() == [False, True, False]
+    assert df["ケース入数"].dropna().tolist() == [12, 24]
+    # 整数でない値があれば float のまま
+    assert df["重量"].dtype == "float64"
+
+
+def test_category_and_string_columns():
+    df = apply_schema("item_master", pd.DataFrame({
+        "ランク": ["Aランク", "Bランク", "Aランク", None],
+        "商品名": ["りんご", None, "みかん", "ぶどう"],
+    }))
+    assert isinstance(df["ランク"].dtype, pd.CategoricalDtype)
+    assert df["ランク"].isna().tolist() == [False, False, False, True]
+    if ARROW_STRING is not None:
+        assert df["商品名"].dtype == ARROW_STRING
+    # 文字列列の欠損は欠損のまま（"nan" / "None" にしない）
+    assert df["商品名"].isna().tolist() == [False, True, False, False]
+
+
+def test_undeclared_table_and_columns_are_untouched():
+    df = pd.DataFrame({"id": [1, 2], "price": ["1.5", "2"]})
+    assert apply_schema("unknown_table", df) is df
+    out = apply_schema("sales", df.assign(quantity_sold=[1.0, np.nan]))
+    assert out["price"].tolist() == ["1.5", "2"]
+    assert out["id"].dtype == df["id"].dtype
+
+
+def test_empty_frame_and_idempotent():
+    empty = pd.DataFrame()
+    assert apply_schema("sales", empty) is empty
+    df = apply_schema("sales", pd.DataFrame({"jan": ["1"], "quantity_sold": [1], "handling_type": ["x"]}))
+    again = apply_schema("sales", df.copy())
+    assert again.dtypes.equals(df.dtypes)
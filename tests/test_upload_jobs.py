@@ -0,0 +1,176 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from upload_jobs import UploadJob, key_filters, stream_chunks
+
+_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+def _split(text):
+    """トップレベルのカンマで区切る（括弧・引用符の中は区切らない）"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"' and text[i - 1] != "\\":
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(text[start:i])
+            start = i + 1
+    return parts + [text[start:]]
+
+
+def _unquote(value):
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def _matches(row, term):
+    """key_filters が出す PostgREST の条件1つを行に当てはめる"""
+    if term.startswith("and("):
+        return all(_matches(row, t) for t in _split(term[4:-1]))
+    col, op, value = term.split(".", 2)
+    if op == "is":
+        return pd.isna(row[col])
+    if pd.isna(row[col]):
+        return False
+    if op == "eq":
+        return str(row[col]) == _unquote(_QUOTED.fullmatch(value).group(1))
+    assert op == "in"
+    return str(row[col]) in {_unquote(v) for v in _QUOTED.findall(value)}
+
+
+def _filter_matches(row, filters):
+    for col, cond in filters:
+        if col == "or":
+            if not any(_matches(row, t) for t in _split(cond[1:-1])):
+                return False
+        elif not _matches(row, f"{col}.{cond}"):
+            return False
+    return True
+
+
+class FakeTable:
+    """
+    id の無いテーブル（sales / purchase_data）。POST はバッチごとに確定し、fail_after バッチ目の後で失敗する。
+    DELETE は key_filters のフィルタをそのまま評価する
+    """
+
+    def __init__(self, batch=2, fail_after=None, key_cols=("jan",)):
+        self.rows = []
+        self.batch = batch
+        self.fail_after = fail_after
+        self.posted_batches = 0
+        self.key_cols = list(key_cols)
+
+    def begin(self):
+        self.rows = []
+        return "sales"
+
+    def post(self, target, df):
+        for i in range(0, len(df), self.batch):
+            if self.fail_after is not None and self.posted_batches >= self.fail_after:
+                raise RuntimeError("POST failed")
+            self.rows.extend(df.iloc[i:i + self.batch].to_dict("records"))
+            self.posted_batches += 1
+
+    def delete_keys(self, target, keys):
+        filters = key_filters(self.key_cols, keys)
+        self.rows = [r for r in self.rows if not _filter_matches(r, filters)]
+
+    def run(self, chunks, job):
+        return stream_chunks(
+            "sales", iter(chunks), self.key_cols, job,
+            begin=self.begin, post=self.post, delete_keys=self.delete_keys, finish=lambda target: None,
+        )
+
+
+def make_chunks(n_chunks=3, rows=5):
+    return [
+        pd.DataFrame({"jan": [f"49{c}{r:04d}" for r in range(rows)], "quantity_sold": range(rows)})
+        for c in range(n_chunks)
+    ]
+
+
+def new_job(checkpoint=None):
+    return UploadJob("job", "sales", "sales.csv", run=None, source=b"", checkpoint=checkpoint)
+
+
+def test_stream_chunks_writes_all_rows():
+    table = FakeTable()
+    assert table.run(make_chunks(), new_job()) == 15
+    assert len(table.rows) == 15
+
+
+@pytest.mark.parametrize("fail_after", [1, 4])
+def test_resume_after_partial_chunk_does_not_duplicate_rows(fail_after):
+    # fail_after=1: 最初のチャンクの途中（1バッチ確定後）で失敗 / 4: 2番目のチャンクの途中
+    chunks = make_chunks()
+    table = FakeTable(fail_after=fail_after)
+    job = new_job()
+    with pytest.raises(RuntimeError):
+        table.run(chunks, job)
+    assert job.checkpoint["target"] == "sales"
+
+    table.fail_after = None
+    assert table.run(chunks, new_job(job.checkpoint)) == 15
+    assert len(table.rows) == 15
+    assert len({r["jan"] for r in table.rows}) == 15
+
+
+def test_later_duplicate_key_wins():
+    chunks = [
+        pd.DataFrame({"jan": ["a", "b"], "quantity_sold": [1, 2]}),
+        pd.DataFrame({"jan": ["b", "c"], "quantity_sold": [3, 4]}),
+    ]
+    table = FakeTable()
+    assert table.run(chunks, new_job()) == 3
+    assert sorted((r["jan"], r["quantity_sold"]) for r in table.rows) == [("a", 1), ("b", 3), ("c", 4)]
+
+
+def test_empty_upload_raises():
+    with pytest.raises(ValueError):
+        FakeTable().run([], new_job())
+
+
+def test_key_filters_use_is_null_for_missing_values():
+    assert key_filters(["jan"], [("1",), ("2",)]) == [("jan", 'in.("1","2")')]
+    assert key_filters(["jan"], [(None,)]) == [("jan", "is.null")]
+    assert key_filters(["jan"], [("1",), (None,)]) == [("or", '(jan.in.("1"),jan.is.null)')]
+    assert key_filters(["jan", "supplier", "order_lot"], [("1", None, 12)]) == [
+        ("or", '(and(jan.eq."1",supplier.is.null,order_lot.eq."12"))'),
+    ]
+
+
+def test_resume_with_null_supplier_does_not_duplicate_rows():
+    # purchase_data の複合キー。supplier / order_lot が空の行も、再開時に消してから送り直す
+    key_cols = ["jan", "supplier", "order_lot"]
+    chunks = [
+        pd.DataFrame({
+            "jan": ["1", "2", "3", "4"],
+            "supplier": ["A", None, np.nan, "B"],
+            "order_lot": ["12", "6", np.nan, "24"],
+            "price": [100, 200, 300, 400],
+        }),
+        pd.DataFrame({
+            "jan": ["2", "5"],
+            "supplier": [None, "C"],
+            "order_lot": ["6", "1"],
+            "price": [250, 500],
+        }),
+    ]
+    table = FakeTable(fail_after=1, key_cols=key_cols)
+    job = new_job()
+    with pytest.raises(RuntimeError):
+        table.run(chunks, job)
+    assert len(table.rows) == 2
+
+    table.fail_after = None
+    assert table.run(chunks, new_job(job.checkpoint)) == 5
+    assert sorted((r["jan"], r["price"]) for r in table.rows) == [
+        ("1", 100), ("2", 250), ("3", 300), ("4", 400), ("5", 500),
+    ]
@@ -0,0 +1,277 @@
+"""
+アップロードのバックグラウンド実行（ジョブ）
+
+main.py では st.cache_resource で JobManager を1つだけ作る。ジョブはワーカースレッドで動くので、
+ブラウザの再読み込みやスクリプトの再実行では止まらない。
+チャンクを1つ書き込むごとにチェックポイント（JSON）を保存し、失敗したジョブは
+最後に書き込んだチャンクの次から再開できる。プロセスが再起動した場合も、同じファイルを
+もう一度選べば（内容のハッシュから同じジョブ ID になる）チェックポイントから再開する。
+stream_chunks() はチャンクを順に全件入れ替えで書き込む本体（書き込み先の操作は呼び出し側が渡す）。
+ジョブはスクリプトの実行の外で動くので、ジョブの中から st.* は呼ばないこと。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from supabase_client import in_filter, pg_quote
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIR = "/tmp/upload_jobs"
+DEFAULT_MAX_WORKERS = 2
+# 一覧に残す終了済みジョブの数
+KEEP_FINISHED = 20
+# 重複キーを DELETE するときの1リクエストあたりのキー数
+DELETE_BATCH = 100
+
+
+def job_id_for(table: str, data: bytes, mode: str = "") -> str:
+    """テーブル・モード・ファイル内容から決まるジョブ ID"""
+    h = hashlib.sha1(f"{table}:{mode}:".encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()[:16]
+
+
+class UploadJob:
+    def __init__(self, job_id, table, name, run, source, checkpoint=None):
+        """
+        run(job) -> 完了メッセージ（失敗時は例外）。source はアップロードされたファイルの bytes
+        checkpoint: 前回までに書き込みを終えた位置など（{"chunks_done": n, "rows": m, "target": ...}）
+        """
+        self.job_id = job_id
+        self.table = table
+        self.name = name
+        self.run = run
+        self.source = source
+        self.checkpoint = checkpoint or {}
+        # 再開したジョブは、このチャンク数までは書き込み済み
+        self.resumed_from = self.chunks_done
+        self.status = "queued"
+        self.message = None
+        self.error = None
+        self.rows = 0
+        self.bytes = 0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._on_commit = None
+
+    @property
+    def chunks_done(self) -> int:
+        return self.checkpoint.get("chunks_done", 0)
+
+    def add_progress(self, rows: int, nbytes: int):
+        """書き込み済みの行数・バイト数を加算（バッチごとに複数スレッドから呼ばれる）"""
+        with self._lock:
+            self.rows += rows
+            self.bytes += nbytes
+
+    def commit(self, **checkpoint):
+        """チャンクの書き込み完了を記録し、チェックポイントを保存する"""
+        with self._lock:
+            self.checkpoint = checkpoint
+        if self._on_commit:
+            self._on_commit(self)
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def rates(self):
+        """(行/秒, バイト/秒)"""
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return self.rows / elapsed, self.bytes / elapsed
+
+
+class JobManager:
+    def __init__(self, checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    # ---------- 公開 ----------
+    def submit(self, job_id, table, name, run, source) -> UploadJob:
+        """
+        ジョブを投入する。同じ ID のジョブが既にあればそれを返す（再実行のたびに二重投入しない）。
+        保存済みのチェックポイントがあればその続きから始める。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+            job = UploadJob(job_id, table, name, run, source, self._load(job_id))
+            self._start(job)
+            return job
+
+    def resume(self, job_id) -> UploadJob:
+        """失敗したジョブを最後のチェックポイントから再開する"""
+        with self._lock:
+            old = self._jobs[job_id]
+            if old.status != "failed":
+                return old
+            job = UploadJob(job_id, old.table, old.name, old.run, old.source, old.checkpoint)
+            self._start(job)
+            return job
+
+    def forget(self, job_id):
+        """ジョブとチェックポイントを消す（同じファイルをもう一度最初からアップロードするとき）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status in ("queued", "running"):
+                return
+            self._jobs.pop(job_id, None)
+            self._remove(job_id)
+
+    def jobs(self):
+        """新しい順"""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.started_at or float("inf"), reverse=True)
+
+    # ---------- 内部 ----------
+    def _start(self, job):
+        job._on_commit = self._save
+        self._jobs[job.job_id] = job
+        self._prune()
+        self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.message = job.run(job)
+            job.status = "done"
+            job.source = None
+            self._remove(job.job_id)
+        except Exception as e:
+            logger.exception("upload job %s failed", job.job_id)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.status in ("done", "failed")]
+        finished.sort(key=lambda j: j.finished_at or 0)
+        for job in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self._jobs[job.job_id]
+
+    def _path(self, job_id):
+        return os.path.join(self.checkpoint_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        path = self._path(job.job_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"job_id": job.job_id, "table": job.table, "name": job.name, **job.checkpoint}, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, job_id):
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return {k: v for k, v in data.items() if k not in ("job_id", "table", "name")}
+
+    def _remove(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+
+def key_filters(key_cols, keys):
+    """
+    キー（タプル）のリスト → DELETE 用の PostgREST フィルタ。
+    欠損（None）は eq では一致しないので is.null で照合する
+    """
+    if len(key_cols) == 1:
+        col = key_cols[0]
+        values = [k[0] for k in keys if k[0] is not None]
+        if len(values) == len(keys):
+            return [(col, in_filter(values))]
+        if not values:
+            return [(col, "is.null")]
+        return [("or", f"({col}.{in_filter(values)},{col}.is.null)")]
+
+    def cond(c, v):
+        return f"{c}.is.null" if v is None else f"{c}.eq.{pg_quote(v)}"
+
+    conds = ["and(" + ",".join(cond(c, v) for c, v in zip(key_cols, k)) + ")" for k in keys]
+    return [("or", "(" + ",".join(conds) + ")")]
+
+
+def stream_chunks(table, chunks, key_cols, job, begin, post, delete_keys, finish, assign_ids=False) -> int:
+    """
+    前処理済みのチャンク（DataFrame のイテレータ）を全件入れ替えで順に書き込む。
+    次のチャンクの読み込みと前のチャンクの POST は並行。同じキーは後の行を残す。
+    チャンクの POST が終わるたびに job にチェックポイントを保存し、再開時は書き込み済みの
+    チャンクを読み飛ばす（重複排除のキーと id の採番だけ進める）。
+
+    begin() -> 書き込み先 / post(target, df) / delete_keys(target, keys) / finish(target)
+    assign_ids: id 列が無ければ 1 からの連番を振る（item_master）
+    戻り値: 件数（失敗・データなしは例外）
+    """
+    done = job.checkpoint.get("chunks_done", 0)
+    target = job.checkpoint.get("target")
+    seen = set()
+    next_id = 1
+    total = 0
+    pending = None
+
+    def wait_pending():
+        future, n, rows = pending
+        future.result()
+        job.commit(target=target, chunks_done=n + 1, rows=rows)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for n, chunk in enumerate(chunks):
+            chunk = chunk.drop_duplicates(subset=key_cols, keep="last")
+            if assign_ids and "id" not in chunk.columns:
+                chunk.insert(0, "id", range(next_id, next_id + len(chunk)))
+                next_id += len(chunk)
+
+            # 欠損は None に揃える（NaN 同士は等しくならず、重複キーを検出できない）
+            key_frame = chunk[key_cols].astype(object)
+            keys = list(key_frame.where(key_frame.notna(), None).itertuples(index=False, name=None))
+            dup_keys = [k for k in keys if k in seen]
+            seen.update(keys)
+            total += len(chunk) - len(dup_keys)
+            if n < done:
+                # 前回までに書き込み済み
+                continue
+
+            # 前のチャンクの POST 完了を待つ
+            if pending is not None:
+                wait_pending()
+
+            if target is None:
+                target = begin()
+                job.commit(target=target, chunks_done=0, rows=0)
+            elif n == done:
+                # 中断したチャンクは途中まで書かれているかもしれないので、そのキーを消してから送り直す
+                # （最初のチャンクで中断した場合も。id の無い sales などは merge-duplicates で重複が消えない）
+                dup_keys = keys
+
+            # 前のチャンクで送ったキーが再登場したら、後の行を残すため先に消す
+            for i in range(0, len(dup_keys), DELETE_BATCH):
+                delete_keys(target, dup_keys[i:i + DELETE_BATCH])
+
+            pending = (executor.submit(post, target, chunk), n, total)
+
+        if pending is not None:
+            wait_pending()
+        elif target is None:
+            raise ValueError(f"⚠️ {table} のデータ行がありません")
+
+    finish(target)
+    return total